@@ -0,0 +1,83 @@
+# Compares the box index of the incremental caches with the nested interval trees it replaced, on
+# random boxes. Needs intervaltree, see requirements-dev.txt.
+#
+#   python bench_box_index.py [--boxes 1000 10000] [--dims 2 6 12] [--queries 1000]
+
+import argparse
+import timeit
+import tracemalloc
+
+import numpy as np
+from intervaltree import IntervalTree
+
+from verse.analysis.box_index import BoxIndex
+
+
+class NestedIntervalTrees:
+    """One level of interval trees per dimension, as the caches used to store their entries"""
+
+    def __init__(self):
+        self.tree = IntervalTree()
+
+    def add(self, lows, highs, data):
+        tree = self.tree
+        for i, (low, high) in enumerate(zip(lows, highs)):
+            next_level = data if i == len(lows) - 1 else IntervalTree()
+            tree[low:high] = next_level
+            tree = next_level
+
+    def query(self, lows, highs):
+        def query(tree, dim):
+            low, high = lows[dim], highs[dim]
+            entries = [t.data for t in tree[low:high] if t.begin <= low and high <= t.end]
+            if dim == len(lows) - 1:
+                return entries
+            return [ent for t in entries for ent in query(t, dim + 1)]
+
+        return query(self.tree, 0)
+
+
+def bench(index, boxes, queries):
+    tracemalloc.start()
+    start = timeit.default_timer()
+    for i, (low, high) in enumerate(zip(*boxes)):
+        index.add(low, high, i)
+    build = timeit.default_timer() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = timeit.default_timer()
+    hits = sum(len(index.query(low, high)) for low, high in zip(*queries))
+    query = timeit.default_timer() - start
+    return build, query, memory, hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boxes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--dims", type=int, nargs="+", default=[2, 6, 12])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    print(
+        f"{'boxes':>6} {'dims':>4} {'index':>8} {'build s':>8} "
+        f"{'query ms':>9} {'MB':>7} {'hits':>7}"
+    )
+    for n in args.boxes:
+        for d in args.dims:
+            # Boxes of initial sets around a few reference points, like in repeated experiments
+            centers = rng.uniform(0, 100, (n, d))
+            widths = rng.uniform(0.5, 2, (n, d))
+            boxes = centers - widths, centers + widths
+            picked = centers[rng.integers(n, size=args.queries)]
+            queries = picked - 0.2, picked + 0.2
+            for name, index in (("trees", NestedIntervalTrees()), ("box", BoxIndex(d))):
+                build, query, memory, hits = bench(index, boxes, queries)
+                ms = query / args.queries * 1000
+                print(
+                    f"{n:>6} {d:>4} {name:>8} {build:>8.3f} "
+                    f"{ms:>9.4f} {memory / 1e6:>7.2f} {hits:>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Tests for the batched simulation of agents
+import math
+import os
+import unittest
+
+import numpy as np
+
+from verse import BaseAgent
+
+CONTROLLER = os.path.join(
+    os.path.realpath(os.path.dirname(__file__)), "./test_controller/ball_controller2.py"
+)
+
+
+class VanDerPolAgent(BaseAgent):
+    def __init__(self, id):
+        super().__init__(id, file_name=CONTROLLER)
+
+    def dynamics(self, t, state):
+        x, y = state
+        return [y, (1 - x**2) * y - x]
+
+
+class PendulumAgent(BaseAgent):
+    # math.sin doesn't broadcast, so the batch falls back to TC_simulate per init
+    def __init__(self, id):
+        super().__init__(id, file_name=CONTROLLER)
+
+    def dynamics(self, t, state):
+        theta, omega = state
+        return [omega, -math.sin(theta)]
+
+
+class TestSimulateBatch(unittest.TestCase):
+    def setUp(self):
+        self.inits = np.random.default_rng(0).uniform(-1, 1, (5, 2))
+
+    def check(self, agent, mode="Normal", **tol):
+        batch = agent.TC_simulate_batch(mode, self.inits, 3, 0.05)
+        self.assertEqual(batch.shape, (5, 61, 3))
+        for init, trace in zip(self.inits, batch):
+            expected = agent.TC_simulate(mode, init.tolist(), 3, 0.05)
+            np.testing.assert_allclose(trace, expected, **tol)
+
+    def test_stacked(self):
+        agent = VanDerPolAgent("vdp")
+        self.check(agent, rtol=1e-5, atol=1e-6)
+        self.assertEqual(agent._batch_dynamics_ok, {"Normal": True})
+
+    def test_fallback(self):
+        agent = PendulumAgent("pendulum")
+        self.check(agent, rtol=0, atol=0)
+        self.assertEqual(agent._batch_dynamics_ok, {"Normal": False})
+
+    def test_per_mode(self):
+        # Each mode is checked on its first batch, modes as lists are keyed as tuples
+        agent = VanDerPolAgent("vdp")
+        self.check(agent, rtol=1e-5, atol=1e-6)
+        self.check(agent, ["Normal", "Lane0"], rtol=1e-5, atol=1e-6)
+        self.assertEqual(agent._batch_dynamics_ok, {"Normal": True, ("Normal", "Lane0"): True})
+
+
+if __name__ == "__main__":
+    unittest.main()
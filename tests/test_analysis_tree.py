@@ -0,0 +1,88 @@
+# Tests for saving and loading analysis trees
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ball_bounce_test import BallAgent, BallMode
+from verse import Scenario, ScenarioConfig
+from verse.analysis import AnalysisTree
+from verse.analysis.analysis_tree import _iter_json_items
+
+CONTROLLER = os.path.join(
+    os.path.realpath(os.path.dirname(__file__)), "./test_controller/ball_controller2.py"
+)
+
+
+def ball_scenario(**config) -> Scenario:
+    scenario = Scenario(ScenarioConfig(**{"parallel": False, "print_level": 0, **config}))
+    scenario.add_agent(BallAgent("green-ball", file_name=CONTROLLER))
+    scenario.set_init([[[15, 1, 1, -2], [15.5, 1.5, 1, -2]]], [(BallMode.Normal,)])
+    return scenario
+
+
+class TestAnalysisTreeDump(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.trees = [
+            ball_scenario().simulate(3, 0.1),
+            ball_scenario(trace_dtype=np.float32).verify(3, 0.1),
+        ]
+
+    def assertSameTree(self, tree: AnalysisTree, loaded: AnalysisTree):
+        self.assertEqual(len(tree.nodes), len(loaded.nodes))
+        for node, other in zip(tree.nodes, loaded.nodes):
+            # Modes come back as lists
+            self.assertEqual(
+                (node.id, node.start_time, node.height, [c.id for c in node.child]),
+                (other.id, other.start_time, other.height, [c.id for c in other.child]),
+            )
+            self.assertEqual({a: list(m) for a, m in node.mode.items()}, other.mode)
+            for aid, trace in node.trace.items():
+                self.assertTrue(np.array_equal(trace, other.trace[aid]))
+
+    def test_json(self):
+        for tree in self.trees:
+            path = os.path.join(self.dir, "tree.json")
+            tree.dump(path)
+            self.assertSameTree(tree, AnalysisTree.load(path))
+
+    def test_json_stream(self):
+        tree = self.trees[1]
+        path = os.path.join(self.dir, "tree.json")
+        tree.dump(path)
+        with open(path) as f:
+            data = json.load(f)
+        with open(path) as f:
+            self.assertEqual(dict(_iter_json_items(f, chunk_size=7)), data)
+        parents = {n.id: p for n, p, _ in AnalysisTree.iter_load(path)}
+        self.assertEqual(parents, {**{c.id: n.id for n in tree.nodes for c in n.child}, 0: None})
+        # Dumps that were written as a single dict
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+        self.assertSameTree(tree, AnalysisTree.load(path))
+
+    def test_json_stream_scalars(self):
+        # Numbers cut by the end of a chunk, at every offset
+        data = {"a": 12345, "b": -1.5e-3, "c": True, "d": None, "e": "x", "f": [1, 22]}
+        src = json.dumps(data)
+        for chunk_size in range(1, len(src) + 1):
+            items = dict(_iter_json_items(io.StringIO(src), chunk_size=chunk_size))
+            self.assertEqual(items, data, chunk_size)
+        items = _iter_json_items(io.StringIO('{"a": 12345, "b": 1}'), chunk_size=7)
+        self.assertEqual(dict(items), {"a": 12345, "b": 1})
+
+    def test_binary(self):
+        for tree in self.trees:
+            path = os.path.join(self.dir, str(tree.type))
+            tree.dump_binary(path)
+            loaded = AnalysisTree.load_binary(path)
+            self.assertTrue(all(n._load_trace != None for n in loaded.nodes))
+            self.assertSameTree(tree, loaded)
+            trace = loaded.root.trace["green-ball"]
+            self.assertIsInstance(trace.base, np.memmap)
+            self.assertEqual(trace.dtype, tree.root.trace["green-ball"].dtype)
+            self.assertSameTree(tree, AnalysisTree.load_binary(path, mmap=False))
@@ -0,0 +1,30 @@
+from enum import Enum, auto
+import copy
+
+class BallMode(Enum):
+    Normal = auto()
+    Wall = auto()
+    Floor = auto()
+
+class State:
+    x: float
+    y = 0.0
+    vx = 0.0
+    vy = 0.0
+    mode: BallMode
+
+    def __init__(self, x, y, vx, vy, ball_mode: BallMode):
+        pass
+
+def decisionLogic(ego: State):
+    output = copy.deepcopy(ego)
+    if ego.mode != BallMode.Wall and ego.x > 20:
+        output.mode = BallMode.Wall
+        output.vx = -ego.vx
+        output.x = 20
+    if ego.mode == BallMode.Normal and ego.y < 0:
+        output.mode = BallMode.Floor
+        output.vy = -ego.vy
+        output.y = 0
+    assert ego.vx > 0, "Wall hit"
+    return output
@@ -0,0 +1,63 @@
+# Tests for the DryVR discrepancy computation
+import unittest
+
+import numpy as np
+from scipy import spatial
+
+from verse.analysis import dryvr, dryvr_disc
+from verse.analysis.dryvr import _SMALL_EPSILON, all_sensitivities_calc
+
+
+def loop_sensitivities_calc(training_traces, initial_radii):
+    # Reference per dimension and time step implementation
+    num_traces, trace_len, ndims = training_traces.shape
+    normalizing_initial_set_radii = initial_radii.copy()
+    y_points = np.zeros((normalizing_initial_set_radii.shape[0], trace_len - 1))
+    normalizing_initial_set_radii[np.where(normalizing_initial_set_radii == 0)] = 1.0
+    for cur_dim_ind in range(1, ndims):
+        normalized_initial_points = training_traces[:, 0, 1:] / normalizing_initial_set_radii
+        initial_distances = (
+            spatial.distance.pdist(normalized_initial_points, "chebyshev") + _SMALL_EPSILON
+        )
+        for cur_time_ind in range(1, trace_len):
+            y_points[cur_dim_ind - 1, cur_time_ind - 1] = np.max(
+                (
+                    spatial.distance.pdist(
+                        np.reshape(training_traces[:, cur_time_ind, cur_dim_ind], (num_traces, 1)),
+                        "chebychev",
+                    )
+                    / normalizing_initial_set_radii[cur_dim_ind - 1]
+                )
+                / initial_distances
+            )
+    return y_points
+
+
+class TestDryVR(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.traces = rng.normal(size=(11, 300, 7))
+        self.traces[:, :, 0] = np.arange(300) * 0.1
+        self.radii = np.abs(rng.normal(size=6))
+        self.radii[2] = 0
+
+    def testSensitivitiesParity(self):
+        expected = loop_sensitivities_calc(self.traces, self.radii)
+        np.testing.assert_array_equal(all_sensitivities_calc(self.traces, self.radii), expected)
+        np.testing.assert_array_equal(
+            dryvr_disc.all_sensitivities_calc(self.traces, self.radii), expected
+        )
+
+    def testSensitivitiesChunked(self):
+        expected = loop_sensitivities_calc(self.traces, self.radii)
+        chunk_size = dryvr._SENSITIVITY_CHUNK_SIZE
+        dryvr._SENSITIVITY_CHUNK_SIZE = 1000
+        try:
+            result = all_sensitivities_calc(self.traces, self.radii)
+        finally:
+            dryvr._SENSITIVITY_CHUNK_SIZE = chunk_size
+        np.testing.assert_array_equal(result, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+# Tests for the interval prefilter of continuous guards, the z3 guard compiler, the vectorized
+# simulation guards and guard evaluation leaving the parsed guards alone
+import ast
+import copy
+import os
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import z3
+
+from verse.agents.example_agent import CarAgent
+from verse.analysis.verifier import Verifier
+from verse.automaton import GuardExpressionAst
+from verse.map.example_map.map_tacas import M3
+from verse.parser import unparse
+from verse.parser.parser import Reduction, ReductionType, VEC_ENV, compile_expr, compile_vec_expr
+from verse.sensor import BaseSensor
+
+GUARDS = [
+    "ego.x > 1.5",
+    "ego.x - ego.y <= 0.5",
+    "ego.x * ego.y < 2",
+    "ego.y ** 2 >= 1",
+    "ego.x / ego.y > 1",
+    "not (ego.x < 1)",
+    "ego.x > 1 and ego.y < 0",
+    "ego.x > 2 or -ego.y > 1",
+]
+
+
+def guard(src):
+    return GuardExpressionAst([ast.parse(src).body[0].value])
+
+
+class TestGuardInterval(unittest.TestCase):
+    def test_consistent_with_z3(self):
+        rng = np.random.default_rng(0)
+        for src in GUARDS:
+            for _ in range(20):
+                lo = rng.uniform(-3, 3, 2)
+                hi = lo + rng.uniform(0, 2, 2)
+                cont = {"ego.x": [lo[0], hi[0]], "ego.y": [lo[1], hi[1]]}
+                result = guard(src).evaluate_guard_interval(cont)
+                if result is None:
+                    continue
+                may, must = result
+                sat, contained = guard(src)._evaluate_guard_cont(None, cont, None, False)
+                if not may:
+                    self.assertFalse(sat, (src, cont))
+                if must:
+                    self.assertTrue(contained, (src, cont))
+
+    def test_array_bounds(self):
+        lo = np.array([[0.0, 1.0, 2.0], [-1.0, -1.0, 0.5]])
+        hi = lo + 0.5
+        cont = {"ego.x": (lo[0], hi[0]), "ego.y": (lo[1], hi[1])}
+        for src in GUARDS:
+            may, must = guard(src).evaluate_guard_interval(cont)
+            for i in range(lo.shape[1]):
+                one = {k: (v[0][i], v[1][i]) for k, v in cont.items()}
+                self.assertEqual(guard(src).evaluate_guard_interval(one), (may[i], must[i]))
+
+    def test_unsupported(self):
+        self.assertIsNone(guard("abs(ego.x) > 1").evaluate_guard_interval({"ego.x": [0, 1]}))
+
+    def test_unbounded(self):
+        # 1 / y spans (-inf, inf) and 0 * inf is NaN, neither may rule the guard out
+        cont = {"ego.x": [0, 1], "ego.y": [-1, 1]}
+        for src in ("ego.x / ego.y > 1", "ego.x * (1 / ego.y) > 0.5"):
+            self.assertIsNone(guard(src).evaluate_guard_interval(cont), src)
+            self.assertTrue(guard(src)._evaluate_guard_cont(None, cont, None, False)[0], src)
+
+
+class TestSolverReuse(unittest.TestCase):
+    def test_no_leaked_constraints(self):
+        rng = np.random.default_rng(1)
+        for src in GUARDS:
+            compiled = None
+            for _ in range(20):
+                lo = rng.uniform(-3, 3, 2)
+                hi = lo + rng.uniform(0, 2, 2)
+                cont = {"ego.x": [lo[0], hi[0]], "ego.y": [lo[1], hi[1]]}
+                g = guard(src)
+                res = g._evaluate_guard_cont(None, cont, None, False)
+                compiled = g._compile(None, cont)
+                # Same answers as fresh solvers
+                x, y = z3.Real("ego_x"), z3.Real("ego_y")
+                box = [x >= lo[0], x <= hi[0], y >= lo[1], y <= hi[1]]
+                solver = z3.Solver()
+                solver.add(compiled.expr, *box)
+                sat = solver.check() == z3.sat
+                solver = z3.Solver()
+                solver.add(z3.Not(compiled.expr), *box)
+                contained = sat and solver.check() == z3.unsat
+                self.assertEqual(res, (sat, contained), (src, cont))
+            # Only the guard itself stays on the shared solvers
+            self.assertEqual(len(compiled.solver.assertions()), 1)
+            self.assertEqual(len(compiled.neg_solver.assertions()), 1)
+            self.assertEqual(compiled.solver.num_scopes(), 0)
+
+    def test_pop_on_error(self):
+        g = guard("ego.x > 1.5")
+        g._evaluate_guard_cont(None, {"ego.x": [0, 1]}, None, False)
+        compiled = g._compile(None, {"ego.x": [0, 1]})
+        with self.assertRaises(z3.Z3Exception):
+            g._evaluate_guard_cont(None, {"ego.x": [0, None]}, None, False)
+        self.assertEqual(compiled.solver.num_scopes(), 0)
+        self.assertEqual(g._evaluate_guard_cont(None, {"ego.x": [2, 3]}, None, False), (True, True))
+
+
+def equivalent(a, b) -> bool:
+    solver = z3.Solver()
+    solver.add(a != b)
+    return solver.check() == z3.unsat
+
+
+class TestZ3Compiler(unittest.TestCase):
+    CONT = {"ego.x": [0, 1], "ego.y": [0, 1], "others_0.x": [0, 1], "others_1.x": [0, 1]}
+
+    def test_same_as_string_path(self):
+        for src in GUARDS + ["ego.x > 1 or True", "not (1 < 2)"]:
+            g = guard(src)
+            compiled = g._compile(None, self.CONT)
+            for var in self.CONT:
+                g.cont_variables[var] = var.replace(".", "_")
+            z3_string = g.generate_z3_expression()
+            if isinstance(z3_string, bool):
+                self.assertEqual(compiled, z3_string, src)
+                continue
+            expected = g._build_guard(z3_string, None)
+            if isinstance(compiled, bool):
+                # Constant comparisons are folded too
+                self.assertTrue(equivalent(z3.BoolVal(compiled), expected.expr), src)
+                continue
+            self.assertTrue(equivalent(compiled.expr, expected.expr), src)
+            self.assertTrue(set(compiled.symbols.items()) <= set(expected.symbols.items()), src)
+
+    def test_chained_compare(self):
+        # The string path can't handle these, z3 terms can't be chained
+        x, y = z3.Real("ego_x"), z3.Real("ego_y")
+        compiled = guard("-1 < ego.x - ego.y < 1")._compile(None, self.CONT)
+        self.assertTrue(equivalent(compiled.expr, z3.And(-1 < x - y, x - y < 1)))
+
+    def test_reduction(self):
+        expr = ast.parse("o.x > ego.x").body[0].value
+        others = ast.Name("others", ctx=ast.Load())
+        x, o0, o1 = (z3.Real(n) for n in ("ego_x", "others_0_x", "others_1_x"))
+        g = GuardExpressionAst([Reduction(ReductionType.Any, expr, "o", others)])
+        self.assertTrue(equivalent(g._compile(None, self.CONT).expr, z3.Or(o0 > x, o1 > x)))
+        total = Reduction(ReductionType.Sum, expr.left, "o", others)
+        g = GuardExpressionAst([ast.Compare(total, [ast.Gt()], [ast.Constant(1)])])
+        self.assertTrue(equivalent(g._compile(None, self.CONT).expr, o0 + o1 > 1))
+
+    def test_unsupported(self):
+        # Calls are left to the string path
+        g = guard("abs(ego.x) > 1")
+        for var in self.CONT:
+            g.cont_variables[var] = var.replace(".", "_")
+        x = z3.Real("ego_x")
+        self.assertTrue(equivalent(g._compile(None, self.CONT).expr, z3.Or(x > 1, x < -1)))
+
+
+SIM_CONDS = GUARDS + [
+    "-1 < ego.x - ego.y < 1",
+    "any(o.x > ego.x for o in others)",
+    "all(o.y <= ego.y or not o.x > 1 for o in others)",
+    "ego.mode == 'Normal' and not any(-1 < o.x - ego.x < 1 for o in others)",
+    "abs(ego.x) > 1 and ego.y < 1",
+    "not (abs(ego.x) > 1) or ego.y < 1",
+]
+
+
+class TestVectorizedCond(unittest.TestCase):
+    def test_over_approximates(self):
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-3, 3, (2, 50))
+        others = [rng.uniform(-3, 3, (2, 50)) for _ in range(2)]
+        env = {
+            "ego": SimpleNamespace(x=x, y=y, mode="Normal"),
+            "others": [SimpleNamespace(x=ox, y=oy) for ox, oy in others],
+        }
+        for src in SIM_CONDS:
+            e = ast.parse(src).body[0].value
+            vec = compile_vec_expr(e)
+            self.assertIsNotNone(vec, src)
+            hits = np.broadcast_to(eval(vec, dict(env, **VEC_ENV)), x.shape)
+            for i in range(len(x)):
+                one = {
+                    "ego": SimpleNamespace(x=x[i], y=y[i], mode="Normal"),
+                    "others": [SimpleNamespace(x=ox[i], y=oy[i]) for ox, oy in others],
+                }
+                if eval(compile_expr(e), one):
+                    self.assertTrue(hits[i], (src, i))
+                elif "abs" not in src:
+                    self.assertFalse(hits[i], (src, i))
+
+    def test_unsupported(self):
+        self.assertIsNone(compile_vec_expr(ast.parse("abs(ego.x) > 1").body[0].value))
+
+
+def highway_guards():
+    controller = os.path.join(
+        os.path.realpath(os.path.dirname(__file__)), "./test_controller/example_controller5.py"
+    )
+    agent = CarAgent("car1", file_name=controller)
+    track_map = M3()
+    # car2 is 3.5 to 4.5 ahead in the same lane, so the lane switches may be taken
+    state_dict = {
+        "car1": ([[0, 5, -0.5, 0, 1], [0, 5.5, 0.5, 0, 1]], ("Normal", "T1"), []),
+        "car2": ([[0, 9, -0.2, 0, 1], [0, 9.5, 0.2, 0, 1]], ("Normal", "T1"), []),
+    }
+    cont, disc, len_dict = BaseSensor().sense(agent, state_dict, track_map, False)
+    return agent, track_map, cont, disc, len_dict
+
+
+class TestNonMutating(unittest.TestCase):
+    def test_evaluation_keeps_asts(self):
+        agent, track_map, cont, disc, len_dict = highway_guards()
+        checked = 0
+        for path in agent.decision_logic.paths:
+            parsed = ast.dump(path.cond_veri)
+            res = Verifier.eval_guard_disc(None, agent, path, dict(cont), disc, len_dict, track_map)
+            self.assertEqual(ast.dump(path.cond_veri), parsed)
+            if res is None:
+                continue
+            guard_expression, cont_var_updater, disc_vars = res
+            unrolled = [ast.dump(node) for node in guard_expression.ast_list]
+            results = []
+            for _ in range(2):
+                one_step_guard = copy.copy(guard_expression)
+                cont_vars = dict(cont)
+                Verifier.apply_cont_var_updater(cont_vars, cont_var_updater)
+                if one_step_guard.evaluate_guard_hybrid(
+                    agent, disc_vars, cont_vars, track_map, False
+                ):
+                    results.append(
+                        one_step_guard.evaluate_guard_cont(agent, cont_vars, track_map, False)
+                    )
+                    checked += 1
+                self.assertEqual([ast.dump(node) for node in guard_expression.ast_list], unrolled)
+            self.assertEqual(ast.dump(path.cond_veri), parsed)
+            self.assertEqual(results[:1], results[1:])
+        self.assertGreater(checked, 0)
+
+
+class TestGuardCache(unittest.TestCase):
+    def test_hits(self):
+        agent, track_map, cont, disc, len_dict = highway_guards()
+        guard_cache = {}
+
+        def eval_guard_disc(path):
+            # Unrolling adds to the sensed dicts, which the verifier senses for every path
+            return Verifier.eval_guard_disc(
+                guard_cache, agent, path, dict(cont), dict(disc), len_dict, track_map
+            )
+
+        fresh = [eval_guard_disc(path) for path in agent.decision_logic.paths]
+        self.assertEqual(len(guard_cache), len(fresh))
+        # Only the lane switches from Normal can fire, the paths back to Normal are ruled out
+        possible = [path for path, res in zip(agent.decision_logic.paths, fresh) if res]
+        self.assertEqual(len(possible), 4)
+        self.assertTrue(all("Normal" not in unparse(path.val_veri) for path in possible))
+        for path, res in zip(agent.decision_logic.paths, fresh):
+            if res is None:
+                self.assertIsNone(eval_guard_disc(path))
+                continue
+            unrolled = [ast.dump(node) for node in res[0].ast_list]
+            hit = eval_guard_disc(path)
+            self.assertIsNot(hit[0], res[0])
+            self.assertEqual((hit[1], hit[2]), (res[1], res[2]))
+            # Evaluating the returned guard doesn't change what the next hit returns
+            cont_vars = dict(cont)
+            Verifier.apply_cont_var_updater(cont_vars, hit[1])
+            hit[0].evaluate_guard_hybrid(agent, hit[2], cont_vars, track_map, False)
+            hit[0].evaluate_guard_cont(agent, cont_vars, track_map, False)
+            hit = eval_guard_disc(path)
+            self.assertEqual([ast.dump(node) for node in hit[0].ast_list], unrolled)
+        self.assertEqual(len(guard_cache), len(fresh))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Tests for the box index and the bounded incremental caches
+import unittest
+
+import numpy as np
+
+from test_analysis_tree import ball_scenario
+from verse.analysis.box_index import BoxIndex
+from verse.analysis.incremental import EvictionPolicy, TubeCache, entry_nbytes
+
+
+def box(x):
+    return [[x, 0], [x + 1, 1]]
+
+
+class TestBoxIndex(unittest.TestCase):
+    def test_same_as_brute_force(self):
+        rng = np.random.default_rng(0)
+        lows = rng.uniform(0, 5, (200, 6))
+        highs = lows + rng.uniform(2, 8, (200, 6))
+        index = BoxIndex(6, capacity=1)
+        for i, (low, high) in enumerate(zip(lows, highs)):
+            index.add(low, high, i)
+        for i in range(0, 200, 3):
+            index.remove(i)
+        kept = [i for i in range(200) if i % 3 != 0]
+        self.assertEqual(len(index), len(kept))
+        for _ in range(100):
+            low = rng.uniform(1, 8, 6)
+            high = low + rng.uniform(0, 1, 6)
+            expected = [i for i in kept if np.all(lows[i] <= low) and np.all(high <= highs[i])]
+            self.assertEqual(sorted(index.query(low, high)), expected)
+            tightest = index.tightest(low, high)
+            if expected:
+                widths = {i: np.sum(highs[i] - lows[i]) for i in expected}
+                self.assertEqual(widths[tightest], min(widths.values()))
+            else:
+                self.assertIsNone(tightest)
+
+
+class TestBoundedCache(unittest.TestCase):
+    def fill(self, policy) -> TubeCache:
+        cache = TubeCache(max_entries=2, policy=policy)
+        for x in (0, 10):
+            cache.add_tube("car", ("Normal",), box(x), np.zeros((4, 3)))
+        cache.check_hit("car", ("Normal",), box(0))
+        cache.check_hit("car", ("Normal",), box(0))
+        cache.check_hit("car", ("Normal",), box(10))
+        cache.add_tube("car", ("Normal",), box(20), np.zeros((4, 3)))
+        return cache
+
+    def test_lru(self):
+        cache = self.fill(EvictionPolicy.LRU)
+        self.assertIsNone(cache.check_hit("car", ("Normal",), box(0)))
+        self.assertIsNotNone(cache.check_hit("car", ("Normal",), box(10)))
+        self.assertEqual((cache.stats.evictions, cache.stats.entries), (1, 2))
+
+    def test_lfu(self):
+        cache = self.fill(EvictionPolicy.LFU)
+        self.assertIsNotNone(cache.check_hit("car", ("Normal",), box(0)))
+        self.assertIsNone(cache.check_hit("car", ("Normal",), box(10)))
+        self.assertIsNotNone(cache.check_hit("car", ("Normal",), box(20)))
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (5, 1))
+
+    def test_max_bytes(self):
+        tube = np.zeros((100, 5))
+        cache = TubeCache(max_bytes=int(2.5 * entry_nbytes(tube)))
+        for x in range(5):
+            cache.add_tube("car", ("Normal",), box(x * 10), tube.copy())
+        self.assertEqual(cache.stats.entries, 2)
+        self.assertLessEqual(cache.stats.nbytes, cache.max_bytes)
+        self.assertEqual(set(cache.cache.keys()), {("car", "Normal")})
+        cache = TubeCache(max_bytes=1)
+        for x in range(2):
+            cache.add_tube("car", (str(x),), box(0), tube.copy())
+        # Emptied keys are dropped, the latest entry is kept
+        self.assertEqual(list(cache.cache.keys()), [("car", "1")])
+
+    def test_verify(self):
+        scenario = ball_scenario(incremental=True, cache_max_entries=1)
+        trees = [scenario.verify(3, 0.1) for _ in range(2)]
+        self.assertEqual(len(trees[0].nodes), len(trees[1].nodes))
+        stats = scenario.verifier.cache_stats()
+        self.assertGreater(stats["tube"].evictions, 0)
+        self.assertEqual(stats["tube"].entries, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+# Tests for the compiled evaluation of resets
+import ast
+import unittest
+from types import SimpleNamespace
+
+from verse.automaton import ResetExpression
+
+
+def reset(var, src):
+    return ResetExpression((var, ast.parse(src).body[0].value))
+
+
+class TestResetExpression(unittest.TestCase):
+    def test_cont_bounds(self):
+        cont = {"ego.x": [1.0, 2.0], "ego.xv": [-1.0, 3.0], "ego.y": [0.0, 0.5]}
+        self.assertEqual(reset("x", "ego.x - 2 * ego.xv").eval_cont_bounds(cont), (-5.0, 4.0))
+        self.assertEqual(reset("x", "ego.x * ego.y").eval_cont_bounds(cont), (0.0, 1.0))
+        self.assertEqual(reset("x", "0").eval_cont_bounds(cont), (0.0, 0.0))
+        self.assertEqual(reset("x", "min(ego.x, ego.y)").eval_cont_bounds(cont), (0.0, 0.5))
+
+    def test_interval_bounds(self):
+        cont = {f"ego.x{i}": [0.0, 1.0] for i in range(20)}
+        src = " + ".join(f"ego.x{i}" for i in range(20))
+        self.assertEqual(reset("x", src).eval_cont_bounds(cont), (0.0, 20.0))
+
+    def test_corner_bounds(self):
+        # min() can't be bounded with intervals, so all 2^14 corners are evaluated
+        cont = {f"ego.x{i}": [-1.0, 1.0] for i in range(14)}
+        src = " + ".join(["min(ego.x0 * ego.x1, 0.5)"] + [f"ego.x{i}" for i in range(2, 14)])
+        with self.assertWarns(UserWarning):
+            self.assertEqual(reset("x", src).eval_cont_bounds(cont), (-13.0, 12.5))
+        src = "min(ego.x0, ego.x1) * max(ego.x2, ego.x3) + " + " * ".join(
+            f"ego.x{i}" for i in range(4, 14)
+        )
+        with self.assertWarns(UserWarning):
+            self.assertEqual(reset("x", src).eval_cont_bounds(cont), (-2.0, 2.0))
+
+    def test_point(self):
+        self.assertEqual(reset("x", "ego.x - ego.xv").eval_point({"ego.x": 3, "ego.xv": 1}), 2)
+
+    def test_mode(self):
+        track_map = SimpleNamespace(h=lambda track, mode, dest: [track + mode + dest])
+        res = reset("track_mode", "track_map.h(ego.track_mode, ego.agent_mode, 'B')").eval_mode(
+            {"ego.track_mode": "T", "ego.agent_mode": "A"}, track_map
+        )
+        self.assertEqual(res, ["TAB"])
+
+
+if __name__ == "__main__":
+    unittest.main()
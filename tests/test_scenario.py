@@ -0,0 +1,288 @@
+# Tests for how scenarios explore the tree: chunked runs, scheduling and stopping early
+import contextlib
+import copy
+import io
+import os
+import unittest
+from enum import Enum, auto
+from unittest import mock
+
+import numpy as np
+
+from ball_bounce_test import BallAgent, BallMode
+from test_analysis_tree import ball_scenario
+from verse import Scenario, ScenarioConfig
+from verse.analysis import AnalysisTree, ExecutionBackend, Simulator, Verifier, shutdown_executors
+from verse.analysis.executor import get_executor
+
+
+def point_scenario(**config):
+    # Crossings don't fall on a sample, so restarting the integration at a chunk boundary can't
+    # move a transition by a step
+    scenario = ball_scenario(**config)
+    scenario.set_init([[[15.05, 1.05, 1, -2], [15.05, 1.05, 1, -2]]], [(BallMode.Normal,)])
+    return scenario
+
+
+def ifexp_scenario():
+    # The same walls, but the conditional expression keeps the guard of the right one from being
+    # vectorized
+    controller = os.path.join(
+        os.path.realpath(os.path.dirname(__file__)),
+        "./test_controller/ball_controller_ifexp.py",
+    )
+    scenario = Scenario(ScenarioConfig(parallel=False, print_level=0))
+    scenario.add_agent(BallAgent("green-ball", file_name=controller))
+    scenario.set_init([[[15.05, 1.05, 1, -2], [15.05, 1.05, 1, -2]]], [(BallMode.Normal,)])
+    return scenario
+
+
+class WallMode(Enum):
+    Normal = auto()
+    Wall = auto()
+    Floor = auto()
+
+
+def wall_scenario() -> Scenario:
+    # Both the wall and the floor are hit from the first node, and every branch hits the assert
+    controller = os.path.join(
+        os.path.realpath(os.path.dirname(__file__)), "./test_controller/ball_controller_assert.py"
+    )
+    scenario = Scenario(ScenarioConfig(parallel=False, print_level=0))
+    scenario.add_agent(BallAgent("ball", file_name=controller))
+    scenario.set_init([[[19.5, 0.9, 1, -2], [19.6, 1.1, 1, -2]]], [(WallMode.Normal,)])
+    return scenario
+
+
+class TestScenario(unittest.TestCase):
+    def assertSameTree(self, tree: AnalysisTree, other: AnalysisTree, **tol):
+        self.assertEqual(len(tree.nodes), len(other.nodes))
+        for node, other_node in zip(tree.nodes, other.nodes):
+            self.assertEqual(
+                (node.id, node.mode, [c.id for c in node.child]),
+                (other_node.id, other_node.mode, [c.id for c in other_node.child]),
+            )
+            self.assertAlmostEqual(node.start_time, other_node.start_time)
+            for agent_id, trace in node.trace.items():
+                np.testing.assert_allclose(trace, other_node.trace[agent_id], **tol)
+                np.testing.assert_allclose(node.init[agent_id], other_node.init[agent_id], **tol)
+
+    def assertContainsTube(self, tube, other):
+        # Each box of `other` is inside the box of `tube` over the same time step
+        boxes = {round(lo[0], 6): (lo[1:], hi[1:]) for lo, hi in zip(tube[::2], tube[1::2])}
+        for lo, hi in zip(other[::2], other[1::2]):
+            outer_lo, outer_hi = boxes[round(lo[0], 6)]
+            np.testing.assert_array_less(outer_lo - 1e-9, lo[1:])
+            np.testing.assert_array_less(hi[1:], outer_hi + 1e-9)
+
+    def test_chunked_verify(self):
+        tree = ball_scenario().verify(10, 0.1)
+        chunked = ball_scenario(chunk_ver_time=1).verify(10, 0.1)
+        self.assertEqual(
+            [(n.id, n.mode, [c.id for c in n.child]) for n in tree.nodes],
+            [(n.id, n.mode, [c.id for c in n.child]) for n in chunked.nodes],
+        )
+        # Chunks start from the last box of the tube so far, which can only loosen it
+        self.assertContainsTube(
+            chunked.nodes[1].trace["green-ball"], tree.nodes[1].trace["green-ball"]
+        )
+
+    def test_chunks_continue(self):
+        horizons = []
+        compute_agent_tube = Verifier.compute_agent_tube
+
+        def spy(config, cached_tubes, node, agent_id, inits, remain_time, *args):
+            horizons.append((node.start_time, remain_time))
+            return compute_agent_tube(
+                config, cached_tubes, node, agent_id, inits, remain_time, *args
+            )
+
+        with mock.patch.object(Verifier, "compute_agent_tube", spy):
+            ball_scenario(chunk_ver_time=1).verify(10, 0.1)
+        # Each chunk extends the tube instead of recomputing it from the initial set
+        for start_time in {start_time for start_time, _ in horizons}:
+            total = sum(h for t, h in horizons if t == start_time)
+            self.assertLessEqual(total, 10 - start_time + 1e-9)
+        self.assertGreater(len(horizons), len({start_time for start_time, _ in horizons}))
+
+    def test_chunked_simulate(self):
+        tree = point_scenario().simulate(20, 0.1)
+        chunked = point_scenario(chunk_sim_time=1).simulate(20, 0.1)
+        self.assertEqual(len(tree.nodes), 4)
+        self.assertSameTree(tree, chunked, rtol=0, atol=1e-10)
+
+    def test_chunked_simulate_on_sample(self):
+        # Both walls are hit right on a sample, where restarting the integration at a chunk
+        # boundary can move a transition by a step
+        trees = []
+        for chunk_sim_time in (None, 1):
+            scenario = ball_scenario(chunk_sim_time=chunk_sim_time)
+            scenario.set_init([[[15, 1, 1, -2], [15, 1, 1, -2]]], [(BallMode.Normal,)])
+            trees.append(scenario.simulate(20, 0.1))
+        tree, chunked = trees
+        self.assertEqual(
+            [(n.id, n.mode, [c.id for c in n.child]) for n in tree.nodes],
+            [(n.id, n.mode, [c.id for c in n.child]) for n in chunked.nodes],
+        )
+        for node, other in zip(tree.nodes, chunked.nodes):
+            self.assertAlmostEqual(node.start_time, other.start_time, delta=0.1 + 1e-9)
+            trace, other_trace = node.trace["green-ball"], other.trace["green-ball"]
+            self.assertAlmostEqual(trace[-1][0], other_trace[-1][0], delta=0.1 + 1e-9)
+            steps = min(len(trace), len(other_trace))
+            np.testing.assert_allclose(trace[:steps, 1:], other_trace[:steps, 1:], atol=0.3)
+
+    def test_partial_vectorization(self):
+        found = []
+        get_guard_candidates = Simulator.get_guard_candidates
+
+        def spy(*args):
+            found.append(get_guard_candidates(*args))
+            return found[-1]
+
+        with mock.patch.object(Simulator, "get_guard_candidates", spy):
+            tree = ifexp_scenario().simulate(20, 0.1)
+        self.assertSameTree(point_scenario().simulate(20, 0.1), tree, rtol=0, atol=0)
+        for candidates, step_guards in found:
+            # The other three guards still narrow the steps down
+            self.assertLess(len(candidates), 200)
+            # One path per variable the right wall resets
+            self.assertEqual([len(g) for g in step_guards.values()], [2])
+
+    def test_guard_candidates(self):
+        # Only checking the candidate steps finds the same hits as checking every step
+        for scenario, time_horizon in ((ball_scenario, 10), (wall_scenario, 3)):
+            found = []
+            get_guard_candidates = Verifier.get_guard_candidates
+
+            def spy(*args):
+                found.append(get_guard_candidates(*args))
+                return found[-1]
+
+            with mock.patch.object(Verifier, "get_guard_candidates", spy):
+                tree = scenario().verify(time_horizon, 0.1)
+            self.assertTrue(all(candidates is not None for candidates in found))
+            with mock.patch.object(Verifier, "get_guard_candidates", return_value=None):
+                full = scenario().verify(time_horizon, 0.1)
+            self.assertSameTree(full, tree, rtol=0, atol=0)
+            for node, other in zip(full.nodes, tree.nodes):
+                self.assertEqual(node.assert_hits, other.assert_hits)
+
+    def test_guard_candidates_fallback(self):
+        # Guards interval arithmetic can't evaluate are checked step by step instead
+        tree = ball_scenario().verify(10, 0.1)
+        found = []
+        get_guard_candidates = Verifier.get_guard_candidates
+
+        def spy(*args):
+            found.append(get_guard_candidates(*args))
+            return found[-1]
+
+        with mock.patch.object(Verifier, "get_guard_candidates", spy), mock.patch(
+            "verse.automaton.guard.GuardExpressionAst.evaluate_guard_interval", return_value=None
+        ):
+            fallback = ball_scenario().verify(10, 0.1)
+        self.assertTrue(found)
+        self.assertTrue(all(candidates is None for candidates in found))
+        self.assertSameTree(tree, fallback, rtol=0, atol=0)
+
+    def test_no_candidates(self):
+        # The floor is only reached after the horizon, so no step needs to be checked
+        found = []
+        get_guard_candidates = Simulator.get_guard_candidates
+
+        def spy(*args):
+            found.append(get_guard_candidates(*args))
+            return found[-1]
+
+        with mock.patch.object(Simulator, "get_guard_candidates", spy):
+            tree = point_scenario().simulate(0.4, 0.1)
+        self.assertEqual(found, [([], {})])
+        self.assertEqual(len(tree.nodes), 1)
+        np.testing.assert_allclose(tree.root.trace["green-ball"][:, 0], [0, 0.1, 0.2, 0.3, 0.4])
+
+    def test_vectorization_errors(self):
+        tree = point_scenario().simulate(20, 0.1)
+        for cond_vec, error in (("undefined < 0", NameError), ("int(ego.x) < 0", TypeError)):
+            scenario = point_scenario(print_level=1)
+            decision_logic = scenario.agent_dict["green-ball"].decision_logic
+            paths = [copy.copy(path) for path in decision_logic.paths]
+            paths[0].cond_vec = compile(cond_vec, "", "eval")
+            with mock.patch.object(decision_logic, "paths", paths):
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    other = scenario.simulate(20, 0.1)
+            # The condition is checked at every step instead
+            self.assertSameTree(tree, other, rtol=0, atol=0)
+            self.assertIn(
+                f"can't vectorize a condition of green-ball: {error.__name__}", out.getvalue()
+            )
+        # Other errors are bugs in the generated code
+        scenario = point_scenario()
+        decision_logic = scenario.agent_dict["green-ball"].decision_logic
+        paths = [copy.copy(path) for path in decision_logic.paths]
+        paths[0].cond_vec = compile("ego.x < 1 / 0", "", "eval")
+        with mock.patch.object(decision_logic, "paths", paths):
+            with self.assertRaises(ZeroDivisionError):
+                scenario.simulate(20, 0.1)
+
+    def test_backends(self):
+        tree = ball_scenario().verify(10, 0.1)
+        sim = point_scenario().simulate(20, 0.1)
+        for backend in (ExecutionBackend.THREAD, ExecutionBackend.PROCESS):
+            config = dict(parallel=True, backend=backend, max_workers=2)
+            self.assertSameTree(tree, ball_scenario(**config).verify(10, 0.1), rtol=0, atol=0)
+            self.assertSameTree(sim, point_scenario(**config).simulate(20, 0.1), rtol=0, atol=0)
+
+    def test_shutdown_executors(self):
+        executor = get_executor(ExecutionBackend.THREAD, 2)
+        shutdown_executors()
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+        # The next run gets a new pool
+        self.assertIsNot(get_executor(ExecutionBackend.THREAD, 2), executor)
+
+    def test_stop_on_first_violation(self):
+        tree = wall_scenario().verify(3, 0.1)
+        self.assertEqual([len(n.child) for n in tree.nodes], [2, 0, 0])
+        stopped = wall_scenario().verify(3, 0.1, stop_on_first_violation=True)
+        # Only the branch to the first violation is kept
+        self.assertEqual([n.id for n in stopped.nodes], [0, 1])
+        self.assertEqual([c.id for c in stopped.root.child], [1])
+        self.assertEqual(stopped.nodes[1].assert_hits["ball"], ["Wall hit"])
+
+    def assertSameNodes(self, tree: AnalysisTree, finished, release=False):
+        nodes = {node.id: (parent_id, node) for parent_id, node in finished}
+        self.assertEqual(set(nodes), {node.id for node in tree.nodes})
+        for node in tree.nodes:
+            parent_id, other = nodes[node.id]
+            self.assertEqual(node.start_time, other.start_time)
+            children = [] if release else [c.id for c in node.child]
+            self.assertEqual([c.id for c in other.child], children)
+            for child in node.child:
+                self.assertEqual(nodes[child.id][0], node.id)
+            for agent_id, trace in node.trace.items():
+                np.testing.assert_array_equal(trace, other.trace[agent_id])
+        self.assertIsNone(nodes[tree.root.id][0])
+
+    def test_iter(self):
+        tree = ball_scenario().verify(10, 0.1)
+        for release in (False, True):
+            scenario = ball_scenario()
+            finished = list(scenario.verify_iter(10, 0.1, release=release))
+            self.assertSameNodes(tree, finished, release)
+            self.assertEqual(len(scenario.verifier.nodes), 0 if release else len(tree.nodes))
+            self.assertEqual(len(scenario.past_runs), 0 if release else 1)
+        tree = point_scenario().simulate(20, 0.1)
+        for release in (False, True):
+            scenario = point_scenario()
+            finished = list(scenario.simulate_iter(20, 0.1, release=release))
+            self.assertSameNodes(tree, finished, release)
+            self.assertEqual(len(scenario.simulator.nodes), 0 if release else len(tree.nodes))
+
+    def test_release_incremental(self):
+        with self.assertRaises(ValueError):
+            next(ball_scenario(incremental=True).verify_iter(10, 0.1, release=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# Tests for the order in which the node queue explores the tree
+import unittest
+
+from verse.analysis.analysis_tree import AnalysisTreeNode, AnalysisTreeNodeType
+from verse.analysis.scheduler import NodeQueue, SearchStrategy, prune_to_violation
+
+
+def node(id, start_time):
+    return AnalysisTreeNode(
+        {}, {}, {}, {}, {}, {}, 0, None, [], start_time, 10, AnalysisTreeNodeType.SIM_TRACE, id
+    )
+
+
+# root -> a, b; a -> a1, a2; b -> b1
+START_TIMES = {"root": 0, "a": 5, "b": 1, "a1": 6, "a2": 2, "b1": 3}
+CHILDREN = {"root": ["a", "b"], "a": ["a1", "a2"], "b": ["b1"]}
+
+
+def explore(queue: NodeQueue):
+    nodes = {name: node(name, t) for name, t in START_TIMES.items()}
+    queue.push(nodes["root"])
+    order = []
+    while len(queue) > 0:
+        n, _ = queue.pop()
+        order.append(n.id)
+        queue.push_children([nodes[c] for c in CHILDREN.get(n.id, [])])
+    return order
+
+
+class TestNodeQueue(unittest.TestCase):
+    def test_strategies(self):
+        expected = {
+            SearchStrategy.DEFAULT: ["root", "a", "a1", "b", "b1", "a2"],
+            SearchStrategy.BFS: ["root", "a", "b", "a1", "a2", "b1"],
+            SearchStrategy.DFS: ["root", "a", "a1", "a2", "b", "b1"],
+            SearchStrategy.EARLIEST_START: ["root", "b", "b1", "a", "a2", "a1"],
+        }
+        for strategy, order in expected.items():
+            self.assertEqual(explore(NodeQueue(strategy)), order, strategy)
+
+    def test_priority(self):
+        # Overrides the strategy, latest start first
+        queue = NodeQueue(SearchStrategy.BFS, priority=lambda n: -n.start_time)
+        self.assertEqual(explore(queue), ["root", "a", "a1", "a2", "b", "b1"])
+
+    def test_prune_to_violation(self):
+        nodes = {name: node(name, t) for name, t in START_TIMES.items()}
+        for name, children in CHILDREN.items():
+            nodes[name].child = [nodes[c] for c in children]
+        queue = NodeQueue()
+        queue.push(nodes["b1"])
+        pending = {"a1"}
+        # a2 hit an assert, b was finished but isn't part of the counterexample
+        prune_to_violation(nodes, queue, pending, nodes["a2"])
+        self.assertEqual(set(nodes), {"root", "a", "a2"})
+        self.assertEqual([c.id for c in nodes["root"].child], ["a"])
+        self.assertEqual([c.id for c in nodes["a"].child], ["a2"])
+        self.assertEqual((len(queue), pending), (0, set()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+# Tests for sensing the other agents
+import os
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from highway_test import AgentMode, TrackMode
+from verse import Scenario, ScenarioConfig
+from verse.agents.example_agent import CarAgent, NPCAgent
+from verse.map.example_map.map_tacas import M3
+from verse.sensor import BaseSensor, ProximitySensor
+from verse.sensor.base_sensor import get_sensor_plan
+from verse.sensor.example_sensor.single_sensor import SingleSensor
+from verse.stars.starset import StarSet
+
+CONTROLLER = os.path.join(
+    os.path.realpath(os.path.dirname(__file__)), "./test_controller/example_controller5.py"
+)
+
+STATE_DICT = {
+    "car1": ([0, 0, 0, 0, 1], ("Normal", "T1"), []),
+    "car2": ([0, 3, 1, 0, 1], ("Normal", "T1"), []),
+    "car3": ([0, 20, 0, 0, 1], ("Normal", "T0"), []),
+    "car4": ([0, -2, -1.5, 0, 1], ("Normal", "T2"), []),
+}
+
+
+def boxes(state_dict):
+    return {
+        aid: ([state, [s + 1 for s in state]], mode, static)
+        for aid, (state, mode, static) in state_dict.items()
+    }
+
+
+def highway_scenario(sensor) -> Scenario:
+    scenario = Scenario(ScenarioConfig(parallel=False, print_level=0))
+    scenario.add_agent(CarAgent("car1", file_name=CONTROLLER))
+    scenario.add_agent(NPCAgent("car2"))
+    scenario.add_agent(NPCAgent("car3"))
+    scenario.set_map(M3())
+    scenario.set_init(
+        [
+            [[5, -0.5, 0, 1.0], [5.5, 0.5, 0, 1.0]],
+            [[20, -0.2, 0, 0.5], [20, 0.2, 0, 0.5]],
+            [[4 - 2.5, 2.8, 0, 1.0], [4.5 - 2.5, 3.2, 0, 1.0]],
+        ],
+        [
+            (AgentMode.Normal, TrackMode.T1),
+            (AgentMode.Normal, TrackMode.T1),
+            (AgentMode.Normal, TrackMode.T0),
+        ],
+    )
+    scenario.set_sensor(sensor)
+    return scenario
+
+
+class TestSensorPlan(unittest.TestCase):
+    def setUp(self):
+        self.ego = CarAgent("car1", file_name=CONTROLLER)
+
+    def test_plan(self):
+        plan = get_sensor_plan(self.ego)
+        self.assertIs(get_sensor_plan(self.ego), plan)
+        cont, disc, _ = plan.ego
+        self.assertEqual(cont, ["ego.x", "ego.y", "ego.theta", "ego.v"])
+        self.assertEqual(disc, ["ego.agent_mode", "ego.track_mode"])
+        self.assertEqual(plan.other_name, "others")
+        self.assertEqual(plan.other[0], ["others.x", "others.y", "others.theta", "others.v"])
+
+    def test_simulate(self):
+        cont, disc, len_dict = BaseSensor().sense(self.ego, STATE_DICT, None)
+        self.assertEqual(len_dict, {"others": 3})
+        self.assertEqual((cont["ego.x"], cont["ego.v"]), (0, 1))
+        self.assertEqual(cont["others.x"], [3, 20, -2])
+        self.assertEqual(cont["others.y"], [1, 0, -1.5])
+        self.assertEqual(disc["ego.track_mode"], "T1")
+        self.assertEqual(disc["others.track_mode"], ["T1", "T0", "T2"])
+
+    def test_verify(self):
+        cont, disc, _ = BaseSensor().sense(self.ego, boxes(STATE_DICT), None, False)
+        self.assertEqual(list(cont["ego.x"]), [0, 1])
+        self.assertEqual([list(b) for b in cont["others.x"]], [[3, 4], [20, 21], [-2, -1]])
+        self.assertEqual(disc["others.agent_mode"], ["Normal"] * 3)
+
+    def test_single(self):
+        # Without stacking, the only other agent is sensed as is
+        state_dict = {aid: STATE_DICT[aid] for aid in ("car1", "car2")}
+        cont, disc, _ = SingleSensor().sense(self.ego, boxes(state_dict), None, False)
+        self.assertEqual(list(cont["others.x"]), [3, 4])
+        self.assertEqual(disc["others.track_mode"], "T1")
+        cont, _, _ = SingleSensor().sense(self.ego, state_dict, None)
+        self.assertEqual(cont["others.x"], [3])
+
+
+class TestProximitySensor(unittest.TestCase):
+    def setUp(self):
+        self.ego = CarAgent("car1", file_name=CONTROLLER)
+        self.state_dict = STATE_DICT
+
+    def test_simulate(self):
+        cont, disc, len_dict = ProximitySensor(5).sense(self.ego, self.state_dict, None)
+        self.assertEqual(len_dict["others"], 2)
+        self.assertEqual(cont["others.x"], [3, -2])
+        self.assertEqual(disc["others.track_mode"], ["T1", "T2"])
+        cont, _, _ = ProximitySensor(1.5, ("y",)).sense(self.ego, self.state_dict, None)
+        self.assertEqual(cont["others.x"], [3, 20, -2])
+
+    def test_verify(self):
+        cont, _, len_dict = ProximitySensor(2).sense(self.ego, boxes(self.state_dict), None, False)
+        self.assertEqual(len_dict["others"], 2)
+        self.assertEqual([list(b) for b in cont["others.x"]], [[3, 4], [-2, -1]])
+
+    def test_stars(self):
+        stars = {
+            aid: ([0, StarSet.rect_to_star(state[1:], [s + 1 for s in state[1:]])], mode, static)
+            for aid, (state, mode, static) in self.state_dict.items()
+        }
+        cont, _, len_dict = ProximitySensor(2).sense(self.ego, stars, None, False)
+        self.assertEqual(len_dict["others"], 2)
+        self.assertIs(cont["others.x"][1], stars["car4"][0][1])
+
+    def test_for_node(self):
+        # car2 only comes within range at the second step, but is sensed at both
+        def tube(*xs):
+            return np.array([[t, x + d, 0, 0, 1] for t, x in enumerate(xs) for d in (0, 1)])
+
+        node = SimpleNamespace(
+            agent={"car1": self.ego, "car2": NPCAgent("car2"), "car3": NPCAgent("car3")},
+            trace={"car1": tube(0, 0), "car2": tube(10, 2), "car3": tube(20, 20)},
+            mode={aid: ("Normal", "T1") for aid in ("car1", "car2", "car3")},
+        )
+        sensor = ProximitySensor(2).for_node(node)
+        self.assertEqual(sensor.sensed, {"car1": {"car2"}})
+        first = {aid: (trace[:2], node.mode[aid], []) for aid, trace in node.trace.items()}
+        _, _, len_dict = ProximitySensor(2).sense(self.ego, first, None, False)
+        self.assertEqual(len_dict["others"], 0)
+        cont, _, len_dict = sensor.sense(self.ego, first, None, False)
+        self.assertEqual(len_dict["others"], 1)
+        self.assertEqual([list(b) for b in cont["others.x"]], [[10, 11]])
+
+    def test_verify_tree(self):
+        # The others sensed at the first step used to be kept for unrolling the guards, and
+        # steps sensing other agents couldn't hit them
+        params = {"bloating_method": "GLOBAL"}
+        tree = highway_scenario(BaseSensor()).verify(40, 0.1, params=params)
+        near = highway_scenario(ProximitySensor(8)).verify(40, 0.1, params=params)
+        self.assertEqual(
+            [(n.start_time, n.mode, len(n.trace["car1"])) for n in near.nodes],
+            [(n.start_time, n.mode, len(n.trace["car1"])) for n in tree.nodes],
+        )
+
+    def test_all_in_range(self):
+        self.assertEqual(
+            ProximitySensor(100).sense(self.ego, self.state_dict, None),
+            BaseSensor().sense(self.ego, self.state_dict, None),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# Tests for the on-disk reach tube store
+import os
+import pickle
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from ball_bounce_test import BallAgent
+from test_analysis_tree import CONTROLLER, ball_scenario
+from verse.analysis.tube_store import TubeStore, tube_key
+
+
+class TestTubeStore(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "tubes.db")
+
+    def test_containment(self):
+        store = TubeStore(self.path)
+        tube = np.arange(12.0).reshape(4, 3)
+        store.put("a", [[0, 0], [2, 2]], tube)
+        store.put("a", [[0, 0], [1, 1]], tube + 1)
+        np.testing.assert_array_equal(store.get("a", [[0.5, 0.5], [1, 1]]), tube + 1)
+        np.testing.assert_array_equal(store.get("a", [[0.5, 0.5], [1.5, 1]]), tube)
+        self.assertIsNone(store.get("a", [[0.5, 0.5], [2.5, 1]]))
+        # Even slightly outside the stored box is a miss
+        self.assertIsNone(store.get("a", [[0.5, 0.5], [np.nextafter(2, 3), 1]]))
+        self.assertIsNone(store.get("b", [[0.5, 0.5], [1, 1]]))
+        # A new connection, as in another worker, sees the same tubes
+        self.assertEqual(len(pickle.loads(pickle.dumps(store))), 2)
+
+    def test_key(self):
+        agent = BallAgent("green-ball", file_name=CONTROLLER)
+        args = (agent, ["Normal"], 3, 0.1, "PW")
+        key = tube_key(*args, SimpleNamespace(width=4), [1], [0.5])
+        self.assertEqual(key, tube_key(*args, SimpleNamespace(width=4), [1], [0.5]))
+        # The map and the parameters of the agent change the tubes
+        self.assertNotEqual(key, tube_key(*args, SimpleNamespace(width=3), [1], [0.5]))
+        self.assertNotEqual(key, tube_key(*args, SimpleNamespace(width=4), [2], [0.5]))
+        self.assertNotEqual(key, tube_key(*args, SimpleNamespace(width=4), [1], [0.6]))
+
+    def test_shared_across_runs(self):
+        tree = ball_scenario(tube_store=self.path).verify(3, 0.1)
+        self.assertGreater(len(TubeStore(self.path)), 0)
+        with mock.patch.object(BallAgent, "TC_simulate", side_effect=AssertionError):
+            with mock.patch.object(BallAgent, "TC_simulate_batch", side_effect=AssertionError):
+                again = ball_scenario(tube_store=self.path).verify(3, 0.1)
+        self.assertEqual(len(tree.nodes), len(again.nodes))
+        for node, other in zip(tree.nodes, again.nodes):
+            np.testing.assert_array_equal(node.trace["green-ball"], other.trace["green-ball"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,11 +2,14 @@
 # Read more from https://docs.python.org/3/library/unittest.html
 
 # A scenario is created for testing
+import os
+import tempfile
 import unittest
-from ball_bounce_test import ball_bounce_test
+import numpy as np
+from ball_bounce_test import BallAgent, BallMode, ball_bounce_test
 from highway_test import highway_test
-from verse import BaseAgent
-from verse.analysis.analysis_tree import AnalysisTreeNodeType
+from verse import BaseAgent, Scenario, ScenarioConfig
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNodeType, cast_tube, tube_boxes
 
 from enum import Enum, auto
 
@@ -82,6 +85,83 @@ class TestSimulatorMethods(unittest.TestCase):
         # assert trace_sim.type == AnalysisTreeNodeType.SIM_TRACE
         # assert trace_veri.type == AnalysisTreeNodeType.REACH_TUBE
 
+    def testEventDetection(self):
+        '''
+        Test that guard crossings are located between samples
+        '''
+        script_dir = os.path.realpath(os.path.dirname(__file__))
+        scenario = Scenario(ScenarioConfig(parallel=False, print_level=0, event_tol=1e-4))
+        ball_controller2 = os.path.join(script_dir, "./test_controller/ball_controller2.py")
+        scenario.add_agent(BallAgent("green-ball", file_name=ball_controller2))
+        scenario.set_init([[[15, 1, 1, -2], [15, 1, 1, -2]]], [(BallMode.Normal,)])
+        trace = scenario.simulate(1, 0.1)
+        # The ball reaches y = 0 at t = 0.5, between the samples at 0.4 and 0.6
+        child = trace.root.child[0]
+        assert 0.5 <= child.start_time <= 0.5 + 1e-4
+        assert child.init["green-ball"][1] == 0
+
+    def testEventHorizon(self):
+        '''
+        Test that traces starting between samples after an event still end at the time horizon
+        '''
+        script_dir = os.path.realpath(os.path.dirname(__file__))
+        scenario = Scenario(ScenarioConfig(parallel=False, print_level=0, event_tol=1e-3))
+        ball_controller2 = os.path.join(script_dir, "./test_controller/ball_controller2.py")
+        agent = BallAgent("green-ball", file_name=ball_controller2)
+        scenario.add_agent(agent)
+        scenario.set_init([[[15, 1, 1, -2], [15, 1, 1, -2]]], [(BallMode.Normal,)])
+        trace = scenario.simulate(20, 0.5)
+        leaf = trace.nodes[-1].trace["green-ball"]
+        assert trace.nodes[-1].start_time % 0.5 != 0
+        assert all(n.trace["green-ball"][-1][0] <= 20 for n in trace.nodes)
+        assert leaf[-1][0] == 20
+        step = 20 - leaf[-2][0]
+        last = agent.TC_simulate(BallMode.Normal, leaf[-2][1:].tolist(), step, step)[-1]
+        assert np.allclose(leaf[-1][1:], last[1:])
+
+    def testReachTubeArrays(self):
+        '''
+        Test that reach tubes are stored as arrays of the configured type
+        '''
+        script_dir = os.path.realpath(os.path.dirname(__file__))
+        scenario = Scenario(ScenarioConfig(parallel=False, print_level=0, trace_dtype=np.float32))
+        ball_controller2 = os.path.join(script_dir, "./test_controller/ball_controller2.py")
+        scenario.add_agent(BallAgent("green-ball", file_name=ball_controller2))
+        scenario.set_init([[[15, 1, 1, -2], [15.5, 1.5, 1, -2]]], [(BallMode.Normal,)])
+        trace = scenario.verify(1, 0.1)
+        for node in trace.nodes:
+            tube = node.trace["green-ball"]
+            assert isinstance(tube, np.ndarray) and tube.dtype == np.float32
+            assert tube_boxes(tube).shape == (len(tube) // 2, 2, 5)
+        path = os.path.join(tempfile.mkdtemp(), "tree.json")
+        trace.dump(path)
+        loaded = AnalysisTree.load(path)
+        assert np.allclose(loaded.root.trace["green-ball"], trace.root.trace["green-ball"])
+
+    def testReachTubeRounding(self):
+        '''
+        Test that float32 reach tubes contain the float64 ones
+        '''
+        script_dir = os.path.realpath(os.path.dirname(__file__))
+        ball_controller2 = os.path.join(script_dir, "./test_controller/ball_controller2.py")
+        trees = []
+        for dtype in (np.float64, np.float32):
+            scenario = Scenario(ScenarioConfig(parallel=False, print_level=0, trace_dtype=dtype))
+            scenario.add_agent(BallAgent("green-ball", file_name=ball_controller2))
+            scenario.set_init([[[15, 1, 1, -2], [15.5, 1.5, 1, -2]]], [(BallMode.Normal,)])
+            trees.append(scenario.verify(3, 0.1))
+        assert len(trees[0].nodes) == len(trees[1].nodes)
+        for node, node32 in zip(trees[0].nodes, trees[1].nodes):
+            boxes = tube_boxes(node.trace["green-ball"])
+            boxes32 = tube_boxes(node32.trace["green-ball"]).astype(float)
+            assert boxes.shape == boxes32.shape
+            assert np.all(boxes32[:, 0] <= boxes[:, 0]) and np.all(boxes32[:, 1] >= boxes[:, 1])
+        tube = np.sort(np.random.default_rng(0).uniform(-100, 100, (200, 2, 5)), axis=1)
+        tube = tube.reshape(-1, 5)
+        boxes32 = tube_boxes(cast_tube(tube, np.float32)).astype(float)
+        assert np.all(boxes32[:, 0] <= tube_boxes(tube)[:, 0])
+        assert np.all(boxes32[:, 1] >= tube_boxes(tube)[:, 1])
+
 
 if __name__ == "__main__":
     unittest.main()
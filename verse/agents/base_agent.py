@@ -11,6 +11,7 @@ class BaseAgent:
     Methods
     -------
     TC_simulate
+    TC_simulate_batch
     """
 
     def __init__(
@@ -91,3 +92,78 @@ class BaseAgent:
         t = t.reshape((-1,1))
         trace = np.hstack((t, trace))
         return trace
+
+    def TC_simulate_batch(self, mode, inits, time_horizon, time_step, map=None):
+        """
+        Simulate the agent from several initial conditions at once
+
+        Agents that keep the default ``TC_simulate`` and whose ``dynamics``
+        broadcasts over a ``(n, N)`` state array are integrated as a single
+        stacked system. Every other agent falls back to calling
+        ``TC_simulate`` once per initial condition.
+
+        Parameters
+        ----------
+            mode: str
+                The current mode to simulate
+            inits: array_like
+                ``(N, n)`` array of initial conditions
+            time_horizon: float
+                The time horizon for simulation
+            time_step: float
+                time_step for performing simulation
+            map: LaneMap, optional
+                Provided if the map is used
+
+        Returns
+        -------
+            ``(N, T, n + 1)`` array of traces, trimmed to a common length
+        """
+        inits = np.array(inits, dtype=float)
+        dynamics = None
+        if type(self).TC_simulate is BaseAgent.TC_simulate:
+            dynamics = self._batch_dynamics(mode, inits)
+        if dynamics is not None:
+            t = np.round(np.arange(0.0, time_horizon + time_step / 2, time_step), 8)
+            num, dim = inits.shape
+            stacked = odeint(
+                func=lambda t, y: self._stacked_dynamics(dynamics, t, y, num, dim),
+                y0=inits.T.reshape(-1),
+                t=t,
+                tfirst=True,
+            )
+            traces = np.empty((num, len(t), dim + 1))
+            traces[:, :, 0] = t
+            traces[:, :, 1:] = stacked.reshape(len(t), dim, num).transpose(2, 0, 1)
+            return traces
+        traces = [
+            np.array(self.TC_simulate(mode, init.tolist(), time_horizon, time_step, map))
+            for init in inits
+        ]
+        trace_len = min(len(trace) for trace in traces)
+        return np.array([trace[:trace_len] for trace in traces])
+
+    @staticmethod
+    def _stacked_dynamics(dynamics, t, y, num, dim):
+        res = dynamics(t, y.reshape(dim, num))
+        return np.array(np.broadcast_arrays(*res, np.empty(num)))[:dim].reshape(-1)
+
+    def _batch_dynamics(self, mode, inits):
+        # The dynamics if they broadcast in `mode`, else None. Checked once per mode against
+        # row-wise evaluation, since dynamics written with math functions or branches won't
+        dynamics = getattr(self, "dynamics", None)
+        if dynamics is None or len(inits) < 2:
+            return None
+        if getattr(self, "_batch_dynamics_ok", None) is None:
+            self._batch_dynamics_ok = {}
+        key = tuple(mode) if isinstance(mode, list) else mode
+        if key not in self._batch_dynamics_ok:
+            num, dim = inits.shape
+            try:
+                batched = self._stacked_dynamics(dynamics, 0.0, inits.T.reshape(-1), num, dim)
+                rows = np.array([dynamics(0.0, init) for init in inits], dtype=float)
+                ok = bool(np.allclose(batched.reshape(dim, num), rows.T))
+            except Exception:
+                ok = False
+            self._batch_dynamics_ok[key] = ok
+        return dynamics if self._batch_dynamics_ok[key] else None
@@ -1,5 +1,8 @@
 from .analysis_tree import *
 from .simulator import Simulator
 from .verifier import Verifier, ReachabilityMethod
+from .executor import ExecutionBackend, shutdown_executors
+from .scheduler import SearchStrategy
+from .incremental import EvictionPolicy
 
 from . import simulator, verifier, analysis_tree
@@ -1,7 +1,20 @@
 from enum import Enum, auto
-from functools import reduce
-from typing import Any, Iterable, List, Dict, Optional, Sequence, TypeVar, Literal
+from functools import partial, reduce
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Literal,
+)
 import json
+import os
 import numpy.typing as nptyp, numpy as np, portion
 import networkx as nx
 from matplotlib import colors
@@ -12,10 +25,92 @@ from verse.analysis.dryvr import _EPSILON
 from verse.agents.base_agent import BaseAgent
 
 TraceType = nptyp.NDArray[np.double]
+"""Trace of a single agent, a contiguous float array with one `[t, x_1, ..., x_n]` row per
+sample. Simulation traces have shape `(T, n+1)`. Rectangular reach tubes have shape `(2T, n+1)`,
+where rows `2i` and `2i+1` are the lower and upper bound of the `i`th box, so that
+`tube_boxes(trace)` is a `(T, 2, n+1)` view of them. Star set tubes are lists of `[t, StarSet]`
+instead."""
 
 _T = TypeVar("_T")
 
 
+def tube_boxes(trace: TraceType) -> TraceType:
+    """View a rectangular reach tube as its `(T, 2, n+1)` boxes, without copying it."""
+    return trace.reshape(-1, 2, trace.shape[-1])
+
+
+def cast_tube(trace: TraceType, dtype) -> TraceType:
+    """Convert a rectangular reach tube to `dtype`, rounding the lower bounds (even rows) down
+    and the upper bounds (odd rows) up, so that each box still contains the original one."""
+    cast = trace.astype(dtype)
+    if cast.dtype == trace.dtype:
+        return cast
+    back = cast.astype(trace.dtype)
+    down, up = np.array(-np.inf, dtype=cast.dtype), np.array(np.inf, dtype=cast.dtype)
+    cast[0::2] = np.where(back[0::2] > trace[0::2], np.nextafter(cast[0::2], down), cast[0::2])
+    cast[1::2] = np.where(back[1::2] < trace[1::2], np.nextafter(cast[1::2], up), cast[1::2])
+    return cast
+
+
+def _iter_json_items(f, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Any]]:
+    """Parse the items of the JSON object in the file "f" one at a time, so only one value is
+    held in memory."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def skip(chars: str) -> bool:
+        # Skip whitespace and `chars`, reading more of the file when needed
+        nonlocal buf, pos, eof
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in chars):
+                pos += 1
+            if pos < len(buf) or eof:
+                return pos < len(buf)
+            buf, pos = f.read(chunk_size), 0
+            eof = len(buf) == 0
+
+    def decode():
+        nonlocal buf, pos, eof
+        size = chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A number cut by the end of the buffer may go on in the next chunk, e.g. "-0"
+                # of "-0.5", so the value is only complete when followed by a delimiter
+                if eof or (end < len(buf) and (buf[end].isspace() or buf[end] in ",:]}")):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # The value isn't complete yet, read more (geometrically so it's linear)
+            more = f.read(size)
+            size *= 2
+            eof = len(more) == 0
+            buf, pos = buf[pos:] + more, 0
+
+    skip("")
+    if buf[pos : pos + 1] != "{":
+        raise ValueError("Expected a JSON object")
+    pos += 1
+    while skip(","):
+        if buf[pos] == "}":
+            return
+        key = decode()
+        skip(":")
+        yield key, decode()
+    raise ValueError("Unterminated JSON object")
+
+
+def _read_traces(data: np.ndarray, slices: Dict[str, List[int]]) -> Dict[str, TraceType]:
+    """Get the traces of a node from the flat array of a binary dump, see
+    `AnalysisTree.dump_binary`"""
+    return {
+        aid: data[offset : offset + int(np.prod(shape))].reshape(shape)
+        for aid, (offset, *shape) in slices.items()
+    }
+
+
 def index_of(l: Iterable[_T], item: _T) -> Optional[int]:
     """Get the index of a item in an iterable. Returns None if not found"""
     for i, v in enumerate(l):
@@ -118,6 +213,23 @@ class AnalysisTreeNode:
         self.id = id
         self.ndigits = ndigits
 
+    @property
+    def trace(self) -> Dict[str, TraceType]:
+        if self._load_trace != None:
+            self._trace, self._load_trace = self._load_trace(), None
+        return self._trace
+
+    @trace.setter
+    def trace(self, trace: Dict[str, TraceType]):
+        self._trace = trace
+        self._load_trace: Optional[Callable[[], Dict[str, TraceType]]] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Lazily loaded traces are read before being sent elsewhere
+        state = self.__dict__.copy()
+        state["_trace"], state["_load_trace"] = self.trace, None
+        return state
+
     @staticmethod
     def root_from_inits(
         init: Dict[str, Sequence[float]],
@@ -170,7 +282,7 @@ class AnalysisTreeNode:
             id=id,
         )
 
-    def _to_dict(self) -> Dict[str, Any]:
+    def _to_dict(self, trace: bool = True) -> Dict[str, Any]:
         rst_dict = {
             "id": self.id,
             "parent": None,
@@ -182,9 +294,7 @@ class AnalysisTreeNode:
             "static": self.static,
             "start_time": self.start_time,
             "trace": (
-                {aid: t.tolist() for aid, t in self.trace.items()}
-                if self.type == AnalysisTreeNodeType.SIM_TRACE
-                else self.trace
+                {aid: np.asarray(t).tolist() for aid, t in self.trace.items()} if trace else {}
             ),
             "type": str(self.type),
             "assert_hits": self.assert_hits,
@@ -223,11 +333,7 @@ class AnalysisTreeNode:
     @staticmethod
     def _from_dict(data: Dict[str, Any]) -> "AnalysisTreeNode":
         return AnalysisTreeNode(
-            trace=(
-                {aid: np.array(data["trace"][aid]) for aid in data["agent"].keys()}
-                if data["type"] == "simtrace"
-                else data["trace"]
-            ),
+            trace={aid: np.array(t, dtype=float) for aid, t in data["trace"].items()},
             id=data["id"],
             init=data["init"],
             mode=data["mode"],
@@ -278,38 +384,97 @@ class AnalysisTree:
         return res
 
     def dump(self, fn: str) -> None:
-        """Dumps the AnalysisTree as JSON data to the file "fn"."""
-        res_dict = {}
-        converted_node = self.root._to_dict()
-        res_dict[self.root.id] = converted_node
-        queue = [self.root]
+        """Dumps the AnalysisTree as JSON data to the file "fn". The data is a dict from node
+        ids to nodes, written one node at a time."""
+        with open(fn, "w+") as f:
+            f.write("{")
+            for i, (node, node_dict) in enumerate(self._iter_dicts()):
+                f.write(",\n" if i > 0 else "\n")
+                f.write(json.dumps(str(node.id)) + ": ")
+                json.dump(node_dict, f, indent=4, sort_keys=True)
+            f.write("\n}")
+
+    def _iter_dicts(self, trace: bool = True) -> Iterable[Tuple[AnalysisTreeNode, Dict[str, Any]]]:
+        """The nodes of the tree and their dicts, in BFS order so parents come before their
+        children"""
+        queue = [(self.root, None)]
         while queue:
-            parent_node = queue.pop(0)
-            for child_node in parent_node.child:
-                node_dict = child_node._to_dict()
-                node_dict["parent"] = parent_node.id
-                res_dict[child_node.id] = node_dict
-                res_dict[parent_node.id]["child"].append(child_node.id)
-                queue.append(child_node)
+            node, parent_id = queue.pop(0)
+            node_dict = node._to_dict(trace)
+            node_dict["parent"] = parent_id
+            node_dict["child"] = [child.id for child in node.child]
+            yield node, node_dict
+            queue.extend((child, node.id) for child in node.child)
+
+    def dump_binary(self, path: str) -> None:
+        """Dumps the AnalysisTree to the directory "path". The traces of all nodes are stored
+        back to back in a single flat array in `traces.npy`, and everything else in a small
+        `index.json`. See `load_binary`. Only works for traces of floats."""
+        nodes = [node for node, _ in self._iter_dicts(False)]
+        traces = [np.asarray(t) for node in nodes for t in node.trace.values()]
+        if any(t.dtype == object for t in traces):
+            raise ValueError("Only traces of floats can be dumped as binary, use `dump` instead")
+        dtype = np.result_type(*{t.dtype for t in traces}) if len(traces) > 0 else np.float64
+        os.makedirs(path, exist_ok=True)
+        # np.memmap can't map empty files
+        data = np.lib.format.open_memmap(
+            os.path.join(path, "traces.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=(max(sum(t.size for t in traces), 1),),
+        )
+        index = []
+        offset = 0
+        for node, node_dict in self._iter_dicts(False):
+            for aid, t in node.trace.items():
+                t = np.asarray(t)
+                data[offset : offset + t.size] = t.ravel()
+                node_dict["trace"][aid] = [offset, *t.shape]
+                offset += t.size
+            index.append(node_dict)
+        data.flush()
+        del data
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"dtype": str(dtype), "nodes": index}, f)
 
-        with open(fn, "w+") as f:
-            json.dump(res_dict, f, indent=4, sort_keys=True)
+    @staticmethod
+    def load_binary(path: str, mmap: bool = True) -> "AnalysisTree":
+        """Loads the AnalysisTree dumped by `dump_binary` to the directory "path". With `mmap`,
+        the traces are memory mapped and each node only reads its own on the first access to
+        its `trace`. Changes to the traces aren't written back to the file."""
+        with open(os.path.join(path, "index.json"), "r") as f:
+            index = json.load(f)
+        data = np.load(os.path.join(path, "traces.npy"), mmap_mode="c" if mmap else None)
+        nodes = {}
+        for node_dict in index["nodes"]:
+            slices = node_dict["trace"]
+            node = AnalysisTreeNode._from_dict(dict(node_dict, trace={}))
+            node._load_trace = partial(_read_traces, data, slices)
+            nodes[node.id] = node
+            if node_dict["parent"] != None:
+                nodes[node_dict["parent"]].child.append(node)
+        return AnalysisTree(nodes[index["nodes"][0]["id"]])
+
+    @staticmethod
+    def iter_load(fn: str) -> Iterator[Tuple[AnalysisTreeNode, Optional[int], List[int]]]:
+        """Reads the nodes of the AnalysisTree dumped as JSON data to the file "fn" one at a
+        time, without loading the whole file. Yields each node (without children) with the id
+        of its parent and the ids of its children."""
+        with open(fn, "r") as f:
+            for _, node_dict in _iter_json_items(f):
+                node = AnalysisTreeNode._from_dict(node_dict)
+                yield node, node_dict["parent"], node_dict["child"]
 
     @staticmethod
     def load(fn: str) -> "AnalysisTree":
         """Loads the AnalysisTree from the file "fn" as JSON data."""
-        with open(fn, "r") as f:
-            data = json.load(f)
-        root_node_dict = data[str(0)]
-        root = AnalysisTreeNode._from_dict(root_node_dict)
-        queue = [(root_node_dict, root)]
-        while queue:
-            parent_node_dict, parent_node = queue.pop(0)
-            for child_node_idx in parent_node_dict["child"]:
-                child_node_dict = data[str(child_node_idx)]
-                child_node = AnalysisTreeNode._from_dict(child_node_dict)
-                parent_node.child.append(child_node)
-                queue.append((child_node_dict, child_node))
+        nodes, child_ids, root = {}, {}, None
+        for node, parent_id, child in AnalysisTree.iter_load(fn):
+            nodes[node.id], child_ids[node.id] = node, child
+            if parent_id == None:
+                root = node
+        for id, node in nodes.items():
+            node.child = [nodes[c] for c in child_ids[id]]
         return AnalysisTree(root)
 
     # TODO Generalize to different timesteps
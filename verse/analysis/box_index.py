@@ -0,0 +1,68 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class BoxIndex:
+    """Axis aligned boxes of one dimension, each with some data attached.
+
+    The bounds are kept in two (n, d) arrays, so that a query tests every box at once in NumPy
+    instead of walking a tree per dimension in Python. Boxes are added in amortized constant time
+    and removed by moving the last box into the hole, which keeps the arrays dense.
+    """
+
+    def __init__(self, dim: int, capacity: int = 8):
+        self.dim = dim
+        self._lows = np.empty((capacity, dim))
+        self._highs = np.empty((capacity, dim))
+        self._data: List[Any] = []
+        # id of data -> row
+        self._rows: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def add(self, lows, highs, data) -> None:
+        n = len(self._data)
+        if n == len(self._lows):
+            self._lows = np.concatenate([self._lows, np.empty_like(self._lows)])
+            self._highs = np.concatenate([self._highs, np.empty_like(self._highs)])
+        self._lows[n] = lows
+        self._highs[n] = highs
+        self._rows[id(data)] = n
+        self._data.append(data)
+
+    def remove(self, data) -> None:
+        row = self._rows.pop(id(data))
+        last = len(self._data) - 1
+        if row != last:
+            moved = self._data[last]
+            self._lows[row] = self._lows[last]
+            self._highs[row] = self._highs[last]
+            self._data[row] = moved
+            self._rows[id(moved)] = row
+        self._data.pop()
+
+    def boxes(self) -> Tuple[np.ndarray, np.ndarray, List[Any]]:
+        """Lower bounds, upper bounds and data of all the boxes, in the same order."""
+        n = len(self._data)
+        return self._lows[:n], self._highs[:n], self._data
+
+    def _containing(self, lows, highs) -> np.ndarray:
+        n = len(self._data)
+        lows, highs = np.asarray(lows, dtype=float), np.asarray(highs, dtype=float)
+        return np.flatnonzero(
+            np.all(self._lows[:n] <= lows, axis=1) & np.all(highs <= self._highs[:n], axis=1)
+        )
+
+    def query(self, lows, highs) -> List[Any]:
+        """Data of the boxes containing the box from `lows` to `highs`."""
+        return [self._data[i] for i in self._containing(lows, highs)]
+
+    def tightest(self, lows, highs) -> Optional[Any]:
+        """Data of the box containing the box from `lows` to `highs` with the least total slack."""
+        rows = self._containing(lows, highs)
+        if len(rows) == 0:
+            return None
+        slack = np.sum(self._highs[rows] - self._lows[rows], axis=1)
+        return self._data[rows[np.argmin(slack)]]
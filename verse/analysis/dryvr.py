@@ -6,6 +6,8 @@ _TRUE_MIN_CONST = -10
 _EPSILON = 1.0e-6
 _SMALL_EPSILON = 1e-10
 SIMTRACENUM = 10
+# Number of pairwise distances held in memory at once by all_sensitivities_calc
+_SENSITIVITY_CHUNK_SIZE = 1 << 22
 
 PW = "PW"
 GLOBAL = "GLOBAL"
@@ -19,28 +21,19 @@ def all_sensitivities_calc(training_traces: np.ndarray, initial_radii: np.ndarra
     normalizing_initial_set_radii: np.array = initial_radii.copy()
     y_points: np.array = np.zeros((normalizing_initial_set_radii.shape[0], trace_len - 1))
     normalizing_initial_set_radii[np.where(normalizing_initial_set_radii == 0)] = 1.0
-    for cur_dim_ind in range(1, ndims):
-        # keyi: move out of loop
-        normalized_initial_points: np.array = (
-            training_traces[:, 0, 1:] / normalizing_initial_set_radii
-        )
-        initial_distances = (
-            spatial.distance.pdist(normalized_initial_points, "chebyshev") + _SMALL_EPSILON
-        )
-        for cur_time_ind in range(1, trace_len):
-            y_points[cur_dim_ind - 1, cur_time_ind - 1] = np.max(
-                (
-                    spatial.distance.pdist(
-                        np.reshape(
-                            training_traces[:, cur_time_ind, cur_dim_ind],
-                            (training_traces.shape[0], 1),
-                        ),
-                        "chebychev",
-                    )
-                    / normalizing_initial_set_radii[cur_dim_ind - 1]
-                )
-                / initial_distances
-            )
+    normalized_initial_points: np.array = training_traces[:, 0, 1:] / normalizing_initial_set_radii
+    initial_distances = (
+        spatial.distance.pdist(normalized_initial_points, "chebyshev") + _SMALL_EPSILON
+    )
+    # Trace pairs in the same order as pdist, time steps taken in chunks to bound memory
+    first, second = np.triu_indices(num_traces, 1)
+    chunk_len = max(1, _SENSITIVITY_CHUNK_SIZE // max(1, len(first) * (ndims - 1)))
+    for start_ind in range(1, trace_len, chunk_len):
+        chunk = training_traces[:, start_ind : start_ind + chunk_len, 1:]
+        distances = np.abs(chunk[first] - chunk[second]) / normalizing_initial_set_radii
+        y_points[: ndims - 1, start_ind - 1 : start_ind - 1 + chunk.shape[1]] = np.max(
+            distances / initial_distances[:, None, None], axis=0
+        ).T
     return y_points
 
 
@@ -247,6 +240,45 @@ def trimTraces(traces):
     return [trace[:trace_len] for trace in traces]
 
 
+def sample_traces(
+    mode_label,
+    initial_set,
+    time_horizon,
+    time_step,
+    sim_func,
+    sim_trace_num,
+    lane_map=None,
+    sim_batch_func=None,
+):
+    """
+    Simulate the center of the initial set and sim_trace_num random points in it
+
+    Args:
+        mode_label (str): mode name
+        initial_set (list): a list contains upper and lower bound of the initial set
+        time_horizon (float): time horizon to simulate
+        time_step (float): time step to simulate
+        sim_func (function): simulation function
+        sim_trace_num (int): number of random points to simulate
+        lane_map (LaneMap or None): map passed to the simulation function
+        sim_batch_func (function or None): batched simulation function taking all the
+            initial points as one (N, n) array, used instead of sim_func when provided
+
+    Returns:
+        traces trimmed to the same length, center trace first
+
+    """
+    inits = [calcCenterPoint(initial_set[0], initial_set[1])]
+    for i in range(sim_trace_num):
+        inits.append(randomPoint(initial_set[0], initial_set[1], i))
+    if sim_batch_func is not None:
+        return list(sim_batch_func(mode_label, np.array(inits), time_horizon, time_step, lane_map))
+    # Simulate SIMTRACENUM times to learn the sensitivity
+    traces = [sim_func(mode_label, init, time_horizon, time_step, lane_map) for init in inits]
+    # Trim the trace to the same length
+    return trimTraces(traces)
+
+
 def calc_bloated_tube(
     mode_label,
     initial_set,
@@ -259,6 +291,7 @@ def calc_bloated_tube(
     guard_checker=None,
     guard_str="",
     lane_map=None,
+    sim_batch_func=None,
 ):
     """
     This function calculate the reach tube for single given mode
@@ -273,6 +306,8 @@ def calc_bloated_tube(
         kvalue (list): list of float used when bloating method set to PW
         guard_checker (verse.core.guard.Guard or None): guard check object
         guard_str (str): guard string
+        sim_batch_func (function or None): batched simulation function, used instead of
+            sim_func when provided
 
     Returns:
         Bloated reach tube
@@ -280,16 +315,17 @@ def calc_bloated_tube(
     """
     # print(initial_set)
     # random.seed(4)
-    cur_center = calcCenterPoint(initial_set[0], initial_set[1])
     cur_delta = calcDelta(initial_set[0], initial_set[1])
-    traces = [sim_func(mode_label, cur_center, time_horizon, time_step, lane_map)]
-    # Simulate SIMTRACENUM times to learn the sensitivity
-    for i in range(sim_trace_num):
-        new_init_point = randomPoint(initial_set[0], initial_set[1], i)
-        traces.append(sim_func(mode_label, new_init_point, time_horizon, time_step, lane_map))
-
-    # Trim the trace to the same length
-    traces = trimTraces(traces)
+    traces = sample_traces(
+        mode_label,
+        initial_set,
+        time_horizon,
+        time_step,
+        sim_func,
+        sim_trace_num,
+        lane_map,
+        sim_batch_func,
+    )
     if guard_checker is not None:
         # pre truncated traces to get better bloat result
         max_idx = -1
@@ -0,0 +1,176 @@
+from enum import Enum, auto
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import atexit
+import concurrent.futures
+
+
+class ExecutionBackend(Enum):
+    SERIAL = auto()
+    THREAD = auto()
+    PROCESS = auto()
+    RAY = auto()
+
+
+class Executor:
+    """Runs simulation/verification steps for `Simulator` and `Verifier`.
+
+    Tasks are submitted with `submit` and collected one at a time with `wait`, so the
+    `parallel_sim_ahead`/`parallel_ver_ahead` back-pressure works the same for every backend.
+    """
+
+    def put(self, obj: Any) -> Any:
+        """Share an object that is passed to many tasks."""
+        return obj
+
+    def submit(self, func: Callable, *args) -> Any:
+        raise NotImplementedError()
+
+    def wait(self, handles: List[Any]) -> Tuple[Any, List[Any]]:
+        """Block until one of the handles is done. Returns it with the remaining handles."""
+        raise NotImplementedError()
+
+    def get(self, handle: Any) -> Any:
+        raise NotImplementedError()
+
+    def cancel(self, handles: List[Any]) -> None:
+        """Cancel tasks that haven't finished. Their results are never collected."""
+        pass
+
+    def shutdown(self) -> None:
+        """Release the workers of the backend, waiting for running tasks."""
+        pass
+
+
+class _Done:
+    def __init__(self, result):
+        self.result = result
+
+
+class SerialExecutor(Executor):
+    """Runs each task inline when it is submitted."""
+
+    def submit(self, func, *args):
+        return _Done(func(*args))
+
+    def wait(self, handles):
+        return handles[0], handles[1:]
+
+    def get(self, handle):
+        return handle.result
+
+
+class FuturesExecutor(Executor):
+    """Wraps a `concurrent.futures` executor."""
+
+    def __init__(self, pool: concurrent.futures.Executor):
+        self.pool = pool
+
+    def submit(self, func, *args):
+        return self.pool.submit(func, *args)
+
+    def wait(self, handles):
+        done, _ = concurrent.futures.wait(handles, return_when=concurrent.futures.FIRST_COMPLETED)
+        # Pick the earliest submitted finished task, so results are processed in a stable order
+        i = next(i for i, h in enumerate(handles) if h in done)
+        return handles[i], handles[:i] + handles[i + 1 :]
+
+    def get(self, handle):
+        return handle.result()
+
+    def cancel(self, handles):
+        for handle in handles:
+            handle.cancel()
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class ThreadExecutor(FuturesExecutor):
+    """Thread pool backend. Calls into z3 are serialized, so verification gains less than
+    simulation from it."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        super().__init__(concurrent.futures.ThreadPoolExecutor(max_workers))
+
+
+def _call_pickled(payload: bytes) -> bytes:
+    import cloudpickle
+
+    func, args = cloudpickle.loads(payload)
+    return cloudpickle.dumps(func(*args))
+
+
+class ProcessExecutor(FuturesExecutor):
+    """Process pool backend. Tasks and results are serialized with cloudpickle, since agents
+    carry compiled decision logic that plain pickle can't handle."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        super().__init__(concurrent.futures.ProcessPoolExecutor(max_workers))
+
+    def submit(self, func, *args):
+        import cloudpickle
+
+        return self.pool.submit(_call_pickled, cloudpickle.dumps((func, args)))
+
+    def get(self, handle):
+        import cloudpickle
+
+        return cloudpickle.loads(handle.result())
+
+
+class RayExecutor(Executor):
+    def __init__(self):
+        import ray
+
+        if not ray.is_initialized():
+            ray.init()
+        self.ray = ray
+        self.remotes: Dict[Callable, Any] = {}
+
+    def put(self, obj):
+        return self.ray.put(obj)
+
+    def submit(self, func, *args):
+        if func not in self.remotes:
+            self.remotes[func] = self.ray.remote(func)
+        return self.remotes[func].remote(*args)
+
+    def wait(self, handles):
+        [res], remaining = self.ray.wait(handles)
+        return res, remaining
+
+    def get(self, handle):
+        return self.ray.get(handle)
+
+    def cancel(self, handles):
+        for handle in handles:
+            self.ray.cancel(handle)
+
+
+_executors: Dict[Tuple[ExecutionBackend, Optional[int]], Executor] = {}
+
+
+def get_executor(backend: ExecutionBackend, max_workers: Optional[int] = None) -> Executor:
+    """Get the executor for a backend. Pools are created on first use and shared afterwards,
+    until `shutdown_executors`."""
+    key = (backend, max_workers)
+    if key not in _executors:
+        if backend == ExecutionBackend.SERIAL:
+            _executors[key] = SerialExecutor()
+        elif backend == ExecutionBackend.THREAD:
+            _executors[key] = ThreadExecutor(max_workers)
+        elif backend == ExecutionBackend.PROCESS:
+            _executors[key] = ProcessExecutor(max_workers)
+        elif backend == ExecutionBackend.RAY:
+            _executors[key] = RayExecutor()
+        else:
+            raise ValueError(f"Unsupported execution backend {backend}")
+    return _executors[key]
+
+
+@atexit.register
+def shutdown_executors() -> None:
+    """Shut down the shared pools. Also called at exit."""
+    while _executors:
+        _, executor = _executors.popitem()
+        executor.shutdown()
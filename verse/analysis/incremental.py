@@ -1,11 +1,12 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
+from enum import Enum, auto
 from pprint import pp
-from typing import Any, DefaultDict, List, Tuple, Optional, Dict, Set
+from typing import Any, List, Tuple, Optional, Dict, Set
 from verse.agents.base_agent import BaseAgent
 from verse.analysis import AnalysisTreeNode
-from intervaltree import IntervalTree
-import itertools, copy, numpy.typing as nptyp, numpy as np
+from verse.analysis.box_index import BoxIndex
+import itertools, copy, sys, numpy.typing as nptyp, numpy as np
 
 from verse.analysis.dryvr import _EPSILON
 
@@ -164,10 +165,119 @@ class CachedTube:
         return (self.tube == other.tube).all()
 
 
-class SimTraceCache:
-    def __init__(self):
-        self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
+class EvictionPolicy(Enum):
+    LRU = auto()
+    LFU = auto()
 
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+
+def entry_nbytes(obj, _seen: Optional[Set[int]] = None) -> int:
+    """Approximate number of bytes held by a cache entry. Objects reachable more than once are
+    counted once, and the `ModePath`s, which are shared with the controllers, aren't counted."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or isinstance(obj, (ModePath, type, Enum)):
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(entry_nbytes(k, _seen) + entry_nbytes(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(entry_nbytes(v, _seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += entry_nbytes(vars(obj), _seen)
+    return size
+
+
+class BoundedCache:
+    """Base of the incremental caches. Entries are stored by the box of their initial set, in a
+    `BoxIndex` per key.
+
+    Once there are more than `max_entries` entries, or they take more than `max_bytes` (see
+    `entry_nbytes`), entries are evicted by `policy`: least recently or least frequently hit, ties
+    going to the least recent. The latest entry is never evicted. Lookups and evictions are
+    counted in `stats`.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
+    ):
+        self.cache: Dict[tuple, BoxIndex] = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.stats = CacheStats()
+        # id of entry -> [entry, key, size, hits], least recent first
+        self._slots: "OrderedDict[int, list]" = OrderedDict()
+
+    def _insert(self, key: tuple, lows, highs, entry):
+        if key not in self.cache:
+            self.cache[key] = BoxIndex(len(lows))
+        self.cache[key].add(lows, highs, entry)
+        size = entry_nbytes(entry)
+        self._slots[id(entry)] = [entry, key, size, 0]
+        self.stats.entries += 1
+        self.stats.nbytes += size
+        self._evict()
+        return entry
+
+    def _record(self, entry) -> None:
+        if entry is None:
+            self.stats.misses += 1
+            return
+        self.stats.hits += 1
+        slot = self._slots.get(id(entry))
+        if slot is not None:
+            slot[3] += 1
+            self._slots.move_to_end(id(entry))
+
+    def update(self, entry) -> None:
+        """Account for an entry that has grown since it was added."""
+        slot = self._slots.get(id(entry))
+        if slot is None:
+            return
+        size = entry_nbytes(entry)
+        self.stats.nbytes += size - slot[2]
+        slot[2] = size
+        self._evict()
+
+    def _over_limit(self) -> bool:
+        return (self.max_entries is not None and self.stats.entries > self.max_entries) or (
+            self.max_bytes is not None and self.stats.nbytes > self.max_bytes
+        )
+
+    def _evict(self) -> None:
+        while self._over_limit() and len(self._slots) > 1:
+            candidates = itertools.islice(self._slots.values(), len(self._slots) - 1)
+            if self.policy == EvictionPolicy.LFU:
+                slot = min(candidates, key=lambda slot: slot[3])
+            else:
+                slot = next(candidates)
+            entry, key, size, _ = slot
+            del self._slots[id(entry)]
+            index = self.cache[key]
+            index.remove(entry)
+            if len(index) == 0:
+                del self.cache[key]
+            self.stats.entries -= 1
+            self.stats.nbytes -= size
+            self.stats.evictions += 1
+
+
+class SimTraceCache(BoundedCache):
     def add_segment(
         self,
         agent_id: str,
@@ -180,74 +290,44 @@ class SimTraceCache:
     ):
         key = (agent_id,) + tuple(node.mode[agent_id])
         init = node.init[agent_id]
-        tree = self.cache[key]
         assert_hits = node.assert_hits or {}
         # pp(('add seg', agent_id, *node.mode[agent_id], *init))
-        for i, val in enumerate(init):
-            if i == len(init) - 1:
-                transitions = convert_sim_trans(
-                    agent_id, transit_agents, node.init, transition, trans_ind
-                )
-                entry = CachedSegment(
-                    trace, assert_hits.get(agent_id), transitions, set([(run_num, node.id)])
-                )
-                tree[val - _EPSILON : val + _EPSILON] = entry
-                return entry
-            else:
-                next_level_tree = IntervalTree()
-                tree[val - _EPSILON : val + _EPSILON] = next_level_tree
-                tree = next_level_tree
-        raise Exception("???")
-
-    @staticmethod
-    def iter_tree(tree, depth: int) -> List[List[float]]:
-        if depth == 0:
-            return [
-                [
-                    (i.begin + i.end) / 2,
-                    (
-                        i.data.node_ids,
-                        [t.transition for t in i.data.transitions],
-                        len(i.data.trace),
-                    ),
-                ]
-                for i in tree
-            ]
-        res = []
-        for i in tree:
-            mid = (i.begin + i.end) / 2
-            subs = SimTraceCache.iter_tree(i.data, depth - 1)
-            res.extend([mid] + sub for sub in subs)
-        return res
-
-    def get_cached_inits(self, n: int):
+        transitions = convert_sim_trans(agent_id, transit_agents, node.init, transition, trans_ind)
+        entry = CachedSegment(
+            trace, assert_hits.get(agent_id), transitions, set([(run_num, node.id)])
+        )
+        init = np.asarray(init, dtype=float)
+        return self._insert(key, init - _EPSILON, init + _EPSILON, entry)
+
+    def get_cached_inits(self):
         inits = defaultdict(list)
-        for key, tree in self.cache.items():
-            inits[key[0]].extend((*key[1:], *init) for init in self.iter_tree(tree, n))
-        inits = {k: sorted(v) for k, v in inits.items()}
+        for key, index in self.cache.items():
+            lows, highs, entries = index.boxes()
+            for mid, e in zip(((lows + highs) / 2).tolist(), entries):
+                info = (e.node_ids, [t.transition for t in e.transitions], len(e.trace))
+                inits[key[0]].append((*key[1:], *mid, info))
+        inits = {k: sorted(v, key=lambda init: init[:-1]) for k, v in inits.items()}
         return inits
 
-    @staticmethod
-    def query_cont(tree: IntervalTree, cont: List[float]) -> List[CachedSegment]:
-        assert isinstance(tree, IntervalTree)
-        next_level_entries = [t.data for t in tree[cont[0]]]
-        if len(cont) == 1:
-            for ent in next_level_entries:
-                assert isinstance(ent, CachedSegment)
-            return next_level_entries
-        else:
-            return [
-                ent for t in next_level_entries for ent in SimTraceCache.query_cont(t, cont[1:])
-            ]
-
     def check_hit(
-        self, agent_id: str, mode: Tuple[str], init: List[float], inits: Dict[str, List[float]]
+        self,
+        agent_id: str,
+        mode: Tuple[str],
+        init: List[float],
+        inits: Dict[str, List[float]],
+        record: bool = True,
     ) -> Optional[CachedSegment]:
+        """Find the cached segment for `init`. Counted in the stats when `record` is set."""
+        entry = self._find(agent_id, mode, init, inits)
+        if record:
+            self._record(entry)
+        return entry
+
+    def _find(self, agent_id, mode, init, inits) -> Optional[CachedSegment]:
         key = (agent_id,) + tuple(mode)
         if key not in self.cache:
             return None
-        tree = self.cache[key]
-        entries = self.query_cont(tree, init)
+        entries = self.cache[key].query(init, init)
         if len(entries) == 0:
             return None
 
@@ -260,10 +340,7 @@ class SimTraceCache:
         return entries[0][0]
 
 
-class TubeCache:
-    def __init__(self):
-        self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
-
+class TubeCache(BoundedCache):
     def add_tube(
         self,
         agent_id: str,
@@ -272,41 +349,28 @@ class TubeCache:
         trace: List[List[List[float]]],
     ):
         key = (agent_id,) + tuple(mode)
-        init = list(map(list, zip(*init)))
-        tree = self.cache[key]
-        for i, (low, high) in enumerate(init):
-            if i == len(init) - 1:
-                entry = CachedTube(trace)
-                tree[low : high + _EPSILON] = entry
-                return entry
-            else:
-                next_level_tree = IntervalTree()
-                tree[low : high + _EPSILON] = next_level_tree
-                tree = next_level_tree
-        raise Exception("???")
+        low, high = np.asarray(init, dtype=float)
+        return self._insert(key, low, high + _EPSILON, CachedTube(trace))
 
     def check_hit(
-        self, agent_id: str, mode: Tuple[str], init: List[List[float]]
+        self, agent_id: str, mode: Tuple[str], init: List[List[float]], record: bool = True
     ) -> Optional[CachedTube]:
+        """Find the tightest cached tube whose initial set contains `init`. Counted in the stats
+        when `record` is set."""
+        entry = self._find(agent_id, mode, init)
+        if record:
+            self._record(entry)
+        return entry
+
+    def _find(self, agent_id, mode, init) -> Optional[CachedTube]:
         key = (agent_id,) + tuple(mode)
         if key not in self.cache:
             return None
-        tree = self.cache[key]
-        for low, high in list(map(list, zip(*init))):
-            next_level_entries = [
-                t for t in tree[low : high + _EPSILON] if t.begin <= low and high <= t.end
-            ]
-            if len(next_level_entries) == 0:
-                return None
-            tree = min(next_level_entries, key=lambda e: low - e.begin + e.end - high).data
-        assert isinstance(tree, CachedTube)
-        return tree
-
-
-class ReachTubeCache:
-    def __init__(self):
-        self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
+        low, high = init
+        return self.cache[key].tightest(low, high)
 
+
+class ReachTubeCache(BoundedCache):
     def add_tube(
         self,
         agent_id: str,
@@ -318,41 +382,14 @@ class ReachTubeCache:
         run_num: int,
     ):
         key = (agent_id,) + tuple(node.mode[agent_id])
-        tree = self.cache[key]
         # pp(('add seg', agent_id, node.mode[agent_id], init))
         assert_hits = node.assert_hits or {}
-        init = list(map(tuple, zip(*init[agent_id])))
-        for i, (low, high) in enumerate(init):
-            if i == len(init) - 1:
-                transitions = convert_reach_trans(
-                    agent_id, transit_agents, node.init, transition, trans_ind
-                )
-                entry = CachedRTTrans(
-                    assert_hits.get(agent_id), transitions, set([(run_num, node.id)])
-                )
-                tree[low : high + _EPSILON] = entry
-                return entry
-            else:
-                next_level_tree = IntervalTree()
-                tree[low : high + _EPSILON] = next_level_tree
-                tree = next_level_tree
-        raise Exception("???")
-
-    @staticmethod
-    def query_cont(tree: IntervalTree, cont: List[Tuple[float, float]]) -> List[CachedRTTrans]:
-        assert isinstance(tree, IntervalTree)
-        low, high = cont[0]
-        next_level_entries = [
-            t.data for t in tree[low : high + _EPSILON] if t.begin <= low and high <= t.end
-        ]
-        if len(cont) == 1:
-            for ent in next_level_entries:
-                assert isinstance(ent, CachedRTTrans)
-            return next_level_entries
-        else:
-            return [
-                ent for t in next_level_entries for ent in ReachTubeCache.query_cont(t, cont[1:])
-            ]
+        transitions = convert_reach_trans(
+            agent_id, transit_agents, node.init, transition, trans_ind
+        )
+        entry = CachedRTTrans(assert_hits.get(agent_id), transitions, set([(run_num, node.id)]))
+        low, high = np.asarray(init[agent_id], dtype=float)
+        return self._insert(key, low, high + _EPSILON, entry)
 
     def check_hit(
         self,
@@ -360,12 +397,20 @@ class ReachTubeCache:
         mode: Tuple[str],
         init: List[float],
         inits: Dict[str, List[List[List[float]]]],
+        record: bool = True,
     ) -> Optional[CachedRTTrans]:
+        """Find the cached transitions for `init`. Counted in the stats when `record` is set."""
+        entry = self._find(agent_id, mode, init, inits)
+        if record:
+            self._record(entry)
+        return entry
+
+    def _find(self, agent_id, mode, init, inits) -> Optional[CachedRTTrans]:
         key = (agent_id,) + tuple(mode)
         if key not in self.cache:
             return None
-        tree = self.cache[key]
-        entries = self.query_cont(tree, list(map(tuple, zip(*init))))
+        low, high = init
+        entries = self.cache[key].query(low, high)
         if len(entries) == 0:
             return None
 
@@ -377,26 +422,12 @@ class ReachTubeCache:
         assert isinstance(entries[0][0], CachedRTTrans)
         return entries[0][0]
 
-    @staticmethod
-    def iter_tree(tree, depth: int) -> List[List[float]]:
-        if depth == 0:
-            return [
-                [
-                    (i.begin + i.end) / 2,
-                    (i.data.run_num, i.data.node_id, [t.transition for t in i.data.transitions]),
-                ]
-                for i in tree
-            ]
-        res = []
-        for i in tree:
-            mid = (i.begin + i.end) / 2
-            subs = ReachTubeCache.iter_tree(i.data, depth - 1)
-            res.extend([mid] + sub for sub in subs)
-        return res
-
-    def get_cached_inits(self, n: int):
+    def get_cached_inits(self):
         inits = defaultdict(list)
-        for key, tree in self.cache.items():
-            inits[key[0]].extend((*key[1:], *init) for init in self.iter_tree(tree, n))
+        for key, index in self.cache.items():
+            lows, highs, entries = index.boxes()
+            for mid, e in zip(((lows + highs) / 2).tolist(), entries):
+                info = (e.node_ids, [t.transition for t in e.transitions])
+                inits[key[0]].append((*key[1:], *mid, info))
         inits = dict(inits)
         return inits
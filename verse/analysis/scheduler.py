@@ -0,0 +1,94 @@
+from enum import Enum, auto
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import heapq
+import itertools
+
+from verse.analysis.analysis_tree import AnalysisTreeNode
+
+
+class SearchStrategy(Enum):
+    DEFAULT = auto()
+    """The first child of every node is explored before the other children, otherwise FIFO."""
+    BFS = auto()
+    DFS = auto()
+    EARLIEST_START = auto()
+    """Nodes with the smallest start time are explored first."""
+
+
+class NodeQueue:
+    """Priority queue of the nodes waiting to be simulated/verified.
+
+    Entries are `(node, later)` pairs, where `later` is 0 for the first child of a node and 1
+    for the rest. Ties are broken by insertion order, so every strategy is deterministic.
+    When `priority` is given, it overrides `strategy` and nodes with the lowest value are popped
+    first, e.g. to explore the nodes closest to an unsafe set first."""
+
+    def __init__(
+        self,
+        strategy: SearchStrategy = SearchStrategy.DEFAULT,
+        priority: Optional[Callable[[AnalysisTreeNode], Any]] = None,
+    ):
+        self.strategy = strategy
+        self.priority = priority
+        self.heap: List[Tuple[Tuple, int, AnalysisTreeNode, int]] = []
+        self.counter = itertools.count()
+        self.batch = 0
+
+    def _key(self, node: AnalysisTreeNode, later: int) -> Tuple:
+        if self.priority != None:
+            return (self.priority(node),)
+        if self.strategy == SearchStrategy.DEFAULT:
+            return (later,)
+        if self.strategy == SearchStrategy.BFS:
+            return ()
+        if self.strategy == SearchStrategy.DFS:
+            return (-self.batch,)
+        if self.strategy == SearchStrategy.EARLIEST_START:
+            return (node.start_time,)
+        raise ValueError(f"Unsupported search strategy {self.strategy}")
+
+    def push(self, node: AnalysisTreeNode, later: int = 0):
+        heapq.heappush(self.heap, (self._key(node, later), next(self.counter), node, later))
+
+    def push_children(self, nodes: List[AnalysisTreeNode]):
+        """Add the children of a node that was just processed."""
+        self.batch += 1
+        for i, node in enumerate(nodes):
+            self.push(node, 0 if i == 0 else 1)
+
+    def pop(self) -> Tuple[AnalysisTreeNode, int]:
+        _, _, node, later = heapq.heappop(self.heap)
+        return node, later
+
+    def drain(self) -> List[AnalysisTreeNode]:
+        """Remove and return every queued node."""
+        nodes = [entry[2] for entry in self.heap]
+        self.heap = []
+        return nodes
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+def prune_to_violation(
+    nodes: Dict[int, AnalysisTreeNode],
+    queue: NodeQueue,
+    pending_ids: Set[int],
+    violation: AnalysisTreeNode,
+):
+    """Stop the search and keep only the counterexample: the branch from the root to
+    `violation`, the node that hit an assert. Queued nodes and nodes still being computed are
+    dropped along with every other finished node. `nodes` maps ids to nodes and is updated in
+    place."""
+    queue.drain()
+    pending_ids.clear()
+    parents = {c.id: n.id for n in nodes.values() for c in n.child}
+    branch = {violation.id}
+    while violation.id in parents:
+        violation = nodes[parents[violation.id]]
+        branch.add(violation.id)
+    for id in list(nodes):
+        if id not in branch:
+            del nodes[id]
+    for n in nodes.values():
+        n.child = [c for c in n.child if c.id in branch]
@@ -1,9 +1,9 @@
 from dataclasses import dataclass
+import numpy as np
 import pickle
 import timeit
 from typing import Dict, List, Optional, Tuple
 import copy, itertools, functools, pprint
-from pympler.asizeof import asizeof
 from collections import defaultdict
 from typing import DefaultDict, Optional, Tuple, List, Dict, Any
 from types import SimpleNamespace
@@ -13,10 +13,19 @@ import sys
 from enum import Enum
 
 from verse.agents.base_agent import BaseAgent
-from verse.analysis.incremental import CachedSegment, SimTraceCache, convert_sim_trans, to_simulate
+from verse.analysis.incremental import (
+    CachedSegment,
+    CacheStats,
+    SimTraceCache,
+    convert_sim_trans,
+    to_simulate,
+)
+from verse.analysis.executor import get_executor
+from verse.analysis.scheduler import NodeQueue, prune_to_violation
 from verse.utils.utils import dedup
 from verse.map.lane_map import LaneMap
-from verse.parser.parser import ModePath, find, unparse
+from verse.parser.parser import VEC_ENV, ModePath, find, unparse
+from verse.sensor.base_sensor import BaseSensor
 from verse.analysis.incremental import (
     CachedRTTrans,
     CachedSegment,
@@ -184,13 +193,18 @@ class SimConsts:
 class Simulator:
     def __init__(self, config):
         self.simulation_tree = None
-        self.cache = SimTraceCache()
+        self.cache = SimTraceCache(
+            config.cache_max_entries, config.cache_max_bytes, config.cache_policy
+        )
         self.config = config
-        self.cache_hits = (0, 0)
-        if self.config.parallel:
-            import ray
 
-            self.simulate_one_remote = ray.remote(Simulator.simulate_one)
+    @property
+    def cache_hits(self) -> Tuple[int, int]:
+        return self.cache.stats.hits, self.cache.stats.misses
+
+    def cache_stats(self) -> Dict[str, CacheStats]:
+        """Hits, misses, evictions and size of the incremental cache"""
+        return {"sim": self.cache.stats}
 
     @staticmethod
     def simulate_one(
@@ -207,6 +221,13 @@ class Simulator:
             print(f"node {node.id} start: {node.start_time}")
         # print(f"node id: {node.id}")
         cache_updates = []
+        # In chunked mode agents are simulated chunk_sim_time at a time, until a guard or assert
+        # fires
+        chunked = config.chunk_sim_time is not None and not config.incremental
+        sim_time = remain_time
+        if chunked:
+            chunk_time = max(config.chunk_sim_time, consts.time_step)
+            sim_time = round(min(chunk_time, remain_time), 10)
         for agent_id in node.agent:
             if agent_id not in node.trace:
                 if agent_id in cached_segments:
@@ -217,7 +238,7 @@ class Simulator:
                     mode = node.mode[agent_id]
                     init = node.init[agent_id]
                     trace = node.agent[agent_id].TC_simulate(
-                        mode, init, remain_time, consts.time_step, consts.lane_map
+                        mode, init, sim_time, consts.time_step, consts.lane_map
                     )
                     trace[:, 0] += node.start_time ### breakpoints here
                     node.trace[agent_id] = trace
@@ -233,9 +254,41 @@ class Simulator:
                 assert old_node != None
                 new_cache, paths_to_sim = to_simulate(old_node.agent, node.agent, cached_segments)
 
-        asserts, transitions, transition_idx = Simulator.get_transition_simulate(
-            new_cache, paths_to_sim, node, consts.lane_map, consts.sensor, consts.agent_dict, config.print_level
-        )
+        checked_idx = 0
+        while True:
+            if chunked:
+                # Continue every agent, including traces inherited from the parent, up to sim_time
+                end_time = node.start_time + sim_time
+                for agent_id in node.agent:
+                    last = node.trace[agent_id][-1]
+                    if last[0] < end_time - consts.time_step / 2:
+                        trace = node.agent[agent_id].TC_simulate(
+                            node.mode[agent_id],
+                            last[1:].tolist(),
+                            round(end_time - last[0], 10),
+                            consts.time_step,
+                            consts.lane_map,
+                        )
+                        trace[:, 0] = np.round(trace[:, 0] + last[0], 10)
+                        node.trace[agent_id] = np.concatenate((node.trace[agent_id], trace[1:]))
+            Simulator.clamp_to_horizon(node, node.start_time + remain_time, consts)
+            asserts, transitions, transition_idx = Simulator.get_transition_simulate(
+                new_cache,
+                paths_to_sim,
+                node,
+                consts.lane_map,
+                consts.sensor,
+                consts.agent_dict,
+                config.print_level,
+                checked_idx,
+            )
+            if asserts != None or transitions or not chunked:
+                break
+            sim_time = min(trace[-1][0] for trace in node.trace.values()) - node.start_time
+            if sim_time >= remain_time - consts.time_step / 2:
+                break
+            checked_idx = transition_idx + 1
+            sim_time = round(min(sim_time + chunk_time, remain_time), 10)
         node.assert_hits = asserts
         
         # pp(("transitions:", transition_idx, transitions))
@@ -248,11 +301,29 @@ class Simulator:
                 later,
                 [], 
                 node.trace,
+                asserts,
                 cache_updates
             )
 
         # pp(("next init:", {a: trace[transition_idx] for a, trace in node.trace.items()}))
 
+        # Move the transition from the first sample past the guard crossing to the crossing itself
+        event = None
+        if (
+            transitions
+            and asserts == None
+            and config.event_tol is not None
+            and not config.incremental
+            and transition_idx > 0
+        ):
+            event = Simulator.locate_event(config, node, transition_idx, consts)
+            if event != None:
+                transitions, rows = event
+                for agent_id in node.agent:
+                    node.trace[agent_id] = np.vstack(
+                        (node.trace[agent_id][:transition_idx], rows[agent_id])
+                    )
+
         # truncate the computed trajectories from idx and store the content after truncate
         truncated_trace: Dict[str, TraceType] = {}
         full_traces: Dict[str, TraceType] = {}
@@ -263,7 +334,7 @@ class Simulator:
                 node.trace[agent_idx] = node.trace[agent_idx][: transition_idx + 1]
 
         if asserts != None:  # FIXME
-            return (node.id, later, [], node.trace, cache_updates)
+            return (node.id, later, [], node.trace, asserts, cache_updates)
             # print(transition_idx)
             # pp({a: len(t) for a, t in node.trace.items()})
         else:
@@ -284,7 +355,7 @@ class Simulator:
                         )
                 # print(red("no trans"))
                 # print(f"node {node.id} dur {timeit.default_timer() - t}")
-                return (node.id, later, [], node.trace, cache_updates)
+                return (node.id, later, [], node.trace, asserts, cache_updates)
 
             transit_agents = transitions.keys()
             # pp(("transit agents", transit_agents))
@@ -303,7 +374,7 @@ class Simulator:
                             consts.run_num,
                         )
                     )
-            # pp(("cached inits", self.cache.get_cached_inits(3)))
+            # pp(("cached inits", self.cache.get_cached_inits()))
             # Generate the transition combinations if multiple agents can transit at the same time step
             transition_list = list(transitions.values())
             all_transition_combinations = itertools.product(*transition_list)
@@ -329,7 +400,10 @@ class Simulator:
                     next_node_init[transit_agent_idx] = next_init
                 for agent_idx in next_node_agent:
                     if agent_idx not in next_node_init:
-                        next_node_trace[agent_idx] = truncated_trace[agent_idx]
+                        # After an event the rest of the trace is off the new time grid, so
+                        # every agent is simulated again from the crossing
+                        if event == None:
+                            next_node_trace[agent_idx] = truncated_trace[agent_idx]
                         next_node_init[agent_idx] = truncated_trace[agent_idx][0][1:].tolist()
 
                 all_transition_paths.append(transition_paths)
@@ -343,22 +417,80 @@ class Simulator:
                 next_nodes.append(tmp)
             # print(len(next_nodes))
             # print(f"node {node.id} dur {timeit.default_timer() - t}")
-            return (node.id, later, next_nodes, node.trace, cache_updates)
+            return (node.id, later, next_nodes, node.trace, asserts, cache_updates)
+
+    @staticmethod
+    def clamp_to_horizon(node: AnalysisTreeNode, end_time: float, consts: SimConsts):
+        """Drop the samples past `end_time`, which the traces of a node starting between two
+        samples (after a located event) overshoot, and simulate the last partial step again so
+        that they still end at `end_time`."""
+        for aid, trace in node.trace.items():
+            past = trace[:, 0] > end_time + 1e-8
+            if not np.any(past):
+                continue
+            trace = trace[~past]
+            last = trace[-1]
+            step = round(end_time - last[0], 10)
+            if step > 1e-8:
+                row = node.agent[aid].TC_simulate(
+                    node.mode[aid], last[1:].tolist(), step, step, consts.lane_map
+                )[-1]
+                row = np.array(row, dtype=float)
+                row[0] = end_time
+                trace = np.vstack((trace, row))
+            node.trace[aid] = trace
 
-    def proc_result(self, id, later, next_nodes, traces, cache_updates):
+    @staticmethod
+    def locate_event(
+        config: "ScenarioConfig", node: AnalysisTreeNode, transition_idx: int, consts: SimConsts
+    ) -> Optional[Tuple[Dict[str, List[Tuple]], Dict[str, np.ndarray]]]:
+        """Bisect the time between the sample before a guard hit and the hit, by simulating
+        every agent again from the earlier sample, until the crossing is within `event_tol`.
+        Returns the transitions and the state of each agent at the crossing, or None when the
+        crossing can't be located closer than the sampled hit."""
+        prev = {aid: node.trace[aid][transition_idx - 1] for aid in node.agent}
+        aid = next(iter(node.agent))
+        lo, hi = 0.0, float(node.trace[aid][transition_idx][0] - prev[aid][0])
+        probe = copy.copy(node)
+        event = None
+        while hi - lo > config.event_tol:
+            mid = (lo + hi) / 2
+            rows = {}
+            for aid, agent in node.agent.items():
+                trace = agent.TC_simulate(
+                    node.mode[aid], prev[aid][1:].tolist(), mid, mid, consts.lane_map
+                )
+                rows[aid] = np.array(trace[-1], dtype=float)
+                rows[aid][0] = round(prev[aid][0] + mid, 10)
+            probe.trace = {aid: np.vstack((prev[aid], rows[aid])) for aid in node.agent}
+            asserts, transitions, _ = Simulator.get_transition_simulate(
+                {}, [], probe, consts.lane_map, consts.sensor, consts.agent_dict, 0, 1
+            )
+            if asserts != None:
+                return None
+            if transitions:
+                hi, event = mid, (transitions, rows)
+            else:
+                lo = mid
+        return event
+
+    def proc_result(self, id, later, next_nodes, traces, assert_hits, cache_updates):
         t = timeit.default_timer()
         # print("got id:", id)
         done_node = self.nodes[id]
-        done_node.child = next_nodes
+        if not self.release:
+            done_node.child = next_nodes
         done_node.trace = traces
-        last_id = self.nodes[-1].id
-        # assert max(n.id for n in self.nodes) == last_id
-        for i, node in enumerate(next_nodes):
-            node.id = i + 1 + last_id
-            later = 0 if i == 0 else 1
-            self.simulation_queue.append((node, later))
-        self.simulation_queue.sort(key=lambda p: p[1:])
-        self.nodes.extend(next_nodes)
+        done_node.assert_hits = assert_hits
+        self.pending_ids.discard(id)
+        if assert_hits != None and self.violation == None:
+            self.violation = done_node
+        for node in next_nodes:
+            node.id = self.next_id
+            self.next_id += 1
+            self.nodes[node.id] = node
+            self.parent_ids[node.id] = id
+        self.simulation_queue.push_children(next_nodes)
         for (
             new,
             aid,
@@ -369,9 +501,10 @@ class Simulator:
             run_num,
         ) in cache_updates:
             cached = self.cache.check_hit(
-                aid, done_node.mode[aid], done_node.init[aid], done_node.init
+                aid, done_node.mode[aid], done_node.init[aid], done_node.init, record=False
             )
-            if new and not cached:
+            # The entry seen when the node was dispatched may have been evicted since
+            if cached is None:
                 self.cache.add_segment(
                     aid, done_node, transit_agents, full_trace, transition, transition_idx, run_num
                 )
@@ -385,9 +518,16 @@ class Simulator:
                 )
                 cached.transitions = dedup(cached.transitions, lambda i: (i.disc, i.cont, i.inits))
                 cached.node_ids.add((run_num, done_node.id))
+                self.cache.update(cached)
             # pre_len = len(cached_segments[aid].transitions)
             # pp(("dedup!", pre_len, len(cached_segments[aid].transitions)))
         # print(f"proc dur {timeit.default_timer() - t}")
+        return done_node
+
+    def finish_node(self, node: AnalysisTreeNode) -> Tuple[Optional[int], AnalysisTreeNode]:
+        if self.release:
+            del self.nodes[node.id]
+        return self.parent_ids.pop(node.id), node
 
     def simulate(
         self,
@@ -399,33 +539,80 @@ class Simulator:
         lane_map,
         run_num,
         past_runs,
+        stop_on_first_violation=False,
+    ):
+        for _ in self.simulate_iter(
+            root,
+            sensor,
+            time_horizon,
+            time_step,
+            max_height,
+            lane_map,
+            run_num,
+            past_runs,
+            stop_on_first_violation,
+        ):
+            pass
+        return self.simulation_tree
+
+    def simulate_iter(
+        self,
+        root: AnalysisTreeNode,
+        sensor,
+        time_horizon,
+        time_step,
+        max_height,
+        lane_map,
+        run_num,
+        past_runs,
+        stop_on_first_violation=False,
+        release=False,
     ):
+        """Simulate the scenario, yielding `(parent_id, node)` as soon as each node is done.
+        When `release` is set, finished nodes are not kept and their `child` lists are left
+        empty; the tree has to be rebuilt from the parent ids."""
         # Setup the root of the simulation tree
         if max_height == None:
             max_height = float("inf")
 
-        self.simulation_queue: List[Tuple[AnalysisTreeNode, int]] = [(root, 0)]
+        self.simulation_queue = NodeQueue(self.config.search_strategy, self.config.search_priority)
+        self.simulation_queue.push(root)
         self.result_refs = []
-        self.nodes = [root]
+        self.pending_ids = set()
+        self.violation = None
+        self.release = release
+        self.nodes = {root.id: root}
+        self.parent_ids = {root.id: None}
+        self.next_id = root.id + 1
+        self.simulation_tree = None
         self.num_cached = 0
         # Perform BFS through the simulation tree to loop through all possible transitions
         consts = SimConsts(time_step, lane_map, run_num, past_runs, sensor, root.agent)
         if self.config.parallel:
-            import ray
-
-            consts_ref = ray.put(consts)
+            executor = get_executor(self.config.backend, self.config.max_workers)
+            consts_ref = executor.put(consts)
         while True:
+            if stop_on_first_violation and self.violation != None:
+                if len(self.result_refs) > 0:
+                    executor.cancel(self.result_refs)
+                    self.result_refs = []
+                prune_to_violation(
+                    self.nodes, self.simulation_queue, self.pending_ids, self.violation
+                )
+                break
             wait = False
             start = timeit.default_timer()
             if len(self.simulation_queue) > 0:
-                node, later = self.simulation_queue.pop(0)
+                node, later = self.simulation_queue.pop()
                 # Check height
                 if node.height >= max_height-1:
                     print("max depth reached")
+                    yield self.finish_node(node)
                     continue
                 # pp(("start sim", node.start_time, {a: (*node.mode[a], *node.init[a]) for a in node.mode}))
                 remain_time = round(time_horizon - node.start_time, 10)
                 if remain_time <= 0:
+                    yield self.finish_node(node)
                     continue
                 # For trace not already simulated
                 cached_segments = {}
@@ -435,10 +622,6 @@ class Simulator:
                     if self.config.incremental:
                         # pp(("check hit", agent_id, mode, init))
                         cached = self.cache.check_hit(agent_id, mode, init, node.init)
-                        if cached != None:
-                            self.cache_hits = self.cache_hits[0] + 1, self.cache_hits[1]
-                        else:
-                            self.cache_hits = self.cache_hits[0], self.cache_hits[1] + 1
                         # pp(("check hit res", agent_id, len(cached.transitions) if cached != None else None))
                         if cached != None:
                             cached_segments[agent_id] = cached
@@ -453,7 +636,7 @@ class Simulator:
                 if not self.config.parallel or old_node_id != None:
                     # print(f"local {node.id}")
                     t = timeit.default_timer()
-                    self.proc_result(
+                    done_node = self.proc_result(
                         *self.simulate_one(
                             self.config,
                             cached_segments,
@@ -464,10 +647,13 @@ class Simulator:
                             consts,
                         )
                     )
+                    yield self.finish_node(done_node)
                     # print(f"node {node.id} dur {timeit.default_timer() - t}")
                 else:
+                    self.pending_ids.add(node.id)
                     self.result_refs.append(
-                        self.simulate_one_remote.remote(
+                        executor.submit(
+                            Simulator.simulate_one,
                             self.config,
                             cached_segments,
                             node,
@@ -484,14 +670,13 @@ class Simulator:
             else:
                 break
             if wait:
-                [res], remaining = ray.wait(self.result_refs)
-                id, later, next_nodes, traces, cache_updates = ray.get(res)
-                self.proc_result(id, later, next_nodes, traces, cache_updates)
+                res, remaining = executor.wait(self.result_refs)
                 self.result_refs = remaining
+                yield self.finish_node(self.proc_result(*executor.get(res)))
         # print("cached", self.num_cached)
-        # pp(self.cache.get_cached_inits(3))
-        self.simulation_tree = AnalysisTree(root)
-        return self.simulation_tree
+        # pp(self.cache.get_cached_inits())
+        if not release:
+            self.simulation_tree = AnalysisTree(root)
 
     def simulate_simple(
         self,
@@ -623,13 +808,14 @@ class Simulator:
         track_map: LaneMap,
         sensor,
         agent_dict,
-        print_level: int
+        print_level: int,
+        start_idx: int = 0,
     ) -> Tuple[
         Optional[Dict[str, List[str]]],
         Optional[Dict[str, List[Tuple[str, List[str], List[float]]]]],
         int,
     ]:
-        trace_length = len(list(node.trace.values())[0])
+        trace_length = min(len(trace) for trace in node.trace.values())
 
         # For each agent
         agent_guard_dict = defaultdict(list)
@@ -705,13 +891,29 @@ class Simulator:
             agent_guard_dict[agent_id].append((path, discrete_variable_dict))
 
         transitions = defaultdict(list)
+        indices = range(start_idx, trace_length)
+        candidates, step_guards = None, {}
+        if not cache:
+            found = Simulator.get_guard_candidates(
+                node, agent_guard_dict, sensor, track_map, start_idx, trace_length, print_level
+            )
+            if found is not None:
+                candidates, step_guards = found
+                if not step_guards:
+                    # Only the steps where something may be hit need to be checked one by one
+                    indices = candidates
+                candidates = set(candidates)
         # TODO: We can probably rewrite how guard hit are detected and resets are handled for simulation
-        for idx in range(trace_length):
+        for idx in indices:
             if min_trans_ind != None and idx >= min_trans_ind:
                 return None, dict(cached_trans), min_trans_ind
             satisfied_guard = []
             all_asserts = defaultdict(list)
-            for agent_id in agent_guard_dict:
+            # Away from the candidates, only what couldn't be vectorized is left to check
+            guard_dict = (
+                agent_guard_dict if candidates is None or idx in candidates else step_guards
+            )
+            for agent_id in guard_dict:
                 agent: BaseAgent = agent_dict[agent_id]
                 state_dict = {
                     aid: (node.trace[aid][idx], node.mode[aid], node.static[aid])
@@ -727,7 +929,7 @@ class Simulator:
                 ]  # FIXME: off by 1?
                 asserts, satisfied = check_sim_transitions(
                     agent,
-                    agent_guard_dict[agent_id] + unchecked_cache_guards,
+                    guard_dict[agent_id] + unchecked_cache_guards,
                     continuous_variable_dict,
                     orig_disc_vars,
                     track_map,
@@ -760,9 +962,64 @@ class Simulator:
                             print("val_veri", unparse(paths[0].val_veri))
                         transitions[agent_idx].append((agent_idx, dest, next_init, paths))
                 break
+        else:
+            # Nothing was hit, so the whole trace is kept. The last step checked is the last
+            # candidate (if any) rather than the end of the trace when only candidates are checked
+            idx = trace_length - 1
         transitions = {aid: dedup(v, lambda p: p[1]) for aid, v in transitions.items()}
         return None, transitions, idx
 
+    @staticmethod
+    def get_guard_candidates(
+        node: AnalysisTreeNode,
+        agent_guard_dict,
+        sensor,
+        track_map,
+        start_idx: int,
+        trace_length: int,
+        print_level: int = 0,
+    ) -> Optional[Tuple[List[int], Dict[str, List]]]:
+        """Find the steps of the trace where a guard may be hit or an assert may be violated, by
+        evaluating the vectorized form of each of them over the whole trace at once. Returns the
+        candidate step indices, with the guards of each agent that can't be handled this way and
+        still need to be checked at every step (an agent whose asserts can't is also listed), or
+        None when the sensor can't sense whole traces. A vectorized form fails to evaluate with a
+        `TypeError` or `NameError` when what the sensor gives doesn't work on arrays; anything else
+        is a bug and is raised."""
+        if type(sensor).sense is not BaseSensor.sense:
+            return None
+        trace_dict = {
+            aid: (
+                np.asarray(node.trace[aid][start_idx:trace_length], dtype=float),
+                node.mode[aid],
+                node.static[aid],
+            )
+            for aid in node.agent
+        }
+        candidates = np.zeros(trace_length - start_idx, dtype=bool)
+        step_guards = {}
+        for agent_id, guards in agent_guard_dict.items():
+            agent = node.agent[agent_id]
+            conds = [(a.hit_vec, None) for a in agent.decision_logic.asserts]
+            conds += [(guard[0].cond_vec, guard) for guard in guards]
+            ego_ty_name = find(agent.decision_logic.args, lambda a: a.name == EGO).typ
+            cont, disc, _ = sensor.sense_trace(agent, trace_dict, track_map)
+            env = pack_env(agent, ego_ty_name, cont, disc, track_map)
+            env.update(VEC_ENV)
+            for cond, guard in conds:
+                if cond is not None:
+                    try:
+                        with np.errstate(all="ignore"):
+                            candidates |= eval(cond, env)
+                        continue
+                    except (TypeError, NameError) as e:
+                        if print_level >= 1:
+                            print(f"can't vectorize a condition of {agent_id}: {e!r}")
+                agent_step_guards = step_guards.setdefault(agent_id, [])
+                if guard is not None:
+                    agent_step_guards.append(guard)
+        return (np.flatnonzero(candidates) + start_idx).tolist(), step_guards
+
     @staticmethod
     def get_transition_simulate_simple(
         node: AnalysisTreeNode, track_map, sensor
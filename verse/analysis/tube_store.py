@@ -0,0 +1,169 @@
+import hashlib
+import inspect
+import io
+import os
+import pickle
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from verse.agents.base_agent import BaseAgent
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tubes (
+    key TEXT NOT NULL,
+    lo0 REAL NOT NULL,
+    hi0 REAL NOT NULL,
+    init BLOB NOT NULL,
+    tube BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tubes_key ON tubes (key, lo0, hi0);
+"""
+
+
+@lru_cache(maxsize=None)
+def _class_fingerprint(cls: type) -> str:
+    h = hashlib.sha1()
+    for c in cls.__mro__:
+        if c is object:
+            continue
+        h.update(f"{c.__module__}.{c.__qualname__}".encode())
+        try:
+            h.update(inspect.getsource(c).encode())
+        except (OSError, TypeError):
+            pass
+    return h.hexdigest()
+
+
+def dynamics_fingerprint(agent: BaseAgent) -> str:
+    """Hash of the source of the agent's class and its bases, which define its dynamics."""
+    return _class_fingerprint(type(agent))
+
+
+def _state_fingerprint(obj) -> str:
+    """Hash of the class and pickled state of `obj`. Objects plain pickle can't handle are pickled
+    with cloudpickle."""
+    h = hashlib.sha1(_class_fingerprint(type(obj)).encode())
+    try:
+        h.update(pickle.dumps(obj))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        import cloudpickle
+
+        h.update(cloudpickle.dumps(obj))
+    return h.hexdigest()
+
+
+def tube_key(
+    agent: BaseAgent,
+    mode,
+    time_horizon: float,
+    time_step: float,
+    method,
+    lane_map=None,
+    static=None,
+    uncertain_param=None,
+) -> str:
+    """Key of the tubes of `agent` in `mode` computed with the given horizon, step and bloating
+    settings, on `lane_map` and with the agent's static and uncertain parameters. Tubes are only
+    shared between equal keys."""
+    parts = (
+        dynamics_fingerprint(agent),
+        agent.id,
+        tuple(mode),
+        round(time_horizon, 10),
+        round(time_step, 10),
+        method,
+        _state_fingerprint(lane_map),
+        _state_fingerprint(static),
+        _state_fingerprint(uncertain_param),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _to_blob(arr) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(arr), allow_pickle=False)
+    return buf.getvalue()
+
+
+def _from_blob(blob: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(blob), allow_pickle=False)
+
+
+class TubeStore:
+    """Reach tubes kept in an SQLite database, so they can be reused by every worker process and
+    by later runs using the same file.
+
+    Tubes are looked up by key (see `tube_key`) and initial box; a tube is returned for any stored
+    box that contains the queried one, preferring the tightest. The database is opened in WAL
+    mode, so readers don't block a writer. It should be on a local file system.
+
+    Each thread and process opens its own connection, and the store is pickled as its path only.
+    """
+
+    def __init__(self, path: str, timeout: float = 60):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {"path": self.path, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Connections can't be used across a fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str, init: List[List[float]]) -> Optional[np.ndarray]:
+        """The tightest stored tube for `key` whose initial box contains `init`."""
+        lo, hi = np.asarray(init, dtype=float)
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT init, tube FROM tubes WHERE key = ? AND lo0 <= ? AND hi0 >= ?",
+                (key, lo[0], hi[0]),
+            )
+            .fetchall()
+        )
+        best, best_slack = None, None
+        for init_blob, tube_blob in rows:
+            box = _from_blob(init_blob)
+            if box.shape[1] != len(lo) or not (np.all(box[0] <= lo) and np.all(hi <= box[1])):
+                continue
+            slack = np.sum(lo - box[0]) + np.sum(box[1] - hi)
+            if best is None or slack < best_slack:
+                best, best_slack = tube_blob, slack
+        return None if best is None else _from_blob(best)
+
+    def put(self, key: str, init: List[List[float]], tube) -> None:
+        box = np.asarray(init, dtype=float)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO tubes (key, lo0, hi0, init, tube) VALUES (?, ?, ?, ?, ?)",
+                (key, box[0, 0], box[1, 0], _to_blob(box), _to_blob(tube)),
+            )
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM tubes").fetchone()[0]
+
+
+_stores: Dict[str, TubeStore] = {}
+
+
+def get_tube_store(path: str) -> TubeStore:
+    """The `TubeStore` of `path`, shared within the process."""
+    if path not in _stores:
+        _stores[path] = TubeStore(path)
+    return _stores[path]
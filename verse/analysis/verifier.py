@@ -1,16 +1,24 @@
 from enum import Enum, auto
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import defaultdict
 import copy, itertools, functools, pprint
 from typing import Dict, List, Optional, Tuple
 import numpy as np
 import warnings
 import ast
-import ray, time
+import time
 from verse.parser import unparse
 
-from verse.analysis.analysis_tree import AnalysisTreeNode, AnalysisTree, TraceType
+from verse.analysis.analysis_tree import (
+    AnalysisTreeNode,
+    AnalysisTree,
+    TraceType,
+    cast_tube,
+    tube_boxes,
+)
 from verse.analysis.dryvr import calc_bloated_tube, SIMTRACENUM
+from verse.analysis.executor import get_executor
+from verse.analysis.scheduler import NodeQueue, prune_to_violation
 from verse.analysis.incremental import (
     ReachTubeCache,
     TubeCache,
@@ -18,11 +26,13 @@ from verse.analysis.incremental import (
     to_simulate,
     combine_all,
 )
-from verse.analysis.incremental import CachedRTTrans, combine_all, reach_trans_suit
+from verse.analysis.incremental import CachedRTTrans, CacheStats, combine_all, reach_trans_suit
+from verse.analysis.tube_store import get_tube_store, tube_key
 from verse.utils.utils import dedup
 from verse.map.lane_map import LaneMap
 from verse.parser.parser import find, ModePath, unparse
 from verse.agents.base_agent import BaseAgent
+from verse.sensor.base_sensor import BaseSensor
 from verse.automaton import GuardExpressionAst, ResetExpression
 
 pp = functools.partial(pprint.pprint, compact=True, width=130)
@@ -50,17 +60,31 @@ class ReachConsts:
     past_runs: List[AnalysisTree]
     sensor: "BaseSensor"
     agent_dict: Dict
+    guard_cache: Dict = field(default_factory=dict)
+    """Discretely evaluated guards of the run, see `Verifier.eval_guard_disc`. Under the PROCESS and
+    RAY backends the consts are serialized for the workers, so each task fills its own copy of the
+    cache, which is never shared with other tasks or sent back to the driver."""
 
 
 class Verifier:
     def __init__(self, config):
         self.reachtube_tree = None
-        self.cache = TubeCache()
-        self.trans_cache = ReachTubeCache()
-        self.tube_cache_hits = (0, 0)
-        self.trans_cache_hits = (0, 0)
+        limits = (config.cache_max_entries, config.cache_max_bytes, config.cache_policy)
+        self.cache = TubeCache(*limits)
+        self.trans_cache = ReachTubeCache(*limits)
         self.config = config
-        self.compute_full_reachtube_step_remote = ray.remote(Verifier.compute_full_reachtube_step)
+
+    @property
+    def tube_cache_hits(self) -> Tuple[int, int]:
+        return self.cache.stats.hits, self.cache.stats.misses
+
+    @property
+    def trans_cache_hits(self) -> Tuple[int, int]:
+        return self.trans_cache.stats.hits, self.trans_cache.stats.misses
+
+    def cache_stats(self) -> Dict[str, CacheStats]:
+        """Hits, misses, evictions and sizes of the incremental caches"""
+        return {"tube": self.cache.stats, "trans": self.trans_cache.stats}
 
     def check_cache_bloated_tube_stars(
         self,
@@ -93,12 +117,6 @@ class Verifier:
             combined_rect = combined_rect.tolist()
             if self.config.incremental:
                 cached = self.cache.check_hit(agent_id, mode_label, combined_rect)
-                if cached != None:
-                    self.tube_cache_hits = self.tube_cache_hits[0] + 1, self.tube_cache_hits[1]
-                    # print('cache', agent_id, time_horizon, self.tube_cache_hits )
-                else:
-                    self.tube_cache_hits = self.tube_cache_hits[0], self.tube_cache_hits[1] + 1
-                    # print('noncache', agent_id, time_horizon, self.tube_cache_hits )
             else:
                 cached = None
             if cached != None:
@@ -139,6 +157,7 @@ class Verifier:
         guard_checker=None,
         guard_str="",
         lane_map=None,
+        sim_batch_func=None,
         pca=True,
     ):
         #this should return a list of stars for one time step along the horizon
@@ -208,6 +227,7 @@ class Verifier:
             sim_trace_num,
             lane_map=lane_map,
             pca=pca,
+            sim_batch_func=sim_batch_func,
             )
 
            
@@ -264,12 +284,6 @@ class Verifier:
             combined_rect = combined_rect.tolist()
             if self.config.incremental:
                 cached = self.cache.check_hit(agent_id, mode_label, combined_rect)
-                if cached != None:
-                    self.tube_cache_hits = self.tube_cache_hits[0] + 1, self.tube_cache_hits[1]
-                    # print('cache', agent_id, time_horizon, self.tube_cache_hits )
-                else:
-                    self.tube_cache_hits = self.tube_cache_hits[0], self.tube_cache_hits[1] + 1
-                    # print('noncache', agent_id, time_horizon, self.tube_cache_hits )
             else:
                 cached = None
             if cached != None:
@@ -310,11 +324,15 @@ class Verifier:
         guard_checker=None,
         guard_str="",
         lane_map=None,
+        sim_batch_func=None,
+        store=None,
+        store_key=None,
     ):
         """
         Get the full bloated tube. use cached tubes, calculate noncached tubes
 
         :param TBA
+        :param store: `TubeStore` to look the noncached tubes up in before calculating them
         :return:    the full bloated tube
                     cache to be updated
         """
@@ -343,17 +361,24 @@ class Verifier:
                     combined_rect[0, :] = np.minimum(combined_rect[0, :], rect[0, :])
                     combined_rect[1, :] = np.maximum(combined_rect[1, :], rect[1, :])
             combined_rect = combined_rect.tolist()
-            cur_bloated_tube = calc_bloated_tube(
-                mode_label,
-                combined_rect,
-                time_horizon,
-                time_step,
-                sim_func,
-                bloating_method,
-                kvalue,
-                sim_trace_num,
-                lane_map=lane_map,
-            )
+            cur_bloated_tube = None
+            if store is not None:
+                cur_bloated_tube = store.get(store_key, combined_rect)
+            if cur_bloated_tube is None:
+                cur_bloated_tube = calc_bloated_tube(
+                    mode_label,
+                    combined_rect,
+                    time_horizon,
+                    time_step,
+                    sim_func,
+                    bloating_method,
+                    kvalue,
+                    sim_trace_num,
+                    lane_map=lane_map,
+                    sim_batch_func=sim_batch_func,
+                )
+                if store is not None:
+                    store.put(store_key, combined_rect, cur_bloated_tube)
             if incremental:
                 cache_tube_updates.append((agent_id, mode_label, combined_rect, cur_bloated_tube))
             if res_tube is None:
@@ -371,7 +396,167 @@ class Verifier:
                 res_tube[combine_seg_idx * 2 + 1 :: 2, 1:] = np.maximum(
                     res_tube[combine_seg_idx * 2 + 1 :: 2, 1:], cur_bloated_tube[1::2, 1:]
                 )
-        return res_tube.tolist(), cache_tube_updates
+        return res_tube, cache_tube_updates
+
+    @staticmethod
+    def compute_agent_tube(
+        config: "ScenarioConfig",
+        cached_tubes: Dict[str, Tuple],
+        node: AnalysisTreeNode,
+        agent_id: str,
+        inits,
+        remain_time: float,
+        consts: ReachConsts,
+        params={},
+    ):
+        """
+        Compute the reach tube of a single agent in its current mode, starting at time 0
+
+        :return:    the tube computed by the configured reachability method
+                    cache to be updated
+        """
+        mode = node.mode[agent_id]
+        uncertain_param = node.uncertain_param[agent_id]
+        cache_tube_updates = []
+        if consts.reachability_method == ReachabilityMethod.DRYVR:
+            # pp(('tube', agent_id, mode, inits))
+            kvalue, sim_trace_num = 100, SIMTRACENUM
+            store, store_key = None, None
+            if config.tube_store is not None:
+                store = get_tube_store(config.tube_store)
+                store_key = tube_key(
+                    node.agent[agent_id],
+                    mode,
+                    remain_time,
+                    consts.time_step,
+                    (params.get("bloating_method", "PW"), kvalue, sim_trace_num),
+                    consts.lane_map,
+                    node.static[agent_id],
+                    uncertain_param,
+                )
+            (
+                cur_bloated_tube,
+                cache_tube_update,
+            ) = Verifier.calculate_full_bloated_tube_simple(
+                agent_id,
+                cached_tubes[agent_id] if config.incremental else None,
+                config.incremental,
+                mode,
+                inits,
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id].TC_simulate,
+                params,
+                kvalue,
+                sim_trace_num,
+                combine_seg_length=consts.init_seg_length,
+                lane_map=consts.lane_map,
+                sim_batch_func=node.agent[agent_id].TC_simulate_batch,
+                store=store,
+                store_key=store_key,
+            )
+            if config.incremental:
+                cache_tube_updates.extend(cache_tube_update)
+        elif consts.reachability_method == ReachabilityMethod.STAR_SETS:
+            # pp(('tube', agent_id, mode, inits))
+            (
+                cur_bloated_tube,
+                cache_tube_update,
+            ) = Verifier.calculate_full_bloated_tube_stars(
+                agent_id,
+                cached_tubes[agent_id] if config.incremental else None,
+                config.incremental,
+                mode,
+                inits,
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id].TC_simulate,
+                params,
+                100,
+                SIMTRACENUM,
+                combine_seg_length=consts.init_seg_length,
+                lane_map=consts.lane_map,
+                pca=config.pca,
+                sim_batch_func=node.agent[agent_id].TC_simulate_batch,
+            )
+            if config.incremental:
+                cache_tube_updates.extend(cache_tube_update)
+
+        elif consts.reachability_method == ReachabilityMethod.DRYVR_DISC:
+            from verse.analysis.dryvr_disc import calc_bloated_tube_dryvr
+            bloating_method = 'PW'
+            if 'bloating_method' in params:
+                bloating_method = params['bloating_method']
+            traces = None
+            if 'traces' in params:
+                traces = params['traces']     
+            if 'sim_trace_num' in params:
+                sim_trace_num = params['sim_trace_num']
+            else:
+                sim_trace_num = SIMTRACENUM              
+            init = inits[0]
+            if isinstance(init, np.ndarray):
+                init = init.tolist()
+            cur_bloated_tube = calc_bloated_tube_dryvr(
+                mode,
+                init,
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id].TC_simulate,
+                bloating_method, 
+                100,
+                sim_trace_num,
+                lane_map = consts.lane_map,
+                traces = traces,
+                sim_batch_func = node.agent[agent_id].TC_simulate_batch
+            )
+        elif consts.reachability_method == ReachabilityMethod.NEU_REACH:
+            # pylint: disable=E0401
+            from verse.analysis.NeuReach.NeuReach_onestep_rect import postCont
+            # pylint: enable=E0401
+            cur_bloated_tube = postCont(
+                mode,
+                inits[0],
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id].TC_simulate,
+                consts.lane_map,
+                params,
+            )
+        elif consts.reachability_method == ReachabilityMethod.MIXMONO_CONT:
+            from verse.analysis.mixmonotone import (
+                calculate_bloated_tube_mixmono_cont,
+            )
+            cur_bloated_tube = calculate_bloated_tube_mixmono_cont(
+                mode,
+                inits,
+                uncertain_param,
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id],
+                consts.lane_map,
+            )
+        elif consts.reachability_method == ReachabilityMethod.MIXMONO_DISC:
+            from verse.analysis.mixmonotone import (
+                calculate_bloated_tube_mixmono_disc,
+            )
+            cur_bloated_tube = calculate_bloated_tube_mixmono_disc(
+                mode,
+                inits,
+                uncertain_param,
+                remain_time,
+                consts.time_step,
+                node.agent[agent_id],
+                consts.lane_map,
+            )
+        return cur_bloated_tube, cache_tube_updates
+
+    @staticmethod
+    def tube_end(trace, consts: ReachConsts):
+        """The last set of a reach tube, as initial set to extend it from, and its time"""
+        if consts.reachability_method == ReachabilityMethod.STAR_SETS:
+            return [trace[-1][1]], float(trace[-1][0])
+        return [np.asarray(trace, dtype=float)[-2:, 1:].tolist()], float(trace[-1][0])
 
     @staticmethod
     def compute_full_reachtube_step(
@@ -398,131 +583,14 @@ class Verifier:
             max_height = float("inf")
         # combined_inits = {a: combine_all(inits) for a, inits in node.init.items()}
         next_nodes = []
-        for agent_id in node.agent:
-            mode = node.mode[agent_id]
-            inits = node.init[agent_id]
-            # combined = combine_all(inits)
-            if agent_id not in node.trace:
-                # Compute the trace starting from initial condition
-                uncertain_param = node.uncertain_param[agent_id]
-                if consts.reachability_method == ReachabilityMethod.DRYVR:
-                    # pp(('tube', agent_id, mode, inits))
-                    (
-                        cur_bloated_tube,
-                        cache_tube_update,
-                    ) = Verifier.calculate_full_bloated_tube_simple(
-                        agent_id,
-                        cached_tubes[agent_id] if config.incremental else None,
-                        config.incremental,
-                        mode,
-                        inits,
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id].TC_simulate,
-                        params,
-                        100,
-                        SIMTRACENUM,
-                        combine_seg_length=consts.init_seg_length,
-                        lane_map=consts.lane_map,
-                    )
-                    if config.incremental:
-                        cache_tube_updates.extend(cache_tube_update)
-                elif consts.reachability_method == ReachabilityMethod.STAR_SETS:
-                    # pp(('tube', agent_id, mode, inits))
-                    (
-                        cur_bloated_tube,
-                        cache_tube_update,
-                    ) = Verifier.calculate_full_bloated_tube_stars(
-                        agent_id,
-                        cached_tubes[agent_id] if config.incremental else None,
-                        config.incremental,
-                        mode,
-                        inits,
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id].TC_simulate,
-                        params,
-                        100,
-                        SIMTRACENUM,
-                        combine_seg_length=consts.init_seg_length,
-                        lane_map=consts.lane_map,
-                        pca=config.pca
-                    )
-                    if config.incremental:
-                        cache_tube_updates.extend(cache_tube_update)
-                
-                elif consts.reachability_method == ReachabilityMethod.DRYVR_DISC:
-                    from verse.analysis.dryvr_disc import calc_bloated_tube_dryvr
-                    bloating_method = 'PW'
-                    if 'bloating_method' in params:
-                        bloating_method = params['bloating_method']
-                    traces = None
-                    if 'traces' in params:
-                        traces = params['traces']     
-                    if 'sim_trace_num' in params:
-                        sim_trace_num = params['sim_trace_num']
-                    else:
-                        sim_trace_num = SIMTRACENUM              
-                    init = inits[0]
-                    if isinstance(init, np.ndarray):
-                        init = init.tolist()
-                    cur_bloated_tube = calc_bloated_tube_dryvr(
-                        mode,
-                        init,
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id].TC_simulate,
-                        bloating_method, 
-                        100,
-                        sim_trace_num,
-                        lane_map = consts.lane_map,
-                        traces = traces
-                    )
-                    if isinstance(cur_bloated_tube, np.ndarray):
-                        cur_bloated_tube = cur_bloated_tube.tolist()
-                elif consts.reachability_method == ReachabilityMethod.NEU_REACH:
-                    # pylint: disable=E0401
-                    from verse.analysis.NeuReach.NeuReach_onestep_rect import postCont
-                    # pylint: enable=E0401
-                    cur_bloated_tube = postCont(
-                        mode,
-                        inits[0],
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id].TC_simulate,
-                        consts.lane_map,
-                        params,
-                    )
-                elif consts.reachability_method == ReachabilityMethod.MIXMONO_CONT:
-                    from verse.analysis.mixmonotone import (
-                        calculate_bloated_tube_mixmono_cont,
-                    )
-                    cur_bloated_tube = calculate_bloated_tube_mixmono_cont(
-                        mode,
-                        inits,
-                        uncertain_param,
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id],
-                        consts.lane_map,
-                    )
-                elif consts.reachability_method == ReachabilityMethod.MIXMONO_DISC:
-                    from verse.analysis.mixmonotone import (
-                        calculate_bloated_tube_mixmono_disc,
-                    )
-                    cur_bloated_tube = calculate_bloated_tube_mixmono_disc(
-                        mode,
-                        inits,
-                        uncertain_param,
-                        remain_time,
-                        consts.time_step,
-                        node.agent[agent_id],
-                        consts.lane_map,
-                    )
-                # num_calls += 1
-                trace = np.array(cur_bloated_tube)
-                trace[:, 0] += node.start_time
-                node.trace[agent_id] = trace.tolist()
+        # In chunked mode tubes are computed for chunk_ver_time, then extended from their last box,
+        # doubling the horizon, until the branch transitions or hits an assert. Tubes inherited
+        # from a chunked parent are extended the same way.
+        chunked = (
+            config.chunk_ver_time is not None and not config.incremental and "traces" not in params
+        )
+        tube_time = min(config.chunk_ver_time, remain_time) if chunked else remain_time
+
         # pp(("cached tubes", cached_tubes.keys()))
         new_cache, paths_to_sim = {}, []
         if old_node_id != None:
@@ -536,10 +604,64 @@ class Verifier:
                 )
                 # pp(("to sim", new_cache.keys(), len(paths_to_sim)))
 
-        # Get all possible transitions to next mode
-        asserts, all_possible_transitions = Verifier.get_transition_verify_opt(
-            config, new_cache, paths_to_sim, node, consts.lane_map, consts.sensor
-        )
+        while True:
+            for agent_id in node.agent:
+                inits, offset = node.init[agent_id], 0
+                if agent_id in node.trace:
+                    if not chunked:
+                        continue
+                    inits, end = Verifier.tube_end(node.trace[agent_id], consts)
+                    offset = round(end - node.start_time, 10)
+                    if offset >= tube_time - consts.time_step / 2:
+                        continue
+                # Compute the trace starting from initial condition, or from the end of the tube
+                cur_bloated_tube, cache_tube_update = Verifier.compute_agent_tube(
+                    config,
+                    cached_tubes,
+                    node,
+                    agent_id,
+                    inits,
+                    round(tube_time - offset, 10),
+                    consts,
+                    params,
+                )
+                cache_tube_updates.extend(cache_tube_update)
+                # num_calls += 1
+                if consts.reachability_method == ReachabilityMethod.STAR_SETS:
+                    trace = np.array(cur_bloated_tube)
+                    trace[:, 0] += node.start_time + offset
+                    trace = trace.tolist()
+                    if agent_id in node.trace:
+                        trace = list(node.trace[agent_id]) + trace[1:]
+                else:
+                    trace = np.array(cur_bloated_tube, dtype=float)
+                    trace[:, 0] += node.start_time + offset
+                    trace = cast_tube(trace, config.trace_dtype)
+                    if agent_id in node.trace:
+                        trace = np.concatenate([node.trace[agent_id], trace])
+                node.trace[agent_id] = trace
+
+            # Get all possible transitions to next mode
+            asserts, all_possible_transitions = Verifier.get_transition_verify_opt(
+                config,
+                new_cache,
+                paths_to_sim,
+                node,
+                consts.lane_map,
+                consts.sensor,
+                consts.guard_cache,
+            )
+            if tube_time >= remain_time or asserts != None:
+                break
+            # Done once every guard region found ends before the end of the tube
+            trace_length = min(len(trace) for trace in node.trace.values())
+            if consts.reachability_method != ReachabilityMethod.STAR_SETS:
+                trace_length //= 2
+            if all_possible_transitions and all(
+                max(transition[4]) < trace_length - 1 for transition in all_possible_transitions
+            ):
+                break
+            tube_time = round(min(tube_time * 2, remain_time), 10)
         node.assert_hits = asserts
 
         if not config.unsafe_continue and asserts != None:
@@ -622,16 +744,18 @@ class Verifier:
             next_node_uncertain_param = node.uncertain_param
             next_node_mode[transit_agent_idx] = dest_mode
             next_node_agent = node.agent
-            next_node_start_time = list(truncated_trace.values())[0][0][0]
+            next_node_start_time = float(list(truncated_trace.values())[0][0][0])
             next_node_init = {}
             next_node_trace = {}
             for agent_idx in next_node_agent:
                 if agent_idx == transit_agent_idx:
                     next_node_init[agent_idx] = next_init
-                else:
+                elif consts.reachability_method == ReachabilityMethod.STAR_SETS:
                     next_node_init[agent_idx] = [
                         [truncated_trace[agent_idx][0][1:], truncated_trace[agent_idx][1][1:]]
                     ]
+                else:
+                    next_node_init[agent_idx] = [truncated_trace[agent_idx][:2, 1:].tolist()]
                     # pp(("infer init", agent_idx, next_node_init[agent_idx]))
                     next_node_trace[agent_idx] = truncated_trace[agent_idx]
 
@@ -678,19 +802,21 @@ class Verifier:
         # t = timeit.default_timer()
         # print('get id: ', id, self.nodes[id].start_time)
         done_node: AnalysisTreeNode = self.nodes[id]
-        done_node.child = next_nodes
+        if not self.release:
+            done_node.child = next_nodes
         done_node.trace = traces
         done_node.assert_hits = assert_hits
-        last_id = self.nodes[-1].id
-        # print([x.id for x in self.nodes])
-        for i, next_node in enumerate(next_nodes):
-            next_node.id = i + 1 + last_id
-            later = 0 if i == 0 else 1
-            if done_node.height <= max_height:
-                self.verification_queue.append((next_node, later))
-        self.verification_queue.sort(key=lambda p: p[1:])
+        self.pending_ids.discard(id)
+        if assert_hits != None and self.violation == None:
+            self.violation = done_node
+        for next_node in next_nodes:
+            next_node.id = self.next_id
+            self.next_id += 1
         if done_node.height <= max_height:
-            self.nodes.extend(next_nodes)
+            for next_node in next_nodes:
+                self.nodes[next_node.id] = next_node
+                self.parent_ids[next_node.id] = id
+            self.verification_queue.push_children(next_nodes)
         combined_inits = {a: combine_all(inits,self.config.reachability_method == ReachabilityMethod.STAR_SETS) for a, inits in done_node.init.items()}
         for (
             new,
@@ -701,9 +827,14 @@ class Verifier:
             run_num,
         ) in cache_trans_tube_updates:
             cached = self.trans_cache.check_hit(
-                aid, done_node.mode[aid], combine_all(done_node.init[aid]), done_node.init
+                aid,
+                done_node.mode[aid],
+                combine_all(done_node.init[aid]),
+                done_node.init,
+                record=False,
             )
-            if new and not cached:
+            # The entry seen when the node was dispatched may have been evicted since
+            if cached is None:
                 self.trans_cache.add_tube(
                     aid,
                     combined_inits,
@@ -723,9 +854,16 @@ class Verifier:
                 )
                 cached.transitions = dedup(cached.transitions, lambda i: (i.mode, i.dest, i.inits))
                 cached.node_ids.add((run_num, done_node.id))
+                self.trans_cache.update(cached)
         for agent_id, mode_label, combined_rect, cur_bloated_tube in cache_tube_updates:
             self.cache.add_tube(agent_id, mode_label, combined_rect, cur_bloated_tube)
         # print(f"proc dur {timeit.default_timer() - t}")
+        return done_node
+
+    def finish_node(self, node: AnalysisTreeNode) -> Tuple[Optional[int], AnalysisTreeNode]:
+        if self.release:
+            del self.nodes[node.id]
+        return self.parent_ids.pop(node.id), node
 
     def compute_full_reachtube(
         self,
@@ -740,13 +878,59 @@ class Verifier:
         run_num,
         past_runs,
         params={},
+        stop_on_first_violation=False,
     ):
+        for _ in self.compute_full_reachtube_iter(
+            root,
+            sensor,
+            time_horizon,
+            time_step,
+            max_height,
+            lane_map,
+            init_seg_length,
+            reachability_method,
+            run_num,
+            past_runs,
+            params,
+            stop_on_first_violation,
+        ):
+            pass
+        return self.reachtube_tree
+
+    def compute_full_reachtube_iter(
+        self,
+        root: AnalysisTreeNode,
+        sensor,
+        time_horizon,
+        time_step,
+        max_height,
+        lane_map,
+        init_seg_length,
+        reachability_method,
+        run_num,
+        past_runs,
+        params={},
+        stop_on_first_violation=False,
+        release=False,
+    ):
+        """Compute the reach tubes, yielding `(parent_id, node)` as soon as each node is done.
+        When `release` is set, finished nodes are not kept and their `child` lists are left
+        empty; the tree has to be rebuilt from the parent ids."""
         if max_height == None:
             max_height = float("inf")
 
-        self.verification_queue: List[Tuple[AnalysisTreeNode, int]] = [(root, 0)]
+        self.verification_queue = NodeQueue(
+            self.config.search_strategy, self.config.search_priority
+        )
+        self.verification_queue.push(root)
         self.result_refs = []
-        self.nodes = [root]
+        self.pending_ids = set()
+        self.violation = None
+        self.release = release
+        self.nodes = {root.id: root}
+        self.parent_ids = {root.id: None}
+        self.next_id = root.id + 1
+        self.reachtube_tree = None
         self.num_cached = 0
         num_calls = 0
         num_transitions = 0
@@ -761,21 +945,31 @@ class Verifier:
             root.agent,
         )
         if self.config.parallel:
-            # import ray
-            consts_ref = ray.put(consts)
+            executor = get_executor(self.config.backend, self.config.max_workers)
+            consts_ref = executor.put(consts)
         while True:
+            if stop_on_first_violation and self.violation != None:
+                if len(self.result_refs) > 0:
+                    executor.cancel(self.result_refs)
+                    self.result_refs = []
+                prune_to_violation(
+                    self.nodes, self.verification_queue, self.pending_ids, self.violation
+                )
+                break
             wait = False
             if len(self.verification_queue) > 0:
                 # print([node.id for node in verification_queue])
-                node, later = self.verification_queue.pop(0)
+                node, later = self.verification_queue.pop()
                 # check height
                 if node.height >= max_height-1:
                     print("max depth reached")
+                    yield self.finish_node(node)
                     continue
                 num_transitions += 1
                 # pp(("start ver", node.start_time, {a: (*node.mode[a], *node.init[a]) for a in node.mode}))
                 remain_time = round(time_horizon - node.start_time, 10)
                 if remain_time <= 0:
+                    yield self.finish_node(node)
                     continue
                 cached_trans_tubes = {}
                 cached_tubes = {}
@@ -786,16 +980,6 @@ class Verifier:
                     if self.config.incremental:
                         # CachedRTTrans
                         cached = self.trans_cache.check_hit(agent_id, mode, combined, node.init)
-                        if cached != None:
-                            self.trans_cache_hits = (
-                                self.trans_cache_hits[0] + 1,
-                                self.trans_cache_hits[1],
-                            )
-                        else:
-                            self.trans_cache_hits = (
-                                self.trans_cache_hits[0],
-                                self.trans_cache_hits[1] + 1,
-                            )
                         # pp(("check hit", agent_id, mode, combined))
                         if cached != None:
                             cached_trans_tubes[agent_id] = cached
@@ -829,7 +1013,7 @@ class Verifier:
                     # else:
                     #     print(f"not full {node.id}: {node_ids}, {len(cached_trans_tubes) == len(node.agent)} | {all_node_ids}")
                 if not self.config.parallel or (old_node_id != None and self.config.try_local):
-                    self.proc_result(
+                    done_node = self.proc_result(
                         *self.compute_full_reachtube_step(
                             self.config,
                             cached_trans_tubes,
@@ -844,9 +1028,12 @@ class Verifier:
                         ),
                         max_height,
                     )
+                    yield self.finish_node(done_node)
                 else:
+                    self.pending_ids.add(node.id)
                     self.result_refs.append(
-                        self.compute_full_reachtube_step_remote.remote(
+                        executor.submit(
+                            Verifier.compute_full_reachtube_step,
                             self.config,
                             cached_trans_tubes,
                             cached_tubes,
@@ -867,7 +1054,7 @@ class Verifier:
                 break
             # print(len(verification_queue), len(result_refs))
             if wait:
-                [res], self.result_refs = ray.wait(self.result_refs)
+                res, self.result_refs = executor.wait(self.result_refs)
                 (
                     id,
                     later,
@@ -876,9 +1063,9 @@ class Verifier:
                     assert_hits,
                     cache_tube_updates,
                     cache_trans_tube_updates,
-                ) = ray.get(res)
+                ) = executor.get(res)
                 # TODO: may add pipelining
-                self.proc_result(
+                done_node = self.proc_result(
                     id,
                     later,
                     next_nodes,
@@ -888,17 +1075,120 @@ class Verifier:
                     cache_trans_tube_updates,
                     max_height,
                 )
-        self.reachtube_tree = AnalysisTree(root)
+                yield self.finish_node(done_node)
+        if not release:
+            self.reachtube_tree = AnalysisTree(root)
         # print(f">>>>>>>> Number of calls to reachability engine: {num_calls}")
         # print(f">>>>>>>> Number of transitions happening: {num_transitions}")
         self.num_transitions = num_transitions
 
-        return self.reachtube_tree
 
+    @staticmethod
+    def get_guard_candidates(
+        node: AnalysisTreeNode, agent_guard_dict, sensor, track_map, trace_length: int
+    ) -> Optional[np.ndarray]:
+        """Find the steps of a rectangular tube where a guard may be hit or an assert may be
+        violated, by evaluating them over the whole tube at once with interval arithmetic.
+        Returns the candidate step indices, or None when the sensor or some guard/assert can't be
+        handled this way."""
+        if type(sensor).sense is not BaseSensor.sense:
+            return None
+        tube_dict = {
+            aid: (
+                tube_boxes(np.asarray(node.trace[aid][: trace_length * 2], dtype=float)),
+                node.mode[aid],
+                node.static[aid],
+            )
+            for aid in node.agent
+        }
+        candidates = np.zeros(trace_length, dtype=bool)
+
+        def eval_tube(ge: GuardExpressionAst, cont_vars, disc_vars):
+            if any(isinstance(n, ast.Call) for root in ge.ast_list for n in ast.walk(root)):
+                return None
+            if not ge.evaluate_guard_disc(agent, disc_vars, cont_vars, track_map):
+                return False, False
+            return ge.evaluate_guard_interval(cont_vars)
+
+        for agent_id, agent in node.agent.items():
+            if len(agent.decision_logic.args) == 0:
+                continue
+            cont_vars, disc_vars, len_dict = sensor.sense_tube(agent, tube_dict, track_map)
+            for a in agent.decision_logic.asserts_veri:
+                res = []
+                for expr in (a.pre, a.cond):
+                    ge = GuardExpressionAst([expr])
+                    expr_cont_vars = dict(cont_vars)
+                    cont_var_updater = ge.parse_any_all_new(expr_cont_vars, disc_vars, len_dict)
+                    Verifier.apply_cont_var_updater(expr_cont_vars, cont_var_updater)
+                    res.append(eval_tube(ge, expr_cont_vars, disc_vars))
+                if None in res:
+                    return None
+                (pre_may, _), (_, cond_must) = res
+                candidates |= np.logical_and(pre_may, np.logical_not(cond_must))
+            for guard_expression, cont_var_updater, disc_vars, path in agent_guard_dict[agent_id]:
+                guard_cont_vars = dict(cont_vars)
+                Verifier.apply_cont_var_updater(guard_cont_vars, cont_var_updater)
+                res = eval_tube(copy.copy(guard_expression), guard_cont_vars, disc_vars)
+                if res == None:
+                    return None
+                candidates |= res[0]
+        return np.flatnonzero(candidates)
+
+    @staticmethod
+    def eval_guard_disc(
+        guard_cache: Optional[Dict],
+        agent: BaseAgent,
+        path: ModePath,
+        cont_var_dict: Dict,
+        disc_var_dict: Dict,
+        len_dict: Dict,
+        track_map,
+    ) -> Optional[Tuple[GuardExpressionAst, Dict[str, List], Dict]]:
+        """Unroll the guard of `path` and evaluate its discrete part. Returns the partially
+        evaluated guard, its continuous variable updater and the discrete variables, or None when
+        the guard can't be satisfied. Both only depend on the discrete state of the agents (and the
+        map), so they are memoized in `guard_cache` and a path that's impossible in some modes is
+        only ruled out once per mode."""
+        key = None
+        if guard_cache != None:
+            key = (
+                agent.id,
+                path.cond,
+                path.var,
+                path.val,
+                tuple(
+                    (k, tuple(v) if isinstance(v, list) else v) for k, v in disc_var_dict.items()
+                ),
+                tuple(len_dict.items()),
+                tuple(cont_var_dict),
+            )
+            if key in guard_cache:
+                res = guard_cache[key]
+                return None if res == None else (copy.copy(res[0]), res[1], res[2])
+        guard_expression = GuardExpressionAst([path.cond_veri])
+        cont_var_updater = guard_expression.parse_any_all_new(
+            cont_var_dict, disc_var_dict, len_dict
+        )
+        Verifier.apply_cont_var_updater(cont_var_dict, cont_var_updater)
+        res = None
+        if guard_expression.evaluate_guard_disc(agent, disc_var_dict, cont_var_dict, track_map):
+            res = (guard_expression, cont_var_updater, dict(disc_var_dict))
+        if key != None:
+            guard_cache[key] = res
+            if res != None:
+                return copy.copy(res[0]), res[1], res[2]
+        return res
 
     @staticmethod
     def get_transition_verify_opt(
-        config: "ScenarioConfig", cache: Dict[str, CachedRTTrans], paths: PathDiffs, node: AnalysisTreeNode, track_map, sensor
+        config: "ScenarioConfig",
+        cache: Dict[str, CachedRTTrans],
+        paths: PathDiffs,
+        node: AnalysisTreeNode,
+        track_map,
+        sensor,
+        guard_cache: Optional[Dict] = None,
     ) -> Tuple[
         Optional[Dict[str, List[str]]],
         Optional[Dict[str, List[Tuple[str, List[str], List[float]]]]],
@@ -909,6 +1199,8 @@ class Verifier:
         min_trans_ind = None
         cached_trans = []
         agent_dict = node.agent
+        if isinstance(sensor, BaseSensor):
+            sensor = sensor.for_node(node)
 
         if not cache:
             paths = [
@@ -960,23 +1252,24 @@ class Verifier:
                             agent, state_dict, track_map, False
                         )
                         reset = (path.var, path.val_veri)
-                        guard_expression = GuardExpressionAst([path.cond_veri])
-
-                        cont_var_updater = guard_expression.parse_any_all_new(
-                            cont_var_dict_template, discrete_variable_dict, length_dict
-                        )
-                        Verifier.apply_cont_var_updater(cont_var_dict_template, cont_var_updater)
-                        guard_can_satisfied = guard_expression.evaluate_guard_disc(
-                            agent, discrete_variable_dict, cont_var_dict_template, track_map
+                        guard = Verifier.eval_guard_disc(
+                            guard_cache,
+                            agent,
+                            path,
+                            cont_var_dict_template,
+                            discrete_variable_dict,
+                            length_dict,
+                            track_map,
                         )
-                        if not guard_can_satisfied:
+                        if guard == None:
                             continue
+                        guard_expression, cont_var_updater, discrete_variable_dict = guard
                         cached_guards[agent_id].append(
                             (
                                 path,
                                 guard_expression,
                                 cont_var_updater,
-                                copy.deepcopy(discrete_variable_dict),
+                                discrete_variable_dict,
                                 reset,
                                 path_transitions[path.cond],
                             )
@@ -1001,19 +1294,20 @@ class Verifier:
             cont_var_dict_template, discrete_variable_dict, length_dict = sensor.sense(agent, state_dict, track_map, False)
             # TODO-PARSER: Get equivalent for this function
             # Construct the guard expression
-            guard_expression = GuardExpressionAst([path.cond_veri])
-
-            cont_var_updater = guard_expression.parse_any_all_new(
-                cont_var_dict_template, discrete_variable_dict, length_dict
+            guard = Verifier.eval_guard_disc(
+                guard_cache,
+                agent,
+                path,
+                cont_var_dict_template,
+                discrete_variable_dict,
+                length_dict,
+                track_map,
             )
-            Verifier.apply_cont_var_updater(cont_var_dict_template, cont_var_updater)
-            guard_can_satisfied = guard_expression.evaluate_guard_disc(
-                agent, discrete_variable_dict, cont_var_dict_template, track_map
-            )
-            if not guard_can_satisfied:
+            if guard == None:
                 continue
+            guard_expression, cont_var_updater, discrete_variable_dict = guard
             agent_guard_dict[agent_id].append(
-                (guard_expression, cont_var_updater, copy.deepcopy(discrete_variable_dict), path)
+                (guard_expression, cont_var_updater, discrete_variable_dict, path)
             )
 
 
@@ -1029,10 +1323,24 @@ class Verifier:
         else:
             trace_length = int(min(len(v) for v in node.trace.values()) // 2)
             reduction_queue = [(0, trace_length, trace_length)]
+        candidates = None
+        if config.reachability_method != ReachabilityMethod.STAR_SETS and not cache:
+            candidates = Verifier.get_guard_candidates(
+                node, agent_guard_dict, sensor, track_map, trace_length
+            )
+        if candidates is not None:
+            # Only the steps that may hit something need to be checked one by one
+            reduction_queue = [(i, i + 1, 1) for i in reversed(candidates.tolist())]
         # for idx, end_idx,combine_len in reduction_queue:
         hits = []
+        last_idx = None
         while reduction_queue:
             idx, end_idx, combine_len = reduction_queue.pop()
+            if candidates is not None:
+                # Skipped steps have no hits, which ends a run of guard hits
+                if guard_hit and idx != last_idx + 1:
+                    break
+                last_idx = idx
             reduction_needed = False
             # print((idx, combine_len))
             any_contained = False
@@ -1079,7 +1387,7 @@ class Verifier:
                     pre_expr = a.pre
 
                     def eval_expr(expr):
-                        ge = GuardExpressionAst([copy.deepcopy(expr)])
+                        ge = GuardExpressionAst([expr])
                         cont_var_updater = ge.parse_any_all_new(cont_vars, disc_vars, len_dict)
                         Verifier.apply_cont_var_updater(cont_vars, cont_var_updater)
                         sat = ge.evaluate_guard_disc(agent, disc_vars, cont_vars, track_map)
@@ -1122,8 +1430,8 @@ class Verifier:
                     agent_guard_dict[agent_id] + unchecked_cache_guards
                 ):
                     assert isinstance(path, ModePath)
-                    new_cont_var_dict = copy.deepcopy(cont_vars)
-                    one_step_guard: GuardExpressionAst = copy.deepcopy(guard_expression)
+                    new_cont_var_dict = dict(cont_vars)
+                    one_step_guard: GuardExpressionAst = copy.copy(guard_expression)
 
                     Verifier.apply_cont_var_updater(new_cont_var_dict, continuous_variable_updater)
                     guard_can_satisfied = one_step_guard.evaluate_guard_hybrid(
@@ -1276,17 +1584,11 @@ class Verifier:
                 if not found:
                     raise ValueError(f"Reset discrete variable {discrete_variable_ego} not found")
                 if isinstance(reset.val_ast, ast.Constant):
-                    val = eval(expr)
-                    possible_dest[var_loc] = [val]
+                    possible_dest[var_loc] = [reset.val_ast.value]
                 else:
                     tmp = expr.split(".")
                     if "map" in tmp[0]:
-                        for var in disc_var_dict:
-                            expr = expr.replace(var, f"'{disc_var_dict[var]}'")
-                        res = eval(expr)
-                        if not isinstance(res, list):
-                            res = [res]
-                        possible_dest[var_loc] = res
+                        possible_dest[var_loc] = reset.eval_mode(disc_var_dict, track_map)
                     else:
                         expr = tmp
                         if expr[0].strip(" ") in agent.decision_logic.mode_defs:
@@ -1305,31 +1607,7 @@ class Verifier:
                         break
                 if not found:
                     raise ValueError(f"Reset continuous variable {cts_variable} not found")
-                # substituting low variables
-
-                symbols = []
-                for var in cont_var_dict:
-                    if var in expr:
-                        symbols.append(var)
-
-                # TODO: Implement this function
-                # The input to this function is a list of used symbols and the cont_var_dict
-                # The ouput of this function is a list of tuple of values for each variable in the symbols list
-                # The function will explor all possible combinations of low bound and upper bound for the variables in the symbols list
-                comb_list = Verifier._get_combinations(symbols, cont_var_dict)
-
-                lb = float("inf")
-                ub = -float("inf")
-
-                for comb in comb_list:
-                    val_dict = {}
-                    tmp = copy.deepcopy(expr)
-                    for symbol_idx, symbol in enumerate(symbols):
-                        tmp = tmp.replace(symbol, str(comb[symbol_idx]))
-                    res = eval(tmp, {}, val_dict)
-                    lb = min(lb, res)
-                    ub = max(ub, res)
-
+                lb, ub = reset.eval_cont_bounds(cont_var_dict)
                 rect[0][lhs_idx] = lb
                 rect[1][lhs_idx] = ub
 
@@ -1378,17 +1656,11 @@ class Verifier:
                 if not found:
                     raise ValueError(f"Reset discrete variable {discrete_variable_ego} not found")
                 if isinstance(reset.val_ast, ast.Constant):
-                    val = eval(expr)
-                    possible_dest[var_loc] = [val]
+                    possible_dest[var_loc] = [reset.val_ast.value]
                 else:
                     tmp = expr.split(".")
                     if "map" in tmp[0]:
-                        for var in disc_var_dict:
-                            expr = expr.replace(var, f"'{disc_var_dict[var]}'")
-                        res = eval(expr)
-                        if not isinstance(res, list):
-                            res = [res]
-                        possible_dest[var_loc] = res
+                        possible_dest[var_loc] = reset.eval_mode(disc_var_dict, track_map)
                     else:
                         expr = tmp
                         if expr[0].strip(" ") in agent.decision_logic.mode_defs:
@@ -1406,7 +1678,7 @@ class Verifier:
                 ):
                     if cts_variable == lhs:
                         found = True
-                        expr_list[lhs_idx] = rhs
+                        expr_list[lhs_idx] = reset
                         reset_vars[lhs_idx] = lhs
                         break
                 if not found:
@@ -1429,13 +1701,7 @@ class Verifier:
             output = np.copy(state)
             idxs = list(reset_vars.keys())
             for idx in idxs:
-                val_dict = {}
-                tmp_exp = copy.deepcopy(expr_list[idx])
-                for i in range(0, len(state)):
-                    if statevec[i] in tmp_exp:
-                        tmp_exp = tmp_exp.replace(statevec[i], str(state[i]))
-                #print(tmp_exp)
-                result = eval(tmp_exp, {}, val_dict)
+                result = expr_list[idx].eval_point(dict(zip(statevec, state)))
                 for i in range(0, len(state)):
                     if reset_vars[idx] == statevec[i].split('.',1)[1]:
                         output[i] = result 
@@ -1477,7 +1743,7 @@ def combine_rect(trace):
     :param trace: the reachtube (2d list) to be combined
     :return: the combined rect (2d list)
     """
-    trace = np.array(trace)
+    trace = np.asarray(trace)
     # assert trace.shape[0] % 2 == 0
     combined_trace = np.ndarray(shape=(2, trace.shape[-1]))
     combined_trace[0] = np.min(trace[::2], 0)
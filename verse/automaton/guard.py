@@ -1,7 +1,12 @@
 from pprint import pp
-from typing import Any
+from typing import Any, Dict, Optional, Tuple
 import pickle
 import ast
+import functools
+import operator
+import threading
+
+import numpy as np
 
 from z3 import *
 
@@ -11,6 +16,344 @@ from verse.agents.base_agent import BaseAgent
 from verse.parser import Reduction, ReductionType, unparse
 
 
+# z3's default context isn't thread safe, so guard checks from the thread backend are serialized.
+# This lock also protects the compiled guard cache and its solvers below.
+_z3_lock = threading.RLock()
+
+
+@functools.lru_cache(maxsize=None)
+def _real(name: str):
+    return Real(name)
+
+
+class CompiledGuard:
+    """A guard translated to z3 once, with persistent solvers for the guard and its negation.
+    Queries add the bounds of the current state inside a push/pop."""
+
+    def __init__(self, expr, symbols):
+        self.expr = expr
+        self.symbols = symbols
+        self.solver = Solver()
+        self.solver.add(expr)
+        self.neg_solver = Solver()
+        self.neg_solver.add(Not(expr))
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_guard(guard_str: str, cont_variables: Tuple[Tuple[str, str], ...]) -> CompiledGuard:
+    symbols_map = {v: k for k, v in cont_variables if k in guard_str}
+    for vars, underscored in reversed(cont_variables):
+        guard_str = guard_str.replace(vars, underscored)
+    var_dict = {underscored: _real(underscored) for _, underscored in cont_variables}
+    # XXX `locals` should override `globals` right?
+    return CompiledGuard(eval(guard_str, globals(), var_dict), symbols_map)
+
+
+# Margin used by the interval prefilter. Comparisons closer than this are left to z3.
+_INTERVAL_EPS = 1e-9
+
+
+class Inconclusive(Exception):
+    """Raised when an expression can't be bounded with interval arithmetic."""
+
+
+class _Unsupported(Exception):
+    """Raised when a guard can't be compiled to z3 directly."""
+
+
+def _var_name(node) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return f"{node.value.id}.{node.attr}"
+    return unparse(node).strip("\n")
+
+
+def interval_bool(node, cont_vars) -> Tuple[Any, Any]:
+    """`(may, must)` of a boolean expression over the boxes in `cont_vars`, see
+    `GuardExpressionAst.evaluate_guard_interval`. Raises `Inconclusive` if the expression uses
+    something interval arithmetic doesn't handle."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+        return node.value, node.value
+    if isinstance(node, ast.BoolOp):
+        res = [interval_bool(val, cont_vars) for val in node.values]
+        if isinstance(node.op, ast.And):
+            return (
+                functools.reduce(np.logical_and, [r[0] for r in res]),
+                functools.reduce(np.logical_and, [r[1] for r in res]),
+            )
+        return (
+            functools.reduce(np.logical_or, [r[0] for r in res]),
+            functools.reduce(np.logical_or, [r[1] for r in res]),
+        )
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        may, must = interval_bool(node.operand, cont_vars)
+        return np.logical_not(must), np.logical_not(may)
+    if isinstance(node, ast.Compare):
+        may, must = True, True
+        left = interval_value(node.left, cont_vars)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = interval_value(comparator, cont_vars)
+            op_may, op_must = _interval_compare(op, left, right)
+            may = np.logical_and(may, op_may)
+            must = np.logical_and(must, op_must)
+            left = right
+        return may, must
+    raise Inconclusive()
+
+
+def _interval_compare(op, left, right) -> Tuple[Any, Any]:
+    (llo, lhi), (rlo, rhi) = left, right
+    if isinstance(op, (ast.Lt, ast.LtE)):
+        return llo < rhi + _INTERVAL_EPS, lhi < rlo - _INTERVAL_EPS
+    if isinstance(op, (ast.Gt, ast.GtE)):
+        return lhi > rlo - _INTERVAL_EPS, llo > rhi + _INTERVAL_EPS
+    if isinstance(op, ast.Eq):
+        return np.logical_and(llo < rhi + _INTERVAL_EPS, rlo < lhi + _INTERVAL_EPS), False
+    if isinstance(op, ast.NotEq):
+        return True, np.logical_or(lhi < rlo - _INTERVAL_EPS, rhi < llo - _INTERVAL_EPS)
+    raise Inconclusive()
+
+
+def interval_value(node, cont_vars) -> Tuple[Any, Any]:
+    """`(lower, upper)` bounds of an arithmetic expression over the boxes in `cont_vars`, which
+    maps variable names to `(lower, upper)` scalars or arrays. Raises `Inconclusive` if the
+    expression uses something interval arithmetic doesn't handle, or isn't bounded."""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise Inconclusive()
+        return node.value, node.value
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        name = _var_name(node)
+        if name not in cont_vars:
+            raise Inconclusive()
+        bounds = cont_vars[name]
+        if len(bounds) != 2:
+            raise Inconclusive()
+        return bounds[0], bounds[1]
+    if isinstance(node, ast.UnaryOp):
+        lo, hi = interval_value(node.operand, cont_vars)
+        if isinstance(node.op, ast.USub):
+            return -hi, -lo
+        if isinstance(node.op, ast.UAdd):
+            return lo, hi
+        raise Inconclusive()
+    if isinstance(node, ast.BinOp):
+        lo, hi = _interval_binop(node, cont_vars)
+        # inf - inf or 0 * inf, every comparison with NaN would rule the guard out
+        if np.any(np.isnan(lo)) or np.any(np.isnan(hi)):
+            raise Inconclusive()
+        return lo, hi
+    raise Inconclusive()
+
+
+def _interval_binop(node, cont_vars) -> Tuple[Any, Any]:
+    llo, lhi = interval_value(node.left, cont_vars)
+    if isinstance(node.op, ast.Pow):
+        if not isinstance(node.right, ast.Constant) or not isinstance(node.right.value, int):
+            raise Inconclusive()
+        return _interval_pow(llo, lhi, node.right.value)
+    rlo, rhi = interval_value(node.right, cont_vars)
+    with np.errstate(invalid="ignore"):
+        if isinstance(node.op, ast.Add):
+            return llo + rlo, lhi + rhi
+        if isinstance(node.op, ast.Sub):
+            return llo - rhi, lhi - rlo
+        if isinstance(node.op, ast.Mult):
+            products = [np.multiply(l, r) for l in (llo, lhi) for r in (rlo, rhi)]
+            return np.minimum.reduce(products), np.maximum.reduce(products)
+    if isinstance(node.op, ast.Div):
+        # The quotient is unbounded when the divisor interval contains 0
+        if np.any(np.logical_and(rlo <= 0, rhi >= 0)):
+            raise Inconclusive()
+        quotients = [np.divide(l, r) for l in (llo, lhi) for r in (rlo, rhi)]
+        return np.minimum.reduce(quotients), np.maximum.reduce(quotients)
+    raise Inconclusive()
+
+
+def _interval_pow(lo, hi, exp: int) -> Tuple[Any, Any]:
+    if exp < 0:
+        raise Inconclusive()
+    if exp == 0:
+        return 1, 1
+    if exp % 2 == 1:
+        return lo**exp, hi**exp
+    abs_lo, abs_hi = np.abs(lo), np.abs(hi)
+    upper = np.maximum(abs_lo, abs_hi) ** exp
+    lower = np.where(np.logical_and(lo <= 0, hi >= 0), 0, np.minimum(abs_lo, abs_hi) ** exp)
+    return lower, upper
+
+
+def _unrolled_len(iter_name: str, cont_vars) -> int:
+    """Number of agents `iter_name` ranges over, from the unrolled variables
+    `<iter_name>_<i>.<var>`"""
+    prefix = iter_name + "_"
+    idx = [
+        name[len(prefix) : name.index(".")]
+        for name in cont_vars
+        if name.startswith(prefix) and "." in name
+    ]
+    return len({i for i in idx if i.isdigit()})
+
+
+def _ast_key(node, cont_vars, lens: Dict[str, int]):
+    """Hashable key of an AST, equal for structurally equal ASTs. Reductions also depend on how
+    many agents they range over, which is added to the key and to `lens`."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return node.value.id, node.attr
+    if isinstance(node, list):
+        return tuple(_ast_key(n, cont_vars, lens) for n in node)
+    if not isinstance(node, ast.AST):
+        return node
+    key = (type(node),) + tuple(
+        _ast_key(getattr(node, f, None), cont_vars, lens) for f in node._fields
+    )
+    if isinstance(node, Reduction) and isinstance(node.value, ast.Name):
+        lens[node.value.id] = _unrolled_len(node.value.id, cont_vars)
+        key += (lens[node.value.id],)
+    return key
+
+
+class _GuardKey:
+    """Guard ASTs hashed and compared by structure, to cache their compiled form."""
+
+    def __init__(self, ast_list, cont_vars):
+        self.ast_list = ast_list
+        self.lens = {}
+        self.key = _ast_key(ast_list, cont_vars, self.lens)
+        self.hash = hash(self.key)
+
+    def __hash__(self) -> int:
+        return self.hash
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, _GuardKey) and self.key == other.key
+
+
+class _Z3Compiler:
+    """Translates guard ASTs to z3 terms. Variables are looked up in a symbol table, so there's no
+    unparsing, renaming or `eval` involved. Constant conditions are folded away as in
+    `GuardExpressionAst.generate_z3_expression`. Reductions range over the unrolled variables
+    `<iter>_<i>.<var>` of the agents."""
+
+    _BIN_OPS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.Pow: operator.pow,
+    }
+    _CMP_OPS = {
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+    }
+
+    def __init__(self, lens: Dict[str, int]):
+        self.lens = lens  # Number of agents each reduction ranges over
+        self.symbols = {}  # Underscored z3 names to variable names
+        self.scope = {}  # Reduction targets to the agent they currently stand for
+
+    @staticmethod
+    def fold(op: ReductionType, vals):
+        """Combine conditions with and/or, dropping the constant ones"""
+        short = op == ReductionType.Any
+        res = []
+        for val in vals:
+            if isinstance(val, bool):
+                if val == short:
+                    return short
+                continue
+            res.append(val)
+        if len(res) == 0:
+            return not short
+        if len(res) == 1:
+            return res[0]
+        return Or(*res) if short else And(*res)
+
+    def unroll(self, node: Reduction):
+        if not isinstance(node.value, ast.Name):
+            raise _Unsupported()
+        for i in range(self.lens[node.value.id]):
+            self.scope[node.it] = f"{node.value.id}_{i}"
+            yield node.expr
+        self.scope.pop(node.it, None)
+
+    def cond(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+            return node.value
+        if isinstance(node, ast.BoolOp):
+            op = ReductionType.All if isinstance(node.op, ast.And) else ReductionType.Any
+            return self.fold(op, (self.cond(val) for val in node.values))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            val = self.cond(node.operand)
+            return (not val) if isinstance(val, bool) else Not(val)
+        if isinstance(node, ast.Compare):
+            vals = [self.value(node.left)] + [self.value(c) for c in node.comparators]
+            if not all(type(op) in self._CMP_OPS for op in node.ops):
+                raise _Unsupported()
+            return self.fold(
+                ReductionType.All,
+                [self._CMP_OPS[type(op)](l, r) for op, l, r in zip(node.ops, vals[:-1], vals[1:])],
+            )
+        if isinstance(node, Reduction) and node.op in (ReductionType.Any, ReductionType.All):
+            return self.fold(node.op, [self.cond(e) for e in self.unroll(node)])
+        raise _Unsupported()
+
+    def value(self, node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise _Unsupported()
+            return node.value
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+                name = f"{self.scope.get(node.value.id, node.value.id)}.{node.attr}"
+            elif isinstance(node, ast.Name):
+                name = node.id
+            else:
+                raise _Unsupported()
+            underscored = name.replace(".", "_")
+            self.symbols[underscored] = name
+            return _real(underscored)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            val = self.value(node.operand)
+            return -val if isinstance(node.op, ast.USub) else val
+        if isinstance(node, ast.BinOp) and type(node.op) in self._BIN_OPS:
+            return self._BIN_OPS[type(node.op)](self.value(node.left), self.value(node.right))
+        if isinstance(node, Reduction) and node.op in (
+            ReductionType.Sum,
+            ReductionType.Max,
+            ReductionType.Min,
+        ):
+            vals = [self.value(e) for e in self.unroll(node)]
+            if node.op == ReductionType.Sum:
+                return functools.reduce(operator.add, vals, 0)
+            if len(vals) == 0:
+                raise _Unsupported()
+            pick = operator.gt if node.op == ReductionType.Max else operator.lt
+            return functools.reduce(lambda a, b: If(pick(a, b), a, b), vals)
+        raise _Unsupported()
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_guard_ast(guard: _GuardKey):
+    """Compile the conjunction of the guard ASTs. Returns a bool if the guard doesn't depend on
+    the continuous variables, and None if it uses something the compiler doesn't handle."""
+    compiler = _Z3Compiler(guard.lens)
+    try:
+        expr = compiler.fold(ReductionType.All, [compiler.cond(node) for node in guard.ast_list])
+    except _Unsupported:
+        return None
+    if isinstance(expr, bool):
+        return expr
+    return CompiledGuard(expr, compiler.symbols)
+
+
 class LogicTreeNode:
     def __init__(self, data, child=[], val=None, mode_guard=None):
         self.data = data
@@ -19,7 +362,42 @@ class LogicTreeNode:
         self.mode_guard = mode_guard
 
 
-class NodeSubstituter(ast.NodeTransformer):
+class CopyOnWriteTransformer(ast.NodeTransformer):
+    """A NodeTransformer that leaves the visited tree untouched. Nodes on the path to a
+    replaced node are shallow copied, all other nodes are shared with the original tree, so
+    guard ASTs can be transformed without deep copying them first."""
+
+    def generic_visit(self, node):
+        changes = {}
+        for field, old_value in ast.iter_fields(node):
+            if isinstance(old_value, list):
+                new_values = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        value = self.visit(value)
+                        if value is None:
+                            continue
+                        elif not isinstance(value, ast.AST):
+                            new_values.extend(value)
+                            continue
+                    new_values.append(value)
+                if len(new_values) != len(old_value) or any(
+                    a is not b for a, b in zip(new_values, old_value)
+                ):
+                    changes[field] = new_values
+            elif isinstance(old_value, ast.AST):
+                new_node = self.visit(old_value)
+                if new_node is not old_value:
+                    changes[field] = new_node
+        if not changes:
+            return node
+        node = copy.copy(node)
+        for field, value in changes.items():
+            setattr(node, field, value)
+        return node
+
+
+class NodeSubstituter(CopyOnWriteTransformer):
     def __init__(self, old_node, new_node):
         super().__init__()
         self.old_node = old_node
@@ -27,14 +405,12 @@ class NodeSubstituter(ast.NodeTransformer):
 
     def visit_Reduction(self, node: Reduction) -> Any:
         if node == self.old_node:
-            self.generic_visit(node)
             return self.new_node
         else:
-            self.generic_visit(node)
-            return node
+            return self.generic_visit(node)
 
 
-class ValueSubstituter(ast.NodeTransformer):
+class ValueSubstituter(CopyOnWriteTransformer):
     def __init__(self, val: str, node):
         super().__init__()
         self.val = val
@@ -59,52 +435,66 @@ class ValueSubstituter(ast.NodeTransformer):
     def visit_Reduction(self, node: Reduction) -> Any:
         if node == self.node:
             if len(self.val) == 1:
-                self.generic_visit(node)
                 return self.val[0]
             elif node.op == ReductionType.Any:
-                self.generic_visit(node)
                 return ast.BoolOp(op=ast.Or(), values=self.val)
             elif node.op == ReductionType.All:
-                self.generic_visit(node)
                 return ast.BoolOp(op=ast.And(), values=self.val)
-        self.generic_visit(node)
-        return node
+        return self.generic_visit(node)
 
 
 class GuardExpressionAst:
+    """A guard made of the conjunction of `guard_list`. Evaluation never modifies the guard
+    ASTs: partially evaluated guards are new trees that share the unchanged nodes, so the
+    ASTs from the parser can be used without copying them."""
+
     def __init__(self, guard_list, guard_idx=0):
-        self.ast_list = copy.deepcopy(guard_list)
+        self.ast_list = list(guard_list)
         self.cont_variables = {}
         self.varDict = {}
         self.guard_idx = guard_idx
 
-    def _build_guard(self, guard_str, agent):
+    def __copy__(self) -> "GuardExpressionAst":
+        res = GuardExpressionAst(self.ast_list, self.guard_idx)
+        res.cont_variables = dict(self.cont_variables)
+        res.varDict = dict(self.varDict)
+        return res
+
+    def _build_guard(self, guard_str, agent) -> CompiledGuard:
         """
-        Build solver for current guard based on guard string
+        Build solver for current guard based on guard string. Guards are compiled once per
+        guard string and variable layout, and the result is shared.
 
         Args:
             guard_str (str): the guard string.
             For example:"And(v>=40-0.1*u, v-40+0.1*u<=0)"
 
         Returns:
-            A Z3 Solver obj that check for guard.
-            A symbol index dic obj that indicates the index
-            of variables that involved in the guard.
+            A CompiledGuard holding the z3 solvers for the guard and its negation, and a
+            symbol index dic obj that indicates the index of variables that involved in the
+            guard.
         """
-        cur_solver = Solver()
-        # This magic line here is because SymPy will evaluate == to be False
-        # Therefore we are not be able to get free symbols from it
-        # Thus we need to replace "==" to something else
+        return _compile_guard(guard_str, tuple(self.cont_variables.items()))
 
-        symbols_map = {v: k for k, v in self.cont_variables.items() if k in guard_str}
+    def _compile(self, agent, continuous_variable_dict):
+        """
+        Compile the guard to z3 straight from the ASTs. Compiled guards are cached by the
+        structure of the ASTs, so equal guards from different steps/nodes share their solvers.
+        Guards the compiler can't handle go through `generate_z3_expression` and `_build_guard`.
 
-        for vars in reversed(self.cont_variables):
-            guard_str = guard_str.replace(vars, self.cont_variables[vars])
-        # XXX `locals` should override `globals` right?
-        cur_solver.add(
-            eval(guard_str, globals(), self.varDict)
-        )  # TODO use an object instead of `eval` a string
-        return cur_solver, symbols_map
+        Returns:
+            A bool if the guard doesn't depend on the continuous variables, the CompiledGuard
+            otherwise.
+        """
+        guard = _compile_guard_ast(_GuardKey(self.ast_list, continuous_variable_dict))
+        if isinstance(guard, bool):
+            return guard
+        if guard != None and all(v in continuous_variable_dict for v in guard.symbols.values()):
+            return guard
+        z3_string = self.generate_z3_expression()
+        if isinstance(z3_string, bool):
+            return z3_string
+        return self._build_guard(z3_string, agent)
 
     def get_agent_dictionaries(self, symbols, continuous_variable_dict):
         #TODO this should be computed once and reused instead of recomputing
@@ -173,73 +563,88 @@ class GuardExpressionAst:
         return agent_vars
 
     def evaluate_guard_cont(self, agent, continuous_variable_dict, track_map, stars):
+        if not stars:
+            # Most boxes are clearly inside or outside of the guard, no need to call z3 for them
+            interval_res = self.evaluate_guard_interval(continuous_variable_dict)
+            if interval_res != None:
+                may, must = interval_res
+                if not may:
+                    return False, False
+                if must:
+                    return True, True
+        with _z3_lock:
+            return self._evaluate_guard_cont(agent, continuous_variable_dict, track_map, stars)
+
+    def evaluate_guard_interval(self, continuous_variable_dict) -> Optional[Tuple[Any, Any]]:
+        """
+        Evaluate the guard over boxes with interval arithmetic.
+
+        Args:
+            continuous_variable_dict: maps variable names to `(lower, upper)` bounds. Bounds
+            can be scalars or arrays of the same shape, to evaluate many boxes at once.
+
+        Returns:
+            `(may, must)`, where `may` is False when no point of the box satisfies the guard
+            and `must` is True when every point does. Both are arrays when the bounds are.
+            None if the guard uses something interval arithmetic doesn't handle.
+        """
+        try:
+            may, must = True, True
+            for node in self.ast_list:
+                node_may, node_must = interval_bool(node, continuous_variable_dict)
+                may = np.logical_and(may, node_may)
+                must = np.logical_and(must, node_must)
+            return may, must
+        except Inconclusive:
+            return None
+
+    def _evaluate_guard_cont(self, agent, continuous_variable_dict, track_map, stars):
         res = False
         is_contained = False
 
         for cont_vars in continuous_variable_dict:
             underscored = cont_vars.replace(".", "_")
             self.cont_variables[cont_vars] = underscored
-            self.varDict[underscored] = Real(underscored)
+            self.varDict[underscored] = _real(underscored)
+
+        guard = self._compile(agent, continuous_variable_dict)
+        if isinstance(guard, bool):
+            return guard, guard
+        symbols = guard.symbols
 
-        z3_string = self.generate_z3_expression()
-        if isinstance(z3_string, bool):
-            return z3_string, z3_string
-        
-        cur_solver, symbols = self._build_guard(z3_string, agent)
-        cur_solver.push()
-        
         if stars:
             agent_states, agent_vars = self.get_agent_dictionaries(symbols, continuous_variable_dict)
-            # print(agent_states)
-            # print(agent_vars)
-            for agent in agent_states.keys():
-                #print(agent)
-                agent_states[agent].add_constraints(cur_solver, agent_vars[agent], agent)
-            #construct the border of the hyperrectangle at a specific time
-            #hyperrectangle = reach(t)
-            #breakpoint()
-            for agent in agent_states.keys():
-                agent_states[agent].add_constraints(cur_solver, agent_vars[agent], agent)
-            #guard \cap hyperrectangle =/= empty set
-            # if false, then they are disjoint
-            #breakpoint()
-            if cur_solver.check() == sat: #checking intersection with guard
-                # The reachtube hits the guard
-                # remove hyperrectangle
-                cur_solver.pop()
-                res = True
 
-                tmp_solver = Solver()
-                #negation of guards
-                tmp_solver.add(Not(cur_solver.assertions()[0]))
-            
-            #KB todo faster way to add a second time without recomputing
+            def add_bounds(solver):
+                #construct the border of the hyperrectangle at a specific time
+                #hyperrectangle = reach(t)
                 for agent in agent_states.keys():
-                    agent_states[agent].add_constraints(tmp_solver, agent_vars[agent], agent)
-                #check if all starset in guard
-                if tmp_solver.check() == unsat:
-                    is_contained = True
-            #breakpoink()
-            #print(cur_solver)
-            return res, is_contained
+                    agent_states[agent].add_constraints(solver, agent_vars[agent], agent)
+
         else:
-            for symbol in symbols:
-                start, end = continuous_variable_dict[symbols[symbol]]
-                cur_solver.add(self.varDict[symbol] >= start, self.varDict[symbol] <= end)
-            if cur_solver.check() == sat:
-                # The reachtube hits the guard
-                cur_solver.pop()
-                res = True
 
-                tmp_solver = Solver()
-                tmp_solver.add(Not(cur_solver.assertions()[0]))
+            def add_bounds(solver):
                 for symbol in symbols:
                     start, end = continuous_variable_dict[symbols[symbol]]
-                    tmp_solver.add(self.varDict[symbol] >= start, self.varDict[symbol] <= end)
-                if tmp_solver.check() == unsat:
-                    is_contained = True
+                    solver.add(self.varDict[symbol] >= start, self.varDict[symbol] <= end)
 
-            return res, is_contained
+        guard.solver.push()
+        try:
+            add_bounds(guard.solver)
+            #guard \cap hyperrectangle =/= empty set
+            # if false, then they are disjoint
+            res = guard.solver.check() == sat
+        finally:
+            guard.solver.pop()
+        if res:
+            # The reachtube hits the guard, check if it's fully inside using the negation
+            guard.neg_solver.push()
+            try:
+                add_bounds(guard.neg_solver)
+                is_contained = guard.neg_solver.check() == unsat
+            finally:
+                guard.neg_solver.pop()
+        return res, is_contained
 
     def generate_z3_expression(self):
         """
@@ -375,8 +780,10 @@ class GuardExpressionAst:
         return res
 
     def _evaluate_guard_hybrid(self, root, agent, disc_var_dict, cont_var_dict, track_map: LaneMap, agent_vars):
+        # Nodes are shallow copied before their children are replaced, see `GuardExpressionAst`
         if isinstance(root, ast.Compare):
-            expr = unparse(root)
+            root = copy.copy(root)
+            root.comparators = list(root.comparators)
             left, root.left = self._evaluate_guard_hybrid(
                 root.left, agent, disc_var_dict, cont_var_dict, track_map, agent_vars
             )
@@ -386,6 +793,8 @@ class GuardExpressionAst:
             return True, root
         elif isinstance(root, ast.BoolOp):
             if isinstance(root.op, ast.And):
+                root = copy.copy(root)
+                root.values = list(root.values)
                 res = True
                 for i, val in enumerate(root.values):
                     tmp, root.values[i] = self._evaluate_guard_hybrid(
@@ -396,14 +805,17 @@ class GuardExpressionAst:
                         break
                 return res, root
             elif isinstance(root.op, ast.Or):
+                root = copy.copy(root)
+                root.values = list(root.values)
                 res = False
-                for val in root.values:
-                    tmp, val = self._evaluate_guard_hybrid(
+                for i, val in enumerate(root.values):
+                    tmp, root.values[i] = self._evaluate_guard_hybrid(
                         val, agent, disc_var_dict, cont_var_dict, track_map, agent_vars
                     )
                     res = res or tmp
                 return res, root
         elif isinstance(root, ast.BinOp):
+            root = copy.copy(root)
             left, root.left = self._evaluate_guard_hybrid(
                 root.left, agent, disc_var_dict, cont_var_dict, track_map, agent_vars
             )
@@ -571,6 +983,7 @@ class GuardExpressionAst:
         elif isinstance(root, ast.Name):
             return True, root
         elif isinstance(root, ast.UnaryOp):
+            root = copy.copy(root)
             if isinstance(root.op, ast.USub):
                 res, root.operand = self._evaluate_guard_hybrid(
                     root.operand, agent, disc_var_dict, cont_var_dict, track_map, agent_vars
@@ -733,7 +1146,8 @@ class GuardExpressionAst:
         The second element in the tuple will be the updated ast node
         """
         if isinstance(root, ast.Compare):
-            expr = unparse(root)
+            root = copy.copy(root)
+            root.comparators = list(root.comparators)
             left, root.left = self._evaluate_guard_disc(
                 root.left, agent, disc_var_dict, cont_var_dict, track_map
             )
@@ -762,6 +1176,8 @@ class GuardExpressionAst:
                 root = ast.parse("False").body[0].value
             return res, root
         elif isinstance(root, ast.BoolOp):
+            root = copy.copy(root)
+            root.values = list(root.values)
             if isinstance(root.op, ast.And):
                 res = True
                 for i, val in enumerate(root.values):
@@ -783,6 +1199,7 @@ class GuardExpressionAst:
                 return res, root
         elif isinstance(root, ast.BinOp):
             # Check left and right in the binop and replace all attributes involving discrete variables
+            root = copy.copy(root)
             left, root.left = self._evaluate_guard_disc(
                 root.left, agent, disc_var_dict, cont_var_dict, track_map
             )
@@ -791,6 +1208,7 @@ class GuardExpressionAst:
             )
             return True, root
         elif isinstance(root, ast.Call):
+            root = copy.copy(root)
             new_args_list = []
             for arg in root.args:
                 res, new_arg = self._evaluate_guard_disc(
@@ -865,6 +1283,7 @@ class GuardExpressionAst:
         elif isinstance(root, ast.Constant):
             return root.value, root
         elif isinstance(root, ast.UnaryOp):
+            root = copy.copy(root)
             if isinstance(root.op, ast.USub):
                 res, root.operand = self._evaluate_guard_disc(
                     root.operand, agent, disc_var_dict, cont_var_dict, track_map
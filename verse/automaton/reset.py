@@ -1,8 +1,60 @@
 import itertools, copy
+import ast
+import functools
+import warnings
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
 import numpy as np
 
+from verse.automaton.guard import Inconclusive, interval_value
 from verse.parser import unparse
 
+# Continuous resets over more variables than this are bounded with interval arithmetic when
+# possible, instead of evaluating all 2^k corners of the box, which are evaluated 2^_MAX_CORNER_VARS
+# at a time
+_MAX_CORNER_VARS = 12
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_reset(expr: str, cont_vars: Tuple[str, ...]) -> Tuple[Any, Tuple[str, ...], ast.expr]:
+    """Compile a continuous reset once. Every continuous variable used in it is replaced by
+    `_v[i]`, so it can be evaluated on the corners of a box in a single call where `_v` holds
+    one array per variable. Returns the code, the variables in the order of `i` and the AST."""
+    tree = ast.parse(expr, mode="eval").body
+    symbols = []
+
+    class SymbolSubstituter(ast.NodeTransformer):
+        def visit_symbol(self, node):
+            name = unparse(node)
+            if name not in cont_vars:
+                return self.generic_visit(node)
+            if name not in symbols:
+                symbols.append(name)
+            index = ast.Constant(symbols.index(name))
+            return ast.Subscript(ast.Name("_v", ctx=ast.Load()), index, ctx=ast.Load())
+
+        visit_Name = visit_symbol
+        visit_Attribute = visit_symbol
+
+    code = SymbolSubstituter().visit(copy.deepcopy(tree))
+    code = compile(ast.fix_missing_locations(ast.Expression(code)), "", "eval")
+    return code, tuple(symbols), tree
+
+
+def _eval_points(code, points: np.ndarray) -> np.ndarray:
+    """Values of a compiled reset at each row of `points`"""
+    try:
+        return np.broadcast_to(eval(code, {"_v": points.T}), (len(points),))
+    except Exception:
+        # Not array friendly, e.g. uses `min`
+        return np.array([eval(code, {"_v": point}) for point in points])
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_mode_reset(expr: str):
+    return compile(expr, "", "eval")
+
 
 class ResetExpression:
     def __init__(self, reset):
@@ -18,6 +70,51 @@ class ResetExpression:
             return False
         return self.var == o.var and self.expr == o.expr
 
+    def eval_cont_bounds(self, cont_var_dict: Dict[str, List[float]]) -> Tuple[float, float]:
+        """Bounds of a continuous reset over the box in `cont_var_dict`, from its values on every
+        corner of the box (exact for linear resets). When the reset uses too many variables, it
+        is bounded with interval arithmetic instead, and if that can't handle it either, the
+        corners are still all evaluated, with a warning."""
+        code, symbols, tree = _compile_reset(self.expr, tuple(cont_var_dict))
+        bounds = np.array([cont_var_dict[symbol] for symbol in symbols], dtype=float)
+        bounds = bounds.reshape(-1, 2)
+        if len(symbols) > _MAX_CORNER_VARS:
+            try:
+                lo, hi = interval_value(tree, cont_var_dict)
+                return float(lo), float(hi)
+            except Inconclusive:
+                warnings.warn(
+                    f"Evaluating the reset of {self.var} on all 2^{len(symbols)} corners of the box"
+                )
+        # Bit i of the index of a corner picks the bound of variable i
+        lo, hi = np.inf, -np.inf
+        count, step = 1 << len(symbols), 1 << _MAX_CORNER_VARS
+        for start in range(0, count, step):
+            idx = np.arange(start, min(start + step, count))
+            bits = (idx[:, None] >> np.arange(len(symbols))) & 1
+            res = _eval_points(code, bounds[np.arange(len(symbols)), bits])
+            lo, hi = min(lo, np.min(res)), max(hi, np.max(res))
+        return float(lo), float(hi)
+
+    def eval_point(self, var_values: Dict[str, float]) -> float:
+        """Value of a continuous reset at a single point."""
+        code, symbols, _ = _compile_reset(self.expr, tuple(var_values))
+        return eval(code, {"_v": [var_values[symbol] for symbol in symbols]})
+
+    def eval_mode(self, disc_var_dict: Dict[str, Any], track_map) -> List[str]:
+        """Possible values of a mode reset computed by the map, e.g.
+        `track_map.h(ego.track_mode, ego.agent_mode, 'Normal')`."""
+        packed = defaultdict(dict)
+        for var, val in disc_var_dict.items():
+            obj, attr = var.split(".", 1)
+            packed[obj][attr] = val
+        env: Dict[str, Any] = {obj: SimpleNamespace(**attrs) for obj, attrs in packed.items()}
+        env[self.expr.split(".")[0].strip(" ")] = track_map
+        res = eval(_compile_mode_reset(self.expr), env)
+        if not isinstance(res, list):
+            res = [res]
+        return res
+
 
 # class ResetExpression:
 #     def __init__(self, reset_list):
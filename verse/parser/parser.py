@@ -1,7 +1,8 @@
-import ast, copy, warnings
+import ast, copy, functools, warnings
 from typing import Callable, List, Dict, TypeVar, Union, Optional, Any, Tuple
 from dataclasses import dataclass, field, fields
 from enum import Enum, auto
+import numpy as np
 from verse.parser import astunparser
 
 T = TypeVar("T")
@@ -27,6 +28,97 @@ def compile_expr(e):
     return compile(ast.fix_missing_locations(ast.Expression(e)), "", "eval")
 
 
+def _vec_and(*args):
+    return functools.reduce(np.logical_and, args)
+
+
+def _vec_or(*args):
+    return functools.reduce(np.logical_or, args)
+
+
+def _vec_any(it):
+    return functools.reduce(np.logical_or, it, False)
+
+
+def _vec_all(it):
+    return functools.reduce(np.logical_and, it, True)
+
+
+VEC_ENV = {
+    "_vec_and": _vec_and,
+    "_vec_or": _vec_or,
+    "_vec_not": np.logical_not,
+    "_vec_any": _vec_any,
+    "_vec_all": _vec_all,
+}
+"""Helpers used by the expressions from `compile_vec_expr`, to be added to their environment"""
+
+
+class _Vectorizer:
+    """Rewrites a (simulation) boolean expression so that it evaluates element-wise when the
+    continuous variables are arrays. Sub-expressions that can't be vectorized (e.g. map calls)
+    are replaced by the constant that makes the result an over-approximation: `True` where
+    they appear positively and `False` under a `not`."""
+
+    _BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+    _REDUCTIONS = {"any": "_vec_any", "all": "_vec_all"}
+
+    def value_ok(self, e: ast.expr) -> bool:
+        if isinstance(e, (ast.Constant, ast.Name)):
+            return True
+        if isinstance(e, ast.Attribute):
+            return self.value_ok(e.value)
+        if isinstance(e, ast.BinOp):
+            return (
+                isinstance(e.op, self._BIN_OPS) and self.value_ok(e.left) and self.value_ok(e.right)
+            )
+        if isinstance(e, ast.UnaryOp):
+            return isinstance(e.op, (ast.USub, ast.UAdd)) and self.value_ok(e.operand)
+        return False
+
+    def cond(self, e: ast.expr, positive: bool) -> ast.expr:
+        if isinstance(e, ast.BoolOp):
+            fn = "_vec_and" if isinstance(e.op, ast.And) else "_vec_or"
+            return _call(fn, [self.cond(v, positive) for v in e.values])
+        if isinstance(e, ast.UnaryOp) and isinstance(e.op, ast.Not):
+            return _call("_vec_not", [self.cond(e.operand, not positive)])
+        if isinstance(e, ast.Compare) and all(self.value_ok(v) for v in [e.left] + e.comparators):
+            # Chained comparisons short-circuit, so split them into `and`ed pairs
+            lefts = [e.left] + e.comparators[:-1]
+            pairs = [ast.Compare(l, [op], [r]) for l, op, r in zip(lefts, e.ops, e.comparators)]
+            return pairs[0] if len(pairs) == 1 else _call("_vec_and", pairs)
+        if (
+            isinstance(e, ast.Call)
+            and isinstance(e.func, ast.Name)
+            and e.func.id in self._REDUCTIONS
+            and len(e.args) == 1
+            and isinstance(e.args[0], ast.GeneratorExp)
+            and len(e.args[0].generators) == 1
+            and len(e.args[0].generators[0].ifs) == 0
+            and self.value_ok(e.args[0].generators[0].iter)
+        ):
+            gen = e.args[0]
+            elt = self.cond(gen.elt, positive)
+            return _call(self._REDUCTIONS[e.func.id], [ast.GeneratorExp(elt, gen.generators)])
+        if self.value_ok(e):
+            return e
+        return ast.Constant(positive)
+
+
+def _call(name: str, args: List[ast.expr]) -> ast.Call:
+    return ast.Call(ast.Name(name, ctx=ast.Load()), args, [])
+
+
+def compile_vec_expr(e: ast.expr):
+    """Compile a simulation condition to be evaluated over whole traces, with `VEC_ENV` added to
+    the environment. The result is `True` wherever the condition holds, and possibly at other
+    points. Returns None if nothing in the condition can be vectorized"""
+    vec = _Vectorizer().cond(copy.deepcopy(e), True)
+    if isinstance(vec, ast.Constant) and vec.value == True:
+        return None
+    return compile_expr(vec)
+
+
 def unparse(e):
     return astunparser.unparse(e).strip("\n")
 
@@ -184,6 +276,7 @@ class CompiledAssert:
     cond: Any  # FIXME type for compiled python (`code`?)
     label: str
     pre: Any
+    hit_vec: Any = None  # Over-approximation of `pre and not cond` over whole traces
 
 
 @dataclass
@@ -302,6 +395,7 @@ class ModePath:
     var: str
     val: Any
     val_veri: ast.expr
+    cond_vec: Any = None  # Over-approximation of `cond` over whole traces, see `compile_vec_expr`
 
     def __eq__(self, other: "ModePath") -> bool:
         if other == None:
@@ -385,12 +479,13 @@ class ControllerIR:
         # for a in asserts_veri:
         #     # print(a)
         #     print(ControllerIR.dump(a.pre), ControllerIR.dump(a.cond, True))
-        asserts_sim = [
-            CompiledAssert(
-                compile_expr(Env.trans_args(c, False)), l, compile_expr(Env.trans_args(p, False))
+        asserts_sim = []
+        for c, l, p in asserts:
+            c, p = Env.trans_args(c, False), Env.trans_args(p, False)
+            hit = ast.BoolOp(ast.And(), [p, ast.UnaryOp(ast.Not(), c)])
+            asserts_sim.append(
+                CompiledAssert(compile_expr(c), l, compile_expr(p), compile_vec_expr(hit))
             )
-            for c, l, p in asserts
-        ]
 
         assert isinstance(controller, Lambda)
         paths = []
@@ -404,9 +499,11 @@ class ControllerIR:
                     cond = merge_conds(case.cond)
                     cond_veri = Env.trans_args(copy.deepcopy(cond), True)
                     val_veri = Env.trans_args(copy.deepcopy(case.val), True)
-                    cond = compile_expr(Env.trans_args(cond, False))
+                    cond = Env.trans_args(cond, False)
+                    cond_vec = compile_vec_expr(cond)
+                    cond = compile_expr(cond)
                     val = compile_expr(Env.trans_args(case.val, False))
-                    paths.append(ModePath(cond, cond_veri, var, val, val_veri))
+                    paths.append(ModePath(cond, cond_veri, var, val, val_veri, cond_vec))
         return ControllerIR(
             controller.args,
             paths,
@@ -1,4 +1,4 @@
-from typing import Tuple, List, Dict
+from typing import Any, Callable, Iterator, Tuple, List, Dict, Optional
 import copy
 from dataclasses import dataclass
 import numpy as np
@@ -6,6 +6,9 @@ import numpy as np
 from verse.agents.base_agent import BaseAgent
 from verse.analysis import Simulator, Verifier, AnalysisTreeNode, AnalysisTree, ReachabilityMethod
 from verse.analysis.analysis_tree import AnalysisTreeNodeType
+from verse.analysis.executor import ExecutionBackend
+from verse.analysis.incremental import EvictionPolicy
+from verse.analysis.scheduler import SearchStrategy
 from verse.utils.utils import sample_rect
 from verse.parser.parser import ControllerIR
 from verse.sensor.base_sensor import BaseSensor
@@ -14,14 +17,6 @@ from verse.map.lane_map import LaneMap
 EGO, OTHERS = "ego", "others"
 
 
-def _check_ray_init(parallel: bool) -> None:
-    if parallel:
-        import ray
-
-        if not ray.is_initialized():
-            ray.init()
-
-
 @dataclass()
 class ScenarioConfig:
     """Configuration for how simulation/verification is performed for a scenario. Properties are
@@ -40,13 +35,58 @@ class ScenarioConfig:
     parallel_ver_ahead: int = 8
     """The number of verification tasks to dispatch before waiting."""
     parallel: bool = True
-    """Enable parallelization. Uses the Ray library. Could be slower for small scenarios."""
+    """Enable parallelization. Uses the backend set by `backend`. Could be slower for small
+    scenarios."""
+    backend: ExecutionBackend = ExecutionBackend.RAY
+    """Where parallel tasks run: SERIAL, THREAD, PROCESS or RAY. Ray is only imported when it is
+    selected."""
+    max_workers: Optional[int] = None
+    """Number of workers for the thread and process pool backends. Defaults to the pool default."""
+    search_strategy: SearchStrategy = SearchStrategy.DEFAULT
+    """Order in which the nodes of the tree are explored: DEFAULT, BFS, DFS or EARLIEST_START."""
+    search_priority: Optional[Callable[[AnalysisTreeNode], Any]] = None
+    """Custom exploration order. Overrides `search_strategy` when set; nodes with the lowest
+    value are explored first."""
     try_local: bool = False
     """Heuristic. When enabled, try to use the local thread when some results are cached."""
     print_level: int = 1
     """Adjust print_level from 0 - 2 to print different information."""
     pca: bool = True
     """If true, uses the PCA algorithm to generate the starsets, otherwise, uses DryVR and rectangular overapproximations"""
+    chunk_ver_time: Optional[float] = None
+    """When set, reach tubes are first computed for this long and extended, doubling the horizon,
+    only until the branch has transitioned or hit an assert. Each extension starts from the last
+    box of the tube so far, so tubes can come out looser than unchunked ones. Silently not used
+    with incremental verification, or when the reachability parameters pass precomputed
+    `traces`."""
+    chunk_sim_time: Optional[float] = None
+    """When set, agents are simulated this long at a time and the branch stops at the first guard
+    or assert that fires. Each chunk restarts `TC_simulate` from the last sample of the previous
+    one, with time starting at 0 as after a transition, so dynamics that depend on time and the
+    error control of the integrator see a restart at every chunk. A guard crossing that falls
+    right on a sample can then move by a time step. Not used with incremental simulation."""
+    event_tol: Optional[float] = None
+    """When set, simulation locates each guard crossing to within this much time by bisecting
+    between samples, and the next segment starts from the crossing instead of the first sample
+    past it. This allows much larger time steps for the same transition accuracy. Not used with
+    incremental simulation."""
+    trace_dtype: type = np.float64
+    """Float type of the rectangular reach tubes stored in the tree. `np.float32` halves their
+    memory, at the cost of precision in the transitions and safety checks. Bounds are rounded
+    outward, so the stored boxes still contain the computed ones."""
+    cache_max_entries: Optional[int] = None
+    """Maximum number of entries kept in each of the incremental caches. Unbounded by default."""
+    cache_max_bytes: Optional[int] = None
+    """Maximum approximate size in bytes of each of the incremental caches. Unbounded by default."""
+    cache_policy: EvictionPolicy = EvictionPolicy.LRU
+    """Which entries are evicted from a full incremental cache: LRU or LFU. Evictions, hits and
+    misses are counted in the `cache_stats` of the simulator and verifier."""
+    tube_store: Optional[str] = None
+    """Path of an SQLite database to keep DryVR reach tubes in. Tubes are looked up there before
+    being computed, so they are shared by parallel workers and by later runs using the same file.
+    Tubes are keyed by the source of the agent class, the mode, the horizon, the time step, the map
+    and the static and uncertain parameters of the agent; other agent attributes aren't part of the
+    key, use separate files when they change."""
 
 
 class Scenario:
@@ -222,7 +262,9 @@ class Scenario:
             res_list.append(trace)
         return res_list
 
-    def simulate(self, time_horizon, time_step, max_height=None, seed=None) -> AnalysisTree:
+    def simulate(
+        self, time_horizon, time_step, max_height=None, seed=None, stop_on_first_violation=False
+    ) -> AnalysisTree:
         '''Computes a single simulation trace of a scenario, starting from a single initial state.
             Parameters:
 
@@ -230,12 +272,38 @@ class Scenario:
                 time_step (float): \delta, the sampling period for continuous evolution.
                 max_height (int): Maximum number of discrete transitions
                 seed (int): Seed for sampling initial state if a initial region is given.
+                stop_on_first_violation (bool): Stop as soon as an assert is hit. Outstanding
+                    tasks are cancelled and the tree is pruned to the counterexample, the branch
+                    from the root to the node that hit the assert.
 
             Result:
 
                 tree (AnalysisTree): Simulation tree contrining possibly multiple simulations   
         '''
-        _check_ray_init(self.config.parallel)
+        for _ in self.simulate_iter(
+            time_horizon, time_step, max_height, seed, stop_on_first_violation
+        ):
+            pass
+        return self.past_runs[-1]
+
+    def simulate_iter(
+        self,
+        time_horizon,
+        time_step,
+        max_height=None,
+        seed=None,
+        stop_on_first_violation=False,
+        release=False,
+    ) -> Iterator[Tuple[Optional[int], AnalysisTreeNode]]:
+        '''Same as `simulate`, but yields `(parent_id, node)` as soon as each node is finished,
+        with its trace and assert hits. The root has parent id None.
+            Parameters:
+
+                release (bool): Don't keep finished nodes in memory. Their `child` lists are left
+                    empty and the run isn't kept for incremental simulation.
+        '''
+        if release and self.config.incremental:
+            raise ValueError("release can't be used with incremental simulation")
         self._get_init_from_agent()
         self._check_init()
         root = AnalysisTreeNode.root_from_inits(
@@ -250,7 +318,7 @@ class Scenario:
             type=AnalysisTreeNodeType.SIM_TRACE,
             ndigits=10,
         )
-        tree = self.simulator.simulate(
+        yield from self.simulator.simulate_iter(
             root,
             self.sensor,
             time_horizon,
@@ -259,16 +327,17 @@ class Scenario:
             self.map,
             len(self.past_runs),
             self.past_runs,
+            stop_on_first_violation,
+            release,
         )
-        self.past_runs.append(tree)
-        return tree
+        if not release:
+            self.past_runs.append(self.simulator.simulation_tree)
 
     def simulate_multi(self, time_horizon, time_step, init_dict_list=None, max_height=None, seed=None):
         '''Computes multiple simulation traces of a scenario, starting from multiple initial states.
             `seed`: the random seed for sampling a point in the region specified by the initial
             conditions
         '''
-        _check_ray_init(self.config.parallel)
         self._get_init_from_agent()
         self._check_init()
         tree_list = []
@@ -337,9 +406,34 @@ class Scenario:
         self.past_runs.append(tree)
         return tree
 
-    def verify(self, time_horizon, time_step, max_height=None, params={}) -> AnalysisTree:
-        '''Compute the set of reachable states, starting from a set of initial states states.'''
-        _check_ray_init(self.config.parallel)
+    def verify(
+        self, time_horizon, time_step, max_height=None, params={}, stop_on_first_violation=False
+    ) -> AnalysisTree:
+        '''Compute the set of reachable states, starting from a set of initial states states.
+        With `stop_on_first_violation`, return as soon as an assert is hit. Outstanding tasks are
+        cancelled and the tree is pruned to the counterexample, the branch from the root to the
+        node that hit the assert.'''
+        for _ in self.verify_iter(
+            time_horizon, time_step, max_height, params, stop_on_first_violation
+        ):
+            pass
+        return self.past_runs[-1]
+
+    def verify_iter(
+        self,
+        time_horizon,
+        time_step,
+        max_height=None,
+        params={},
+        stop_on_first_violation=False,
+        release=False,
+    ) -> Iterator[Tuple[Optional[int], AnalysisTreeNode]]:
+        '''Same as `verify`, but yields `(parent_id, node)` as soon as each node is finished,
+        with its reach tubes and assert hits. The root has parent id None. With `release`,
+        finished nodes aren't kept in memory, their `child` lists are left empty and the run isn't
+        kept for incremental verification.'''
+        if release and self.config.incremental:
+            raise ValueError("release can't be used with incremental verification")
         self._check_init()
         root = AnalysisTreeNode.root_from_inits(
             init={
@@ -358,7 +452,7 @@ class Scenario:
             ndigits=10,
         )
 
-        tree = self.verifier.compute_full_reachtube(
+        yield from self.verifier.compute_full_reachtube_iter(
             root,
             self.sensor,
             time_horizon,
@@ -370,9 +464,11 @@ class Scenario:
             len(self.past_runs),
             self.past_runs,
             params,
+            stop_on_first_violation,
+            release,
         )
-        self.past_runs.append(tree)
-        return tree
+        if not release:
+            self.past_runs.append(self.verifier.reachtube_tree)
 
 
 @dataclass
@@ -407,7 +503,6 @@ class ExprConfig:
         print("sim", self.sim)
 
 
-from pympler import asizeof
 import timeit
 
 
@@ -421,6 +516,7 @@ class Benchmark:
     run_time: float
     cache_size: float
     cache_hits: Tuple[int, int]
+    cache_evictions: int
     leaves: int
     _start_time: float
     parallelness: float
@@ -450,12 +546,12 @@ class Benchmark:
             self.traces = f(*a, **kw)
         self.run_time = timeit.default_timer() - self._start_time
         if self.config.sim:
-            self.cache_size = asizeof.asizeof(self.scenario.simulator.cache) / 1_000_000
+            self.cache_size = self.scenario.simulator.cache.stats.nbytes / 1_000_000
             self.cache_hits = self.scenario.simulator.cache_hits
         else:
             self.cache_size = (
-                asizeof.asizeof(self.scenario.verifier.cache)
-                + asizeof.asizeof(self.scenario.verifier.trans_cache)
+                self.scenario.verifier.cache.stats.nbytes
+                + self.scenario.verifier.trans_cache.stats.nbytes
             ) / 1_000_000
             self.cache_hits = (
                 self.scenario.verifier.tube_cache_hits[0]
@@ -463,13 +559,15 @@ class Benchmark:
                 self.scenario.verifier.tube_cache_hits[1]
                 + self.scenario.verifier.trans_cache_hits[1],
             )
+        engine = self.scenario.simulator if self.config.sim else self.scenario.verifier
+        self.cache_evictions = sum(s.evictions for s in engine.cache_stats().values())
         self.num_agent = len(self.scenario.agent_dict)
         self.map_name = self.scenario.map.__class__.__name__
         if self.map_name == "LaneMap":
             self.map_name = "N/A"
         self.num_nodes = len(self.traces.nodes)
         self.leaves = self.traces.leaves()
-        if self.config.config.parallel:
+        if self.config.config.parallel and self.config.config.backend == ExecutionBackend.RAY:
             import ray
 
             parallel_time = (
@@ -516,11 +614,12 @@ class Benchmark:
         print("#leaves:", self.leaves)
         print(f"run time: {self.run_time:.2f}s")
         print(f"timesteps: {self.timesteps}s")
-        if self.config.config.parallel:
+        if self.config.config.parallel and self.config.config.backend == ExecutionBackend.RAY:
             print(f"parallelness: {self.parallelness:.2f}")
         if self.config.config.incremental:
             print(f"cache size: {self.cache_size:.2f}MB")
             print(f"cache hit: {(self.cache_hits[0], self.cache_hits[1])}")
+            print(f"cache evictions: {self.cache_evictions}")
             print(
                 f"cache hit rate: {self.cache_hits[0] / (self.cache_hits[0] + self.cache_hits[1]) * 100:.2f}%"
             )
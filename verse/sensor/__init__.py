@@ -1,2 +1,3 @@
 from . import base_sensor
 from .base_sensor import BaseSensor
+from .proximity_sensor import ProximitySensor
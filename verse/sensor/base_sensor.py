@@ -2,135 +2,106 @@ import numpy as np
 from verse.agents.base_agent import BaseAgent
 
 
-def sets(d, thing, attrs, vals):
-    d.update({thing + "." + k: v for k, v in zip(attrs, vals)})
-
-
-def adds(d, thing, attrs, vals):
-    for k, v in zip(attrs, vals):
-        if thing + "." + k not in d:
-            d[thing + "." + k] = [v]
-        else:
-            d[thing + "." + k].append(v)
-
-
-def set_states_2d(cnts, disc, thing, val, cont_var, disc_var, stat_var):
-    state, mode, static = val
-    sets(cnts, thing, cont_var, state[1:])
-    sets(disc, thing, disc_var, mode)
-    sets(disc, thing, stat_var, static)
-
-
-def set_states_3d(cnts, disc, thing, val, cont_var, disc_var, stat_var):
-    state, mode, static = val
-    print(state)
-    transp = np.transpose(np.array(state)[:, 1:])
-    # assert len(transp) == 4
-    sets(cnts, thing, cont_var, transp)
-    sets(disc, thing, disc_var, mode)
-    sets(disc, thing, stat_var, static)
-
-
-def add_states_2d(cont, disc, thing, val, cont_var, disc_var, stat_var):
-    state, mode, static = val
-    adds(cont, thing, cont_var, state[1:])
-    adds(disc, thing, disc_var, mode)
-    adds(disc, thing, stat_var, static)
-
-
-def add_states_3d(cont, disc, thing, val, cont_var, disc_var, stat_var):
-    state, mode, static = val
-    transp = np.transpose(np.array(state)[:, 1:])
-    # assert len(transp) == 4
-    adds(cont, thing, cont_var, transp)
-    adds(disc, thing, disc_var, mode)
-    adds(disc, thing, stat_var, static)
+class SensorPlan:
+    """Precomputed `thing.var` keys for sensing, so that sensing doesn't search the controller
+    arguments or build key strings on every call. `ego` and `other` are `(cont, disc, static)`
+    triples of keys, or None when the controller has no such argument."""
+
+    def __init__(self, ego, other_name, other):
+        self.ego = ego
+        self.other_name = other_name
+        self.other = other
+
+    @staticmethod
+    def keys(thing, cont_var, disc_var, stat_var):
+        return tuple([thing + "." + k for k in attrs] for attrs in (cont_var, disc_var, stat_var))
+
+    @staticmethod
+    def from_controller(decision_logic) -> "SensorPlan":
+        ego = other = other_name = None
+        for arg in decision_logic.args:
+            if arg.name == "ego":
+                if ego is None:
+                    state_def = decision_logic.state_defs[arg.typ]
+                    ego = SensorPlan.keys("ego", state_def.cont, state_def.disc, state_def.static)
+            elif "map" not in arg.name and other is None:
+                state_def = decision_logic.state_defs[arg.typ]
+                other_name = arg.name
+                other = SensorPlan.keys(arg.name, state_def.cont, state_def.disc, state_def.static)
+        return SensorPlan(ego, other_name, other)
+
+    def sense(self, agent_id, state_dict, simulate=True, stack_others=True):
+        """Fill the `cont`/`disc` dicts like `BaseSensor.sense`. In verification, continuous
+        values are `[lower, upper]` pairs. With `stack_others=False`, a single other agent is
+        sensed and its values aren't put in lists."""
+        cont = {}
+        disc = {}
+        len_dict = {"others": len(state_dict) - 1}
+        for aid, (state, mode, static) in state_dict.items():
+            keys = self.ego if aid == agent_id else self.other
+            if keys is None:
+                continue
+            cont_keys, disc_keys, stat_keys = keys
+            vals = state[1:] if simulate else np.transpose(np.array(state)[:, 1:])
+            if aid == agent_id or not stack_others:
+                cont.update(zip(cont_keys, vals))
+                disc.update(zip(disc_keys, mode))
+                disc.update(zip(stat_keys, static))
+            else:
+                for d, ks, vs in (
+                    (cont, cont_keys, vals),
+                    (disc, disc_keys, mode),
+                    (disc, stat_keys, static),
+                ):
+                    for k, v in zip(ks, vs):
+                        if k in d:
+                            d[k].append(v)
+                        else:
+                            d[k] = [v]
+        return cont, disc, len_dict
 
 
-# TODO-PARSER: Update base sensor
+def get_sensor_plan(agent: BaseAgent) -> SensorPlan:
+    """The sensing plan for the controller of an agent, built once per controller."""
+    decision_logic = agent.decision_logic
+    plan = getattr(decision_logic, "_sensor_plan", None)
+    if plan is None:
+        plan = SensorPlan.from_controller(decision_logic)
+        decision_logic._sensor_plan = plan
+    return plan
 
 
 class BaseSensor:
     # The baseline sensor is omniscient. Each agent can get the state of all other agents
     def sense(self, agent: BaseAgent, state_dict, lane_map, simulate = True):
-        cont = {}
-        disc = {}
-        len_dict = {"others": len(state_dict) - 1}
-        tmp = np.array(list(state_dict.values())[0][0])
-        if simulate:
-            for agent_id in state_dict:
-                if agent_id == agent.id:
-                    # Get type of ego
-                    controller_args = agent.decision_logic.args
-                    arg_type = None
-                    for arg in controller_args:
-                        if arg.name == "ego":
-                            arg_type = arg.typ
-                            break
-                    if arg_type is None:
-                        continue
-                        raise ValueError(f"Invalid arg for ego")
-                    cont_var = agent.decision_logic.state_defs[arg_type].cont
-                    disc_var = agent.decision_logic.state_defs[arg_type].disc
-                    stat_var = agent.decision_logic.state_defs[arg_type].static
-                    set_states_2d(
-                        cont, disc, "ego", state_dict[agent_id], cont_var, disc_var, stat_var
-                    )
-                else:
-                    controller_args = agent.decision_logic.args
-                    arg_type = None
-                    arg_name = None
-                    for arg in controller_args:
-                        if arg.name != "ego" and "map" not in arg.name:
-                            arg_name = arg.name
-                            arg_type = arg.typ
-                            break
-                    if arg_type is None:
-                        continue
-                        raise ValueError(f"Invalid arg for others")
-                    cont_var = agent.decision_logic.state_defs[arg_type].cont
-                    disc_var = agent.decision_logic.state_defs[arg_type].disc
-                    stat_var = agent.decision_logic.state_defs[arg_type].static
-                    add_states_2d(
-                        cont, disc, arg_name, state_dict[agent_id], cont_var, disc_var, stat_var
-                    )
-
-        else:
-            for agent_id in state_dict:
-                if agent_id == agent.id:
-                    # Get type of ego
-                    controller_args = agent.decision_logic.args
-                    arg_type = None
-                    for arg in controller_args:
-                        if arg.name == "ego":
-                            arg_type = arg.typ
-                            break
-                    if arg_type is None:
-                        continue
-                        raise ValueError(f"Invalid arg for ego")
-                    cont_var = agent.decision_logic.state_defs[arg_type].cont
-                    disc_var = agent.decision_logic.state_defs[arg_type].disc
-                    stat_var = agent.decision_logic.state_defs[arg_type].static
-                    set_states_3d(
-                        cont, disc, "ego", state_dict[agent_id], cont_var, disc_var, stat_var
-                    )
-                else:
-                    controller_args = agent.decision_logic.args
-                    arg_type = None
-                    arg_name = None
-                    for arg in controller_args:
-                        if arg.name != "ego" and "map" not in arg.name:
-                            arg_name = arg.name
-                            arg_type = arg.typ
-                            break
-                    if arg_type is None:
-                        continue
-                        raise ValueError(f"Invalid arg for others")
-                    cont_var = agent.decision_logic.state_defs[arg_type].cont
-                    disc_var = agent.decision_logic.state_defs[arg_type].disc
-                    stat_var = agent.decision_logic.state_defs[arg_type].static
-                    add_states_3d(
-                        cont, disc, arg_name, state_dict[agent_id], cont_var, disc_var, stat_var
-                    )
-
-        return cont, disc, len_dict
+        return get_sensor_plan(agent).sense(agent.id, state_dict, simulate)
+
+    def for_node(self, node) -> "BaseSensor":
+        """The sensor to verify `node` with. Guards over the other agents are unrolled once per
+        node, so a sensor that picks which agents are sensed must keep them for all its steps."""
+        return self
+
+    def sense_tube(self, agent: BaseAgent, tube_dict, lane_map):
+        """Sense a whole rectangular reach tube at once. `tube_dict` maps agent ids to
+        `(tube, mode, static)`, where `tube` has shape (T, 2, n+1). The bounds of each continuous
+        variable are arrays of length T instead of floats."""
+        state_dict = {}
+        for agent_id, (tube, mode, static) in tube_dict.items():
+            # Box of per-step bound arrays, laid out like a single (2, n+1) box
+            state = np.empty(tube.shape[1:], dtype=object)
+            for idx in np.ndindex(state.shape):
+                state[idx] = tube[(slice(None),) + idx]
+            state_dict[agent_id] = (state, mode, static)
+        return BaseSensor.sense(self, agent, state_dict, lane_map, False)
+
+    def sense_trace(self, agent: BaseAgent, trace_dict, lane_map):
+        """Sense a whole simulation trace at once. `trace_dict` maps agent ids to
+        `(trace, mode, static)`, where `trace` has shape (T, n+1). Each continuous variable is an
+        array of length T instead of a float."""
+        state_dict = {}
+        for agent_id, (trace, mode, static) in trace_dict.items():
+            state = np.empty(trace.shape[1], dtype=object)
+            for i in range(trace.shape[1]):
+                state[i] = trace[:, i]
+            state_dict[agent_id] = (state, mode, static)
+        return BaseSensor.sense(self, agent, state_dict, lane_map)
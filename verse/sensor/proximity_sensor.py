@@ -0,0 +1,105 @@
+import copy
+from typing import Dict, Optional, Sequence, Set
+
+import numpy as np
+
+from verse.agents.base_agent import BaseAgent
+from verse.sensor.base_sensor import BaseSensor, get_sensor_plan
+from verse.sensor.base_sensor_stars import BaseStarSensor
+from verse.stars.starset import StarSet
+
+
+def _is_star(state) -> bool:
+    return len(state) > 1 and isinstance(state[1], StarSet)
+
+
+class ProximitySensor(BaseSensor):
+    """Like the base sensor, but each agent only senses the other agents whose position box is
+    within `radius` of its own, per coordinate. Guards that range over the others (`any`/`all`)
+    then only grow with the number of nearby agents, instead of with the size of the scenario.
+
+    In verification, guards are unrolled once per node, so the verifier senses through
+    `for_node`: each agent senses the agents that come within range anywhere in the node's reach
+    tube, at every step of it. Star sets are sensed like `BaseStarSensor` does, with their
+    bounding boxes as positions.
+
+    Args:
+        radius: sensing range along each of `pos_vars`
+        pos_vars: names of the continuous variables that make up the position of an agent, for
+            both the ego and the others
+    """
+
+    def __init__(self, radius: float, pos_vars: Sequence[str] = ("x", "y")):
+        self.radius = radius
+        self.pos_vars = tuple(pos_vars)
+        self.sensed: Optional[Dict[str, Set[str]]] = None
+        """Agents sensed by each agent, fixed by `for_node`"""
+
+    def _pos_idx(self, thing: str, cont_keys):
+        try:
+            return [cont_keys.index(f"{thing}.{var}") + 1 for var in self.pos_vars]
+        except ValueError:
+            raise ValueError(f"{thing} doesn't have all position variables {self.pos_vars}")
+
+    @staticmethod
+    def _box(state, idx):
+        # (2, d) array of the lower and upper position
+        if _is_star(state):
+            return np.array([state[1].get_max_min(i - 1) for i in idx], dtype=float).T
+        return np.atleast_2d(np.asarray(state, dtype=float))[[0, -1]][:, idx]
+
+    @staticmethod
+    def _hull(trace, idx):
+        # Position box over a whole reach tube
+        if len(trace) > 0 and _is_star(trace[0]):
+            boxes = np.stack([ProximitySensor._box(state, idx) for state in trace])
+        else:
+            tube = np.asarray(trace, dtype=float)
+            boxes = tube.reshape(-1, 2, tube.shape[-1])[:, :, idx]
+        return np.stack([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])
+
+    def _near(self, agent: BaseAgent, others, bounds) -> Set[str]:
+        """The ids in `others` within range of `agent`, where `bounds(aid, idx)` is the position
+        box of an agent"""
+        if len(others) == 0:
+            return set()
+        plan = get_sensor_plan(agent)
+        ego = bounds(agent.id, self._pos_idx("ego", plan.ego[0]))
+        other_idx = self._pos_idx(plan.other_name, plan.other[0])
+        boxes = np.stack([bounds(aid, other_idx) for aid in others])
+        near = np.all(
+            (boxes[:, 0] <= ego[1] + self.radius) & (boxes[:, 1] >= ego[0] - self.radius), axis=1
+        )
+        return {aid for aid, n in zip(others, near) if n}
+
+    def for_node(self, node) -> "ProximitySensor":
+        sensor = copy.copy(self)
+        sensor.sensed = {}
+        for agent_id, agent in node.agent.items():
+            if len(agent.decision_logic.args) == 0:
+                continue
+            plan = get_sensor_plan(agent)
+            if plan.ego is None or plan.other is None:
+                continue
+            others = [aid for aid in node.agent if aid != agent_id]
+            sensor.sensed[agent_id] = self._near(
+                agent, others, lambda aid, idx: self._hull(node.trace[aid], idx)
+            )
+        return sensor
+
+    def sense(self, agent: BaseAgent, state_dict, lane_map, simulate=True):
+        plan = get_sensor_plan(agent)
+        if plan.ego is not None and plan.other is not None and agent.id in state_dict:
+            if self.sensed is not None and agent.id in self.sensed:
+                near = self.sensed[agent.id]
+            else:
+                others = [aid for aid in state_dict if aid != agent.id]
+                near = self._near(
+                    agent, others, lambda aid, idx: self._box(state_dict[aid][0], idx)
+                )
+            state_dict = {
+                aid: val for aid, val in state_dict.items() if aid == agent.id or aid in near
+            }
+        if not simulate and _is_star(next(iter(state_dict.values()))[0]):
+            return BaseStarSensor().sense(agent, state_dict, lane_map, simulate)
+        return plan.sense(agent.id, state_dict, simulate)
@@ -154,7 +154,19 @@ class StarSet:
     '''
     TO-DO: see if I can toggle which alg to use (DryVR, mine) based on some parameter, see if a new scenarioconfig can be added without much fuss
     '''
-    def calc_reach_tube(self, mode_label,time_horizon,time_step,sim_func,bloating_method,kvalue,sim_trace_num,lane_map,pca):
+    def calc_reach_tube(
+        self,
+        mode_label,
+        time_horizon,
+        time_step,
+        sim_func,
+        bloating_method,
+        kvalue,
+        sim_trace_num,
+        lane_map,
+        pca,
+        sim_batch_func=None,
+    ):
         #get rectangle
 
         if not pca:
@@ -169,7 +181,8 @@ class StarSet:
                 bloating_method,
                 kvalue,
                 sim_trace_num,
-                lane_map=lane_map
+                lane_map=lane_map,
+                sim_batch_func=sim_batch_func
             )
             #transform back into star
             star_tube = []
@@ -202,7 +215,14 @@ class StarSet:
             return star_tube
         
         else:
-            reach = gen_starsets_post_sim(self, sim_func, time_horizon, time_step, mode_label=mode_label)
+            reach = gen_starsets_post_sim(
+                self,
+                sim_func,
+                time_horizon,
+                time_step,
+                mode_label=mode_label,
+                sim_batch=sim_batch_func,
+            )
             star_tube = []
             for i in range(len(reach)):
                 star_tube.append([i*time_step, reach[i]])
@@ -705,10 +725,24 @@ def gen_starset(points: np.ndarray, old_star: StarSet) -> StarSet:
     return post_cont_pca(old_star, derived_basis, points)
 
 ### doing post_computations using simulation then constructing star sets around each set of points afterwards -- not iterative
-def gen_starsets_post_sim(old_star: StarSet, sim: Callable, T: float = 7, ts: float = 0.05, N: int = 100, no_init: bool = False, mode_label: int = None) -> List[StarSet]:
+def gen_starsets_post_sim(
+    old_star: StarSet,
+    sim: Callable,
+    T: float = 7,
+    ts: float = 0.05,
+    N: int = 100,
+    no_init: bool = False,
+    mode_label: int = None,
+    sim_batch: Callable = None,
+) -> List[StarSet]:
     points = np.array(sample_star(old_star, N))
     post_points = []
-    if no_init: 
+    if sim_batch is not None:
+        # all sampled points simulated in one call, see BaseAgent.TC_simulate_batch
+        post_points = np.asarray(sim_batch(mode_label, points, T, ts))
+        if no_init:
+            post_points = post_points[:, 1:]
+    elif no_init: 
         for point in points:
             post_points.append(sim(mode=mode_label, initialCondition=point, time_bound=T, time_step=ts).tolist()[1:])
     else: